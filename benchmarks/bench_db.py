@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Write throughput of CryptDB on a big synthetic project, one commit per row against the batch API, and
+fetching a huge project as slotted Line objects against the old dictionary per row
+
+    python benchmarks/bench_db.py [--lines 100000] [--sample 2000] [--batch 500] [--fetch 500000]
+"""
+
+import os
+import sys
+import argparse
+import logging
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from db_util import CryptDB
+
+logging.basicConfig(level=logging.ERROR)
+
+
+def synthetic_project(backend: CryptDB, num_lines: int) -> int:
+    project_id = backend.create_project(given_name="Benchmark", file_path="bench.wav", status=1)
+    backend.create_bulk_line(project_id, [
+        {"start_ms": i * 1500, "stop_ms": i * 1500 + 1200, "speaker_id": f"SPEAKER_{i % 5:02d}"}
+        for i in range(num_lines)
+    ])
+    return project_id
+
+
+def bench_per_row(backend: CryptDB, uids: list) -> float:
+    start = time.perf_counter()
+    for uid in uids:
+        backend.update_line(uid, content=f"per row {uid}", language="de")
+    return len(uids) / (time.perf_counter() - start)
+
+
+def bench_batched(backend: CryptDB, uids: list, size: int) -> float:
+    start = time.perf_counter()
+    with backend.batch(size):
+        for uid in uids:
+            backend.update_line(uid, content=f"batched {uid}", language="de")
+    return len(uids) / (time.perf_counter() - start)
+
+
+def fetch_as_dicts(backend: CryptDB, project_id: int, limit: int) -> list:
+    """The way CryptDB did it before the DTOs"""
+    cursor = backend.db.cursor()
+    cursor.execute("SELECT * FROM line WHERE project_id = ? ORDER BY start_ms, uid LIMIT ?", (project_id, limit))
+    return [{key: row[key] for key in row.keys()} for row in cursor.fetchall()]
+
+
+def fetch_as_dto(backend: CryptDB, project_id: int, limit: int) -> list:
+    return backend.fetch_project_lines(project_id, limit)
+
+
+def bench_fetch(fetcher, backend: CryptDB, project_id: int, limit: int) -> tuple:
+    """
+    :return: (rows per second, peak memory in MiB), both measured in separate runs as tracemalloc is slow
+    """
+    start = time.perf_counter()
+    rows = fetcher(backend, project_id, limit)
+    speed = len(rows) / (time.perf_counter() - start)
+    del rows
+    tracemalloc.start()
+    rows = fetcher(backend, project_id, limit)
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    del rows
+    return speed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CryptDB write throughput")
+    parser.add_argument("--lines", type=int, default=100000, help="lines in the synthetic project")
+    parser.add_argument("--sample", type=int, default=2000,
+                        help="lines updated one by one, all of them would take ages, which is kind of the point")
+    parser.add_argument("--batch", type=int, default=500, help="batch size for the batch API")
+    parser.add_argument("--fetch", type=int, default=500000, help="lines in the project for the fetch comparison")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        backend = CryptDB(os.path.join(work_dir, "bench.db"))
+        project_id = synthetic_project(backend, args.lines)
+        uids = [row['uid'] for row in backend.fetch_project_lines(project_id, args.lines)]
+        per_row = bench_per_row(backend, uids[:args.sample])
+        batched = bench_batched(backend, uids, args.batch)
+        del uids
+        big_project = synthetic_project(backend, args.fetch)
+        dict_speed, dict_peak = bench_fetch(fetch_as_dicts, backend, big_project, args.fetch)
+        dto_speed, dto_peak = bench_fetch(fetch_as_dto, backend, big_project, args.fetch)
+        backend.close()
+    print(f"update_line, one commit per row: {per_row:>10.0f} rows/s ({args.sample} rows)")
+    print(f"update_line inside batch({args.batch}): {batched:>10.0f} rows/s ({args.lines} rows)")
+    print(f"speedup: {batched / per_row:.1f}x")
+    print(f"fetch {args.fetch} lines as dict per row: {dict_speed:>10.0f} rows/s, peak {dict_peak:.0f} MiB")
+    print(f"fetch {args.fetch} lines as Line DTO:     {dto_speed:>10.0f} rows/s, peak {dto_peak:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
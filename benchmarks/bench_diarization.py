@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+
+"""
+Turning diarization output into segments, straight from the tracks of an annotation and with the compiled
+parser for old text dumps, at growing sizes. Time per segment should stay flat if both are linear
+
+    python benchmarks/bench_diarization.py [--segments 200000] [--steps 4]
+
+Without pyannote.core installed the annotation is a minimal stand-in that only has itertracks, which is
+all annotation2dict uses, so this measures our side of the conversion and not pyannote's.
+"""
+
+import os
+import sys
+import argparse
+import logging
+import random
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import util
+
+logging.basicConfig(level=logging.ERROR)
+
+Segment = namedtuple("Segment", ("start", "end"))
+
+
+class StandInAnnotation:
+    def __init__(self, tracks: list):
+        self.tracks = tracks
+
+    def itertracks(self, yield_label=False):
+        for segment, track, label in self.tracks:
+            yield (segment, track, label) if yield_label else (segment, track)
+
+
+def synthetic_tracks(num_segments: int, seed=42) -> list:
+    rng = random.Random(seed)
+    tracks = []
+    start = 0.0
+    for i in range(num_segments):
+        start += rng.uniform(0.05, 2.0)
+        tracks.append((Segment(start, start + rng.uniform(0.2, 8.0)), chr(65 + i % 26), f"SPEAKER_{rng.randrange(5):02d}"))
+    return tracks
+
+
+def build_annotation(tracks: list):
+    try:
+        from pyannote.core import Annotation, Segment as PySegment
+    except ImportError:
+        return StandInAnnotation(tracks)
+    annotation = Annotation()
+    for segment, track, label in tracks:
+        annotation[PySegment(segment.start, segment.end), track] = label
+    return annotation
+
+
+def as_text(tracks: list) -> str:
+    """Same format str(Annotation) has, with some noise in between that the old parser choked on"""
+    def stamp(seconds: float) -> str:
+        hours, rest = divmod(seconds, 3600)
+        minutes, rest = divmod(rest, 60)
+        return f"{int(hours):02d}:{int(minutes):02d}:{rest:06.3f}"
+    lines = []
+    for i, (segment, track, label) in enumerate(tracks):
+        lines.append(f"[ {stamp(segment.start)} -->  {stamp(segment.end)}] {track} {label}")
+        if i % 1000 == 0:
+            lines.append("")
+    return "\n".join(lines)
+
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="diarization output conversion")
+    parser.add_argument("--segments", type=int, default=200000, help="segments at the biggest size")
+    parser.add_argument("--steps", type=int, default=4, help="number of sizes up to --segments")
+    args = parser.parse_args()
+
+    all_tracks = synthetic_tracks(args.segments)
+    print(f"{'segments':>10} | {'annotation':>14} | {'text parser':>14}")
+    for step in range(1, args.steps + 1):
+        size = args.segments * step // args.steps
+        tracks = all_tracks[:size]
+        annotation = build_annotation(tracks)
+        text = as_text(tracks)
+        direct, segments = timed(lambda a: list(util.annotation2dict(a)), annotation)
+        parsed, parsed_segments = timed(util.pipelinetxt2dict, text)
+        assert len(segments) == len(parsed_segments) == size
+        print(f"{size:>10} | {direct / size * 1e6:>9.2f} µs/seg | {parsed / size * 1e6:>9.2f} µs/seg")
+
+
+if __name__ == "__main__":
+    main()
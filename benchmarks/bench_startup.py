@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Cold start guard for everything that does not need any machine learning. Every scenario gets started
+in a fresh interpreter with `-X importtime`, the report shows the slowest imports and the wall clock.
+It fails if torch & friends sneak in again or if the start takes longer than allowed.
+
+    python benchmarks/bench_startup.py [--runs 5] [--limit 1.5]
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+HEAVY_MODULES = ("torch", "whisper", "pydub", "pyannote", "numpy", "scipy")
+
+SCENARIOS = {
+    "tui": ["-c", "import tui"],
+    "cli": ["-c", "import cli"],
+    "list": [os.path.join(SRC, "cli.py"), "--list", "-db", "bench_startup.db"],
+}
+
+
+def parse_importtime(stderr: str) -> list[tuple]:
+    """
+    Parses the `-X importtime` output
+
+    :return: list of (module name, self time in µs, cumulative time in µs)
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def run_scenario(args: list, runs=5) -> dict:
+    """
+    Starts a fresh interpreter `runs` times in an empty working directory
+
+    :return: dictionary with the median wall clock, the import list of the last run and possible errors
+    """
+    env = dict(os.environ, PYTHONPATH=SRC)
+    walls = []
+    modules = []
+    error = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        for _ in range(runs):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-X", "importtime", *args],
+                                  cwd=work_dir, env=env, capture_output=True, text=True)
+            walls.append(time.perf_counter() - start)
+            modules = parse_importtime(proc.stderr)
+            if proc.returncode != 0:
+                error = proc.stderr.strip().splitlines()[-1]
+                break
+    return {"wall": statistics.median(walls), "modules": modules, "error": error}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="TransCrypt cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="interpreter starts per scenario")
+    parser.add_argument("--limit", type=float, default=1.5, help="maximum median wall clock in seconds")
+    parser.add_argument("--top", type=int, default=8, help="number of slowest imports to show")
+    args = parser.parse_args()
+
+    failed = False
+    for name, scenario in SCENARIOS.items():
+        result = run_scenario(scenario, args.runs)
+        heavy = sorted({mod for mod, _, _ in result['modules'] if mod.split(".")[0] in HEAVY_MODULES})
+        print(f"== {name}: {result['wall']*1000:.0f} ms wall clock")
+        for mod, self_us, cumulative_us in sorted(result['modules'], key=lambda x: -x[2])[:args.top]:
+            print(f"   {cumulative_us/1000:>8.1f} ms  {mod}")
+        if result['error']:
+            print(f"   !! could not start: {result['error']}")
+            failed = True
+        if heavy:
+            print(f"   !! heavy imports on startup: {', '.join(heavy)}")
+            failed = True
+        if result['wall'] > args.limit:
+            print(f"   !! slower than {args.limit}s")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+
+"""
+Per speaker stems of a synthetic recording, the old way of growing one track per speaker by appending
+silence and speech, which copies everything accumulated so far each time, against export_speaker_stems
+that writes all speakers in one pass into files allocated at their final size. Time per segment should
+grow with the count for the first and stay flat for the second
+
+    python benchmarks/bench_stems.py [--segments 1000] [--speakers 5] [--steps 4]
+
+pydub is not needed, the appending is done with numpy.concatenate which copies just like AudioSegment +=
+"""
+
+import os
+import sys
+import argparse
+import logging
+import random
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import util
+
+logging.basicConfig(level=logging.ERROR)
+
+
+def synthetic_recording(num_segments: int, num_speakers: int, seed=42) -> tuple:
+    rng = random.Random(seed)
+    segments = []
+    now = 0
+    for _ in range(num_segments):
+        now += rng.randint(100, 800)
+        length = rng.randint(500, 4000)
+        segments.append({"start_ms": now, "stop_ms": now + length, "speaker_id": f"SPEAKER_{rng.randrange(num_speakers):02d}"})
+        now += length
+    samples = np.random.default_rng(seed).uniform(-0.5, 0.5, now * util.SAMPLE_RATE // 1000).astype(np.float32)
+    return samples, segments
+
+
+def appending(samples, segments: list, work_dir: str) -> int:
+    """One full pass per speaker and a copy of the whole track so far for every segment"""
+    speakers = sorted({each['speaker_id'] for each in segments})
+    for speaker in speakers:
+        track = np.zeros(0, dtype=np.float32)
+        for each in segments:
+            if each['speaker_id'] != speaker:
+                continue
+            start = each['start_ms'] * util.SAMPLE_RATE // 1000
+            stop = each['stop_ms'] * util.SAMPLE_RATE // 1000
+            track = np.concatenate([track, np.zeros(start - len(track), dtype=np.float32), samples[start:stop]])
+        track = np.concatenate([track, np.zeros(len(samples) - len(track), dtype=np.float32)])
+        util.export_samples_wav(track, os.path.join(work_dir, f"old_{speaker}.wav"))
+    return len(speakers)
+
+
+def one_pass(samples, segments: list, work_dir: str) -> int:
+    return len(util.export_speaker_stems(samples, segments, lambda speaker: os.path.join(work_dir, f"{speaker}.wav")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="speaker stem export")
+    parser.add_argument("--segments", type=int, default=1000, help="segments at the biggest size")
+    parser.add_argument("--speakers", type=int, default=5)
+    parser.add_argument("--steps", type=int, default=4, help="number of sizes up to --segments")
+    args = parser.parse_args()
+
+    samples, segments = synthetic_recording(args.segments, args.speakers)
+    print(f"{'segments':>9} | {'audio':>7} | {'appending':>15} | {'one pass':>15}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for step in range(1, args.steps + 1):
+            size = args.segments * step // args.steps
+            part = segments[:size]
+            audio = samples[:part[-1]['stop_ms'] * util.SAMPLE_RATE // 1000]
+            results = []
+            for exporter in (appending, one_pass):
+                start = time.perf_counter()
+                exporter(audio, part, work_dir)
+                results.append((time.perf_counter() - start) / size * 1000)
+            print(f"{size:>9} | {len(audio) / util.SAMPLE_RATE / 60:>5.1f}m | {results[0]:>9.2f} ms/seg | "
+                  f"{results[1]:>9.2f} ms/seg")
+
+
+if __name__ == "__main__":
+    main()
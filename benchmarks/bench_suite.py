@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Regression guard for everything around the models, the parsing, slicing, exporting, scripting and database
+work. All of it runs on synthetic audio and diarization on the cpu, no model and no network needed. Every
+benchmark reports the best of several runs, which is the one least disturbed by whatever else the machine
+was doing, compared against a stored baseline anything slower than the
+threshold fails, so a slowdown shows up before it gets deployed.
+
+    python benchmarks/bench_suite.py --save           # measure and store as baseline for this machine
+    python benchmarks/bench_suite.py                  # measure and compare, exit code 1 on regressions
+    python benchmarks/bench_suite.py -k db --repeat 9 # only benchmarks with 'db' in their name
+
+Baselines only mean something on the machine they were measured on, so they are not part of the repository,
+the file remembers host and python version and the comparison warns if they differ. The older bench_*.py
+scripts compare old against new implementations, this one only watches the current ones.
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import util
+from db_util import CryptDB
+from bench_db import synthetic_project
+from bench_diarization import synthetic_tracks, as_text, build_annotation
+
+logging.basicConfig(level=logging.ERROR)
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+BENCHMARKS = {}  # name: (setup, modules it needs)
+_backends = []  # databases the setup of the current benchmark opened, closed once it is measured
+
+
+def benchmark(name: str, needs=()):
+    """
+    Registers a setup function, setup(work_dir, scale) prepares the data and returns the callable that gets
+    timed, so only the actual work is measured
+
+    :param str name: unique name, dotted by area
+    :param needs: modules without which the benchmark is skipped, eg. numpy
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, needs)
+        return setup
+    return register
+
+
+def open_backend(work_dir: str, name: str) -> CryptDB:
+    """Opens a database in the work dir that gets closed after the benchmark, windows cannot delete open files"""
+    backend = CryptDB(os.path.join(work_dir, name))
+    _backends.append(backend)
+    return backend
+
+
+def synthetic_lines(num_lines: int, num_speakers=5, seed=42) -> list[dict]:
+    rng = random.Random(seed)
+    lines = []
+    now = 0
+    for _ in range(num_lines):
+        now += rng.randint(100, 800)
+        length = rng.randint(500, 4000)
+        lines.append({"start_ms": now, "stop_ms": now + length, "speaker_id": f"SPEAKER_{rng.randrange(num_speakers):02d}"})
+        now += length
+    return lines
+
+
+def synthetic_samples(lines: list[dict], seed=42):
+    import numpy as np
+    length = lines[-1]['stop_ms'] * util.SAMPLE_RATE // 1000
+    return np.random.default_rng(seed).uniform(-0.5, 0.5, length).astype(np.float32)
+
+
+@benchmark("diarization.pipelinetxt2dict")
+def _parse_text(work_dir: str, scale: float):
+    text = as_text(synthetic_tracks(int(20000 * scale)))
+    return lambda: util.pipelinetxt2dict(text)
+
+
+@benchmark("diarization.annotation2dict")
+def _annotation(work_dir: str, scale: float):
+    annotation = build_annotation(synthetic_tracks(int(20000 * scale)))
+    return lambda: list(util.annotation2dict(annotation))
+
+
+@benchmark("audio.speech_parts", needs=("numpy",))
+def _speech_parts(work_dir: str, scale: float):
+    lines = synthetic_lines(int(200 * scale))
+    samples = synthetic_samples(lines)
+    folder = os.path.join(work_dir, "parts") + os.sep
+    os.makedirs(folder, exist_ok=True)
+    return lambda: util.speech_parts("bench.wav", lines, folder, samples=samples)
+
+
+@benchmark("audio.single_out_speaker", needs=("numpy",))
+def _single_out_speaker(work_dir: str, scale: float):
+    lines = synthetic_lines(int(200 * scale))
+    samples = synthetic_samples(lines)
+    out_file = os.path.join(work_dir, "speaker.wav")
+    return lambda: util.single_out_speaker("bench.wav", lines, "SPEAKER_01", out_file, samples=samples)
+
+
+@benchmark("script.create_stage_script")
+def _stage_script(work_dir: str, scale: float):
+    lines = [dict(each, transcription=f"  Das ist Zeile {i}, mit etwas Text.  " if i % 7 else " Untertitel ")
+             for i, each in enumerate(synthetic_lines(int(50000 * scale)))]
+    names = {f"SPEAKER_{i:02d}": f"Person {i}" for i in range(5)}
+    biases = [f"Hallucination number {i}" for i in range(100)] + ["Untertitel"]
+    return lambda: util.create_stage_script(lines, names, biases)
+
+
+@benchmark("script.cleanup_transcript")
+def _cleanup(work_dir: str, scale: float):
+    texts = [f"  Zeile {i} mit Leerzeichen rundherum \n" for i in range(int(100000 * scale))]
+    biases = [f"Hallucination number {i}" for i in range(100)]
+    return lambda: [util.cleanup_transcript(each, biases) for each in texts]
+
+
+@benchmark("db.create_bulk_line")
+def _bulk_line(work_dir: str, scale: float):
+    backend = open_backend(work_dir, "bulk.db")
+    lines = synthetic_lines(int(20000 * scale))
+    return lambda: backend.create_bulk_line(backend.create_project(given_name="Bulk", status=1), lines)
+
+
+@benchmark("db.update_line_batch")
+def _update_line(work_dir: str, scale: float):
+    backend = open_backend(work_dir, "update.db")
+    project_id = synthetic_project(backend, int(20000 * scale))
+    uids = [row['uid'] for row in backend.iter_project_lines(project_id, columns=("state",))]
+
+    def update():
+        with backend.batch(500):
+            for uid in uids:
+                backend.update_line(uid, content=f"Zeile {uid}", language="de", state=CryptDB.LINE_TRANSCRIBED)
+    return update
+
+
+@benchmark("db.fetch_project_lines")
+def _fetch_lines(work_dir: str, scale: float):
+    backend = open_backend(work_dir, "fetch.db")
+    size = int(50000 * scale)
+    project_id = synthetic_project(backend, size)
+    return lambda: backend.fetch_project_lines(project_id, size)
+
+
+@benchmark("tui.project_table")
+def _project_table(work_dir: str, scale: float):
+    backend = open_backend(work_dir, "projects.db")
+    for i in range(int(2000 * scale)):
+        backend.create_project(given_name=f"Anhörung {i} mit einem eher langen Namen", status=i % 5,
+                               num_lines=i * 10, num_speakers=i % 7, file_path=f"/data/recordings/2023/{i:05d}.wav")
+    return lambda: list(util.project_table_rows(backend.list_project(limit=-1)))
+
+
+def available(modules) -> bool:
+    for module in modules:
+        try:
+            __import__(module)
+        except ImportError:
+            return False
+    return True
+
+
+def measure(names: list[str], scale=1.0, repeat=5) -> dict:
+    """
+    :return: dictionary `name: seconds of the fastest run`, skipped benchmarks are missing
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in names:
+            setup, needs = BENCHMARKS[name]
+            if not available(needs):
+                print(f"{name:<32} | skipped, needs {', '.join(needs)}")
+                continue
+            try:
+                func = setup(work_dir, scale)
+                func()  # warm up, first runs pay for caches and imports
+                runs = []
+                for _ in range(repeat):
+                    gc.collect()
+                    gc.disable()  # like timeit, a collection of somebody else's garbage is not our runtime
+                    try:
+                        start = time.perf_counter()
+                        func()
+                        runs.append(time.perf_counter() - start)
+                    finally:
+                        gc.enable()
+                results[name] = min(runs)
+                del func
+            finally:
+                while _backends:
+                    _backends.pop().close()
+    return results
+
+
+def reference(repeat=5) -> float:
+    """
+    Seconds for a fixed pure python workload, measured before and after the suite. Shared machines and
+    cpu clocks drift by tens of percent between runs, the comparison scales the baseline by this
+    """
+    def work():
+        total = 0
+        for i in range(1000000):
+            total += i * i
+        return total
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        work()
+        runs.append(time.perf_counter() - start)
+    return min(runs)
+
+
+def machine() -> dict:
+    return {"host": socket.gethostname(), "python": platform.python_version(), "platform": platform.platform()}
+
+
+def compare(results: dict, baseline: dict, threshold: float, speed=1.0) -> list[str]:
+    """
+    :param float speed: reference time now divided by the one of the baseline, >1 means the machine is slower
+    :return: names of the benchmarks that got slower than the baseline allows
+    """
+    regressions = []
+    if speed != 1.0:
+        print(f"machine is {speed:.2f}x the reference time of the baseline, the baseline is scaled by that")
+    print(f"{'benchmark':<32} | {'now':>10} | {'baseline':>10} | {'change':>8}")
+    for name, seconds in results.items():
+        before = baseline.get(name, None)
+        if not before:
+            print(f"{name:<32} | {seconds * 1000:>7.1f} ms | {'-':>10} | {'new':>8}")
+            continue
+        before *= speed
+        change = seconds / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  !! regression"
+        print(f"{name:<32} | {seconds * 1000:>7.1f} ms | {before * 1000:>7.1f} ms | {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="TransCrypt microbenchmarks with baseline comparison")
+    parser.add_argument("-k", type=str, default="", help="only benchmarks whose name contains this")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the size of all synthetic data")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark, the fastest counts")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, 0.25 means 25%% slower")
+    parser.add_argument("--baseline", type=str, default=BASELINE, help="json file with the stored baseline")
+    parser.add_argument("--save", action="store_true", help="stores the results as new baseline")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.k in name]
+    speed = reference()
+    results = measure(names, args.scale, args.repeat)
+    speed = min(speed, reference())
+    if args.save:
+        stored = {}
+        if os.path.exists(args.baseline):  # benchmarks that did not run keep their old numbers
+            with open(args.baseline, "r", encoding="utf-8") as baseline_fh:
+                stored = json.load(baseline_fh)
+        stored.update(machine=machine(), scale=args.scale, reference=speed, results=dict(stored.get('results', {}), **results))
+        with open(args.baseline, "w", encoding="utf-8") as baseline_fh:
+            json.dump(stored, baseline_fh, indent=3)
+        for name, seconds in results.items():
+            print(f"{name:<32} | {seconds * 1000:>7.1f} ms")
+        print(f"Baseline stored in '{args.baseline}'")
+        return 0
+    if not os.path.exists(args.baseline):
+        compare(results, {}, args.threshold)
+        print(f"No baseline in '{args.baseline}' yet, store one with --save")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as baseline_fh:
+        stored = json.load(baseline_fh)
+    if stored.get('scale', 1.0) != args.scale:
+        print(f"!! baseline was measured with --scale {stored.get('scale')}, numbers are not comparable")
+        return 1
+    if stored.get('machine', {}) != machine():
+        print(f"!! baseline comes from {stored.get('machine', {}).get('host', 'somewhere else')}, take it with salt")
+    speed = speed / stored['reference'] if stored.get('reference') else 1.0
+    regressions = compare(results, stored.get('results', {}), args.threshold, speed)
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Feeding whisper one line at a time leaves the GPU bored most of the time, most of our lines are
+shorter than three seconds. Whisper always works on 30 second windows anyway, so we might as well
+stack a bunch of them and let the decoder chew on all of them at once.
+"""
+
+import time
+import logging
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+WINDOW_SAMPLES = 30 * SAMPLE_RATE  # whisper.audio.N_SAMPLES, everything longer needs the sliding window
+
+
+class StubWhisper:
+    """
+    Deterministic stand-in for a loaded whisper model, no torch, no download, no GPU. The 'text' is
+    derived from the length of the given samples so it can be checked that results end up at the
+    right line. The optional costs simulate the fixed overhead of a device call and the per audio
+    second work, that is what batching is supposed to save
+    """
+
+    def __init__(self, call_overhead=0.0, cost_per_second=0.0, language="en", no_speech_prob=0.0, avg_logprob=0.0):
+        """
+        :param float call_overhead: seconds of sleep per call of transcribe or decode_batch
+        :param float cost_per_second: seconds of sleep per second of audio
+        :param str language: language that gets reported if none was given
+        :param float no_speech_prob: reported by decode_batch for every line
+        :param float avg_logprob: reported by decode_batch for every line
+        """
+        self.call_overhead = call_overhead
+        self.cost_per_second = cost_per_second
+        self.language = language
+        self.no_speech_prob = no_speech_prob
+        self.avg_logprob = avg_logprob
+        self.calls = 0
+
+    @staticmethod
+    def text_for(samples) -> str:
+        return f"stub {len(samples)}"
+
+    def _simulate(self, num_samples: int):
+        self.calls += 1
+        delay = self.call_overhead + self.cost_per_second * num_samples / SAMPLE_RATE
+        if delay > 0:
+            time.sleep(delay)
+
+    def transcribe(self, audio, language=None, **kwargs) -> dict:
+        self._simulate(len(audio))
+        return {"text": self.text_for(audio), "language": language or self.language, "segments": []}
+
+    def decode_batch(self, batch: list, language=None) -> list[dict]:
+        # a batch costs as much as the longest member, everything is padded to the same window anyway
+        self._simulate(max((len(each) for each in batch), default=0))
+        return [{"text": self.text_for(each),
+                 "language": language or self.language,
+                 "no_speech_prob": self.no_speech_prob,
+                 "avg_logprob": self.avg_logprob} for each in batch]
+
+
+class BatchTranscriber:
+    """
+    Groups lines by length and decodes them together. Anything longer than a single whisper window gets
+    the normal, sequential model.transcribe treatment as the batched decoder cannot slide over audio
+    """
+
+    def __init__(self, model, language=None, batch_size=16, sort_window=8, fp16=None, cache=None, model_name=""):
+        """
+        :param model: loaded whisper model or StubWhisper
+        :param str language: optional language code, None lets whisper detect it per line
+        :param int batch_size: number of lines that get decoded together
+        :param int sort_window: number of batches that are collected and sorted by length before decoding
+        :param bool fp16: half precision, by default only if the model is not on the cpu
+        :param TranscriptionCache cache: optional, lines that were transcribed before skip the model
+        :param str model_name: model size, part of the cache key as the model object itself tells nothing
+        """
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name
+        self._keys = {}
+        self.language = language
+        self.batch_size = max(1, int(batch_size))
+        self.sort_window = max(1, int(sort_window))
+        if fp16 is None:
+            device = getattr(model, "device", None)
+            fp16 = bool(device is not None and getattr(device, "type", "cpu") != "cpu")
+        self.fp16 = fp16
+        self.options = {"fp16": self.fp16, "without_timestamps": True}
+
+    def transcribe_lines(self, lines: Iterable[tuple]) -> Iterator[tuple]:
+        """
+        Transcribes (uid, samples) pairs, results are yielded as soon as their batch is done, the order
+        is the one of the length grouping and not the one of the input
+
+        :param lines: iterable of (uid, samples) with samples as 16 kHz float32 audio
+        :return: iterator of (uid, whisper result dict)
+        """
+        pending = []
+        for uid, samples in lines:
+            if self.cache:
+                key = self.cache.make_key(samples, self.model_name, self.language, self.options)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    yield uid, cached
+                    continue
+                self._keys[uid] = key
+            if len(samples) > WINDOW_SAMPLES:
+                yield uid, self._remember(uid, self.model.transcribe(samples, language=self.language, fp16=self.fp16))
+                continue
+            pending.append((uid, samples))
+            if len(pending) >= self.batch_size * self.sort_window:
+                yield from self._flush(pending)
+                pending = []
+        if pending:
+            yield from self._flush(pending)
+
+    def transcribe_all(self, lines: Iterable[tuple]) -> dict:
+        """
+        Same as transcribe_lines but waits for all of it
+
+        :return: dictionary of `uid: whisper result dict`
+        """
+        return dict(self.transcribe_lines(lines))
+
+    def _flush(self, pending: list) -> Iterator[tuple]:
+        pending.sort(key=lambda x: len(x[1]))
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            results = self._decode([samples for _, samples in batch])
+            for (uid, samples), result in zip(batch, results):
+                if self._needs_fallback(result):
+                    logger.debug(f"BatchTranscriber: line {uid} looks off, retrying with temperature fallback")
+                    result = self.model.transcribe(samples, language=self.language, fp16=self.fp16)
+                elif self._is_silence(result):  # model.transcribe does that on its own
+                    result = dict(result, text="")
+                yield uid, self._remember(uid, result)
+
+    def _remember(self, uid, result: dict) -> dict:
+        key = self._keys.pop(uid, None)
+        if key:
+            self.cache.put(key, result)
+        return result
+
+    def _decode(self, batch: list) -> list[dict]:
+        decode_batch = getattr(self.model, "decode_batch", None)
+        if decode_batch:
+            return decode_batch(batch, language=self.language)
+        import numpy as np
+        import torch
+        import whisper
+
+        n_mels = getattr(self.model.dims, "n_mels", 80)
+        mels = []
+        for samples in batch:
+            audio = whisper.pad_or_trim(torch.from_numpy(np.asarray(samples, dtype=np.float32)))
+            if n_mels != 80:  # older whisper versions do not know this parameter
+                mels.append(whisper.log_mel_spectrogram(audio, n_mels=n_mels))
+            else:
+                mels.append(whisper.log_mel_spectrogram(audio))
+        mels = torch.stack(mels).to(self.model.device)
+        options = whisper.DecodingOptions(language=self.language, fp16=self.fp16, without_timestamps=True)
+        results = whisper.decode(self.model, mels, options)
+        return [{"text": res.text,
+                 "language": res.language,
+                 "avg_logprob": res.avg_logprob,
+                 "no_speech_prob": res.no_speech_prob,
+                 "compression_ratio": res.compression_ratio,
+                 "temperature": res.temperature} for res in results]
+
+    @staticmethod
+    def _needs_fallback(result: dict) -> bool:
+        """Same thresholds whisper.transcribe uses to decide that a greedy decode went wrong"""
+        if result.get("compression_ratio", 0.0) > 2.4:
+            return True
+        if result.get("avg_logprob", 0.0) < -1.0 and result.get("no_speech_prob", 0.0) <= 0.6:
+            return True
+        return False
+
+    @staticmethod
+    def _is_silence(result: dict) -> bool:
+        """whisper.transcribe drops a segment that is probably no speech unless the model is sure about the text"""
+        return result.get("no_speech_prob", 0.0) > 0.6 and result.get("avg_logprob", 0.0) < -1.0
+
+
+if __name__ == "__main__":
+    print("Comparing sequential and batched decoding with the stub model...")
+    fake_lines = [(uid, [0.0] * (SAMPLE_RATE * (1 + uid % 3))) for uid in range(1, 401)]
+    stub = StubWhisper(call_overhead=0.005, cost_per_second=0.0005)
+    start = time.perf_counter()
+    for uid, samples in fake_lines:
+        stub.transcribe(samples)
+    sequential = time.perf_counter() - start
+    stub = StubWhisper(call_overhead=0.005, cost_per_second=0.0005)
+    start = time.perf_counter()
+    done = BatchTranscriber(stub, batch_size=16).transcribe_all(fake_lines)
+    batched = time.perf_counter() - start
+    print(f"sequential: {len(fake_lines)/sequential:.1f} lines/s, batched: {len(done)/batched:.1f} lines/s "
+          f"({stub.calls} calls)")
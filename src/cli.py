@@ -23,13 +23,24 @@ import sys
 import logging
 import json
 import os
+import time
 import argparse
-
-import torch
-import whisper
+from typing import Callable, Iterator
 
 import util
+import pcm_cache
+import profiling
+import progress
+from batch_transcribe import BatchTranscriber
+from coalesce import coalesce_segments
+from cpu_pool import transcribe_cpu_pool
 from db_util import CryptDB
+from metrics import RunMetrics
+from model_registry import registry
+from pipeline import Pipeline, register_lines, slice_lines, transcribe_lines, write_lines
+from transcribe_cache import TranscriptionCache
+from windowed_diarization import diarize_windowed
+from worker import JobWorker
 
 logging.basicConfig(filename='TransCrypt.log', format='[%(asctime)s] %(levelname)s:%(message)s', level=logging.INFO)
 
@@ -39,12 +50,23 @@ def save_dict_as_json(filepath: str, data):
         json.dump(data, out_file, indent=3)
 
 
+def read_api_key(key_path="hugging_api_key"):
+    """The hugging face api key lives in a plain text file, None if there is none"""
+    if not os.path.exists(key_path):
+        return None
+    with open(key_path, "r") as key_file:
+        return key_file.read()
+
+
 def cli_process_plain(audio_file: str,
                       out_file: str,
                       temp_folder="./temp/",
                       language="de",
                       silent=False,
-                      bias_file="dataset_bias.json"):
+                      bias_file="dataset_bias.json",
+                      export_clips=False,
+                      cache=None,
+                      coalesce=None):
     speakers = {
         "SPEAKER_00": "Max",
         "SPEAKER_01": "Moritz",
@@ -69,17 +91,25 @@ def cli_process_plain(audio_file: str,
     with open("hugging_api_key", "r") as key_file:
         api_key = key_file.read()
     logging.info("Calling pyannote")
-    raw_pipetxt = util.create_pipelinetxt(audio_file, api_key)
-    save_dict_as_json("Crypt001-rawpipe.json", raw_pipetxt)
-    logging.info(f"PyAnnote done - {len(raw_pipetxt)} -> refining (converting in a useable list)")
-    refined = util.pipelinetxt2dict(raw_pipetxt)
+    annotation = util.create_annotation(audio_file, api_key)
+    save_dict_as_json("Crypt001-rawpipe.json", str(annotation))
+    logging.info(f"PyAnnote done - {len(annotation)} -> refining (converting in a useable list)")
+    refined = list(util.annotation2dict(annotation))
+    if coalesce is not None:
+        refined = list(coalesce_segments(refined, **coalesce))
     save_dict_as_json("Crypt002-refined.json", refined)
     logging.info(f"Refinement done - {len(refined)} entries, found: {len(util.piped_speakers(refined))} Speakers")
-    enriched = util.speech_parts(audio_file, refined, temp_folder)
-    save_dict_as_json("Crypt003-enriched.json", enriched)
-    logging.info(
-        "Created temp files for each singular line, this might be many, calling whisper now, embrace your GPU Ram!")
-    diamonds = util.transcribe_enriched(enriched, "medium", language)
+    if export_clips:
+        enriched = util.speech_parts(audio_file, refined, temp_folder)
+        save_dict_as_json("Crypt003-enriched.json", enriched)
+        logging.info(
+            "Created temp files for each singular line, this might be many, calling whisper now, embrace your GPU Ram!")
+    else:
+        enriched = util.speech_samples(audio_file, refined)
+        logging.info("Decoded audio once, handing the samples straight to whisper now, embrace your GPU Ram!")
+    diamonds = util.transcribe_enriched(enriched, "medium", language, cache)
+    for each in diamonds:
+        each.pop('samples', None)  # numpy views are neither json nor useful anymore
     save_dict_as_json("Crypt004-diamond.json", diamonds)
     logging.info("Transcription done, saving up raw data now")
     with open("last_run.json", "w", encoding="utf-8") as raw_json:
@@ -90,14 +120,115 @@ def cli_process_plain(audio_file: str,
     logging.info("Process finished")
 
 
+def export_stage_script(project_id: int, out_file=None, bias_file="assets/dataset_bias.json", language=None,
+                        db_file="transcrypts.db"):
+    """
+    Writes the stage script of a transcribed project, lines are streamed from the database so this works
+    for projects of any size
+
+    :param int project_id: existing project
+    :param str out_file: path of the text file, stdout if None
+    :param str bias_file: json file with known hallucinations per language
+    :param str language: language of the biases, by default all of them
+    """
+    biases = None
+    if bias_file and os.path.exists(bias_file):
+        with open(bias_file, "r", encoding="utf-8") as bias_fh:
+            all_biases = json.load(bias_fh)
+        biases = all_biases.get(language, None) if language else [b for each in all_biases.values() for b in each]
+    backend = CryptDB(db_file)
+    names = {each['speaker_id']: each['name'] for each in backend.fetch_project_speaker(project_id)}
+    lines = backend.iter_project_lines(project_id, columns=("speaker_id", "content"))
+    script = util.iter_stage_script(lines, names, biases, text_key="content")
+    if out_file:
+        with open(out_file, "w", encoding="utf-8") as txt_file:
+            txt_file.writelines(script)
+    else:
+        sys.stdout.writelines(script)
+    backend.close()
+
+
+def export_project_stems(project_id: int, out_prefix: str, db_file="transcrypts.db", pcm_folder="./pcm/") -> dict:
+    """
+    Writes one wav file per speaker of a project, named `<out_prefix><speaker name>.wav`
+
+    :param int project_id: existing, at least diarized project
+    :param str out_prefix: folder and/or start of the file names
+    :return: dictionary `speaker_id: path`
+    """
+    backend = CryptDB(db_file)
+    project = backend.fetch_project(project_id)
+    if not project:
+        backend.close()
+        return {}
+    names = {each['speaker_id']: each['name'] for each in backend.fetch_project_speaker(project_id)}
+    samples = pcm_cache.project_samples(backend, project, pcm_folder)
+    lines = backend.iter_project_lines(project_id, columns=("stop_ms", "speaker_id"))
+    stems = util.export_speaker_stems(samples, lines,
+                                      lambda speaker: f"{out_prefix}{names.get(speaker, speaker) or speaker}.wav")
+    backend.close()
+    for speaker, path in stems.items():
+        logging.info(f"Stem of {speaker} written to '{path}'")
+    return stems
+
+
+def transcribe_rows(backend: CryptDB, samples, db_pipe: list[dict], model_size: str, language: str,
+                    batch_size=16, cpu_workers=0, cache=None, metrics=None):
+    """
+    Transcribes the given lines and writes the text back to the database as soon as it is there
+
+    :param CryptDB backend: open database handler
+    :param numpy.ndarray samples: 16 kHz mono float32 audio of the whole recording
+    :param db_pipe: iterable of lines as fetched or streamed from the database
+    :param int cpu_workers: if set, shards the lines over that many cpu processes instead of using the GPU
+    :param TranscriptionCache cache: optional, lines that were transcribed before skip the model
+    :param RunMetrics metrics: optional, gets a 'transcribe' stage that includes writing the results
+    """
+    metrics = metrics or RunMetrics()
+    with metrics.stage("transcribe") as stage:
+        pending = {}  # uid: line, until its result is back, the engines read ahead of what they finished
+
+        def counted():
+            for each in db_pipe:
+                pending[each['uid']] = each
+                yield each
+
+        if cpu_workers:
+            results = transcribe_cpu_pool(samples, counted(), model_size, language, workers=cpu_workers, cache=cache)
+        else:
+            engine = BatchTranscriber(registry.whisper(model_size), language=language, batch_size=batch_size,
+                                      cache=cache, model_name=model_size)
+            results = engine.transcribe_lines(
+                (each['uid'], util.slice_samples(samples, each['start_ms'], each['stop_ms'])) for each in counted())
+        with backend.batch(batch_size):
+            for uid, result in results:
+                backend.update_line(uid, content=result['text'], language=result.get('language', "un"),
+                                    state=CryptDB.LINE_TRANSCRIBED)
+                stage.add(pending.pop(uid, None))
+                # TODO: delete file after processing and reference in db
+
+
 def cli_process_db(audio_file: str,
                    language=None,
                    temp_folder="./temp/",
                    silent=False,
                    bias_file="assets/dataset_bias.json",
                    model_size="medium",
-                   db_file="transcrypts.db"):
-    """Tries to utilise database for processing"""
+                   db_file="transcrypts.db",
+                   export_clips=False,
+                   batch_size=16,
+                   cpu_workers=0,
+                   cache=None,
+                   coalesce=None,
+                   window_minutes=0,
+                   pcm_folder="./pcm/"):
+    """
+    Tries to utilise database for processing
+
+    :param dict coalesce: keyword arguments for coalesce_segments, None registers every diarization turn as is
+    :param float window_minutes: diarizes in overlapping windows of that length instead of the whole file at once
+    :param str pcm_folder: where the decoded copy of the recording is kept for later slicing
+    """
     biases = None
     if not silent:
         print("TransCrypt - This process might take a while")
@@ -120,75 +251,317 @@ def cli_process_db(audio_file: str,
                     biases = None
         else:
             logging.warning(f"Bias file '{bias_file}' got entered but cannot be found")
-    # retrieve API Key
-    with open("hugging_api_key", "r") as key_file:
-        api_key = key_file.read()
     # * Creating DB
     backend = CryptDB(db_file)
-    p_id = backend.create_project(file_path=str(audio_file), status=0)
-    logging.info("Calling pyannote")
-    raw_pipetxt = util.create_pipelinetxt(audio_file, api_key)
-    # TODO: save up raw annotate files for whatever reason
-    logging.info(f"PyAnnote done - {len(raw_pipetxt)} -> refining (converting in a useable list)")
-    refined = util.pipelinetxt2dict(raw_pipetxt)
-    lines = len(refined)
-    num_speaker = len(util.piped_speakers(refined))
-    # TODO: get the actual length of the file
-    backend.update_project(p_id, num_speaker=num_speaker, status=1, num_lines=lines)
-    logging.info(f"Refinement done - {lines} entries, found: {num_speaker} Speakers")
-    backend.create_bulk_line(p_id, refined)
-    # this step is a bit illogical because we just gave all the data IN the database, now we
-    # extract it again to get the proper line_ids
-    db_pipe = backend.fetch_project_lines(p_id, 99999)
-    check = util.speech_parts(audio_file, db_pipe, temp_folder, backend)
-
-    if not check:
+    p_id, fingerprint, pcm_file = new_project(backend, audio_file, pcm_folder)
+    return process_project(backend, p_id, audio_file, fingerprint, pcm_file, language, temp_folder, model_size,
+                           db_file, export_clips, batch_size, cpu_workers, cache, coalesce, window_minutes)
+
+
+def diarize_file(audio_file: str, window_minutes=0):
+    """
+    :param float window_minutes: diarizes in overlapping windows of that length instead of the whole file at once
+    :return: iterator of diarized segments
+    """
+    # retrieve API Key, only needed if pyannote actually has to run
+    api_key = read_api_key()
+    if window_minutes:
+        window_ms = int(window_minutes * 60 * 1000)
+        yield from diarize_windowed(audio_file, api_key, window_ms=window_ms, overlap_ms=min(60 * 1000, window_ms // 4))
+    else:
+        yield from util.diarize(audio_file, api_key)
+
+
+def new_project(backend: CryptDB, audio_file: str, pcm_folder="./pcm/") -> tuple[int, str, str]:
+    """
+    :return: uid of the new, empty project, fingerprint of the recording and path of its decoded copy
+    """
+    fingerprint = util.file_fingerprint(audio_file)
+    pcm_file = pcm_cache.pcm_path(audio_file, pcm_folder, fingerprint)
+    p_id = backend.create_project(file_path=str(audio_file), status=0, pcm_path=pcm_file)
+    return p_id, fingerprint, pcm_file
+
+
+def process_project(backend: CryptDB, p_id: int, audio_file: str, fingerprint: str, pcm_file: str, language=None,
+                    temp_folder="./temp/", model_size="medium", db_file="transcrypts.db", export_clips=False,
+                    batch_size=16, cpu_workers=0, cache=None, coalesce=None, window_minutes=0, kind="process"):
+    """
+    Diarization, slicing and transcription of a project without any lines yet, everything streams from one
+    stage into the next, the timings of every stage end up in run_metrics
+
+    :param CryptDB backend: open database handler
+    :param int p_id: existing project
+    :param str fingerprint: util.file_fingerprint of the recording, a known one skips pyannote
+    :param str pcm_file: decoded copy of the recording, see pcm_cache
+    :param str kind: what the run is called in run_metrics
+    """
+    segments = backend.fetch_diarization(fingerprint)
+    metrics = RunMetrics(kind, model_size, p_id)
+
+    def diarized():
+        for each in diarize_file(audio_file, window_minutes):
+            segments.append(each)
+            yield each
+
+    def annotated(stage_backend: CryptDB, lines: int, num_speakers: int):
+        stage_backend.update_project(p_id, num_speakers=num_speakers, status=1, num_lines=lines)
+        stage_backend.save_diarization(p_id, fingerprint, segments)
+        logging.info(f"Diarization done - {lines} entries, found: {num_speakers} Speakers")
+
+    if segments:
+        logging.info(f"'{audio_file}' got diarized before, reusing its {len(segments)} segments")
+        source = list(segments)
+    else:
+        logging.info("Calling pyannote, slicing and transcription start as soon as the first segments are known")
+        source = diarized()
+    source = metrics.source("diarize", source)
+    if coalesce is not None:
+        source = metrics.measured("coalesce", lambda turns: coalesce_segments(turns, **coalesce), source)
+    pipe = Pipeline()
+    register = metrics.wrap("register", register_lines(pipe, db_file, p_id, on_done=annotated))
+    try:
+        if cpu_workers:  # the pool wants the whole recording at once, so only the diarization streams
+            pipe.run_all(source, register)
+            transcribe_rows(backend, pcm_cache.load(audio_file, pcm_file),
+                            backend.iter_project_lines(p_id, below_state=CryptDB.LINE_TRANSCRIBED),
+                            model_size, language, batch_size, cpu_workers, cache, metrics)
+        else:
+            pipe.run_all(source,
+                         register,
+                         metrics.wrap("slice", slice_lines(audio_file, temp_folder if export_clips else None, pcm_file)),
+                         metrics.wrap("transcribe", transcribe_lines(model_size, language, batch_size, cache)),
+                         metrics.wrap("write", write_lines(db_file)))
+    except Exception as err:
+        logging.error(f"Processing of '{audio_file}' failed - {err}")
         return False
-    # don't like this part
-    db_pipe = backend.fetch_project_lines(p_id, 99999)
-    logging.info(
-        "Created temp files for each singular line, this might be many, calling whisper now, embrace your GPU Ram!")
+    audio_s = len(pcm_cache.load(audio_file, pcm_file)) / util.SAMPLE_RATE
+    backend.update_project(p_id, status=2, length_ms=int(audio_s * 1000))
+    metrics.finish(backend, p_id, audio_s)
+    if cache:
+        logging.info(f"Transcription cache: {cache.stats()}")
+    return True
 
-    devices = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    model = whisper.load_model(model_size, device=devices)
 
-    for each in db_pipe:
-        crypt = util.transcribe_line(each, model, language)
-        if crypt:
-            backend.update_line(each['uid'],
-                                content=each['transcribe']['text'],
-                                language=each['transcribe'].get('language', "un"))
-            # TODO: delete file after processing and reference in db
-    backend.update_project(p_id, status=2)
+def prepare_files(db_file: str, pcm_folder="./pcm/", window_minutes=0) -> Callable:
+    """
+    Pipeline stage of the batch ingest, creates the project of a file, decodes it and diarizes it. What is
+    left for process_project is the transcription, it finds the diarization by the fingerprint
+    """
+    def prepare(files: Iterator[str]) -> Iterator[dict]:
+        backend = CryptDB(db_file)
+        try:
+            for audio_file in files:
+                started = time.perf_counter()
+                prepared = {"audio_file": audio_file, "audio_s": 0.0}
+                try:
+                    p_id, fingerprint, pcm_file = new_project(backend, audio_file, pcm_folder)
+                    prepared.update(project_id=p_id, fingerprint=fingerprint, pcm_file=pcm_file)
+                    prepared['audio_s'] = len(pcm_cache.load(audio_file, pcm_file)) / util.SAMPLE_RATE
+                    backend.update_project(p_id, length_ms=int(prepared['audio_s'] * 1000))
+                    if not backend.fetch_diarization(fingerprint):
+                        backend.save_diarization(p_id, fingerprint, list(diarize_file(audio_file, window_minutes)))
+                except Exception as err:  # one broken file does not stop the batch
+                    logging.error(f"Batch: preparing '{audio_file}' failed - {err}")
+                    prepared['error'] = str(err)
+                prepared['prepare_s'] = time.perf_counter() - started
+                yield prepared
+        finally:
+            backend.close()
+    return prepare
 
 
-def continue_from_refined(project_id: int, temp_folder, language):
+def cli_process_batch(pattern: str,
+                      language=None,
+                      temp_folder="./temp/",
+                      model_size="medium",
+                      db_file="transcrypts.db",
+                      export_clips=False,
+                      batch_size=16,
+                      cpu_workers=0,
+                      cache=None,
+                      coalesce=None,
+                      window_minutes=0,
+                      pcm_folder="./pcm/"):
+    """
+    Processes every audio file of a directory or glob in this one process. While one file is transcribed the
+    next one already gets decoded and diarized in the background, models stay loaded the whole time
+
+    :param str pattern: directory or glob, see util.audio_files
+    :return: list of dictionaries with the timings per file
+    """
+    files = util.audio_files(pattern)
+    if not files:
+        logging.warning(f"Batch: no audio files in '{pattern}'")
+        return []
+    logging.getLogger().addHandler(logging.StreamHandler())
+    logging.info(f"Batch: {len(files)} files from '{pattern}'")
+    backend = CryptDB(db_file)
+    pipe = Pipeline(maxsize=1)  # the next file waits prepared, the one after that is in preparation
+    report = []
+    started = time.perf_counter()
+    for prepared in pipe.run(files, prepare_files(db_file, pcm_folder, window_minutes)):
+        if 'error' not in prepared:
+            transcribing = time.perf_counter()
+            if not process_project(backend, prepared['project_id'], prepared['audio_file'], prepared['fingerprint'],
+                                   prepared['pcm_file'], language=language, temp_folder=temp_folder,
+                                   model_size=model_size, db_file=db_file, export_clips=export_clips,
+                                   batch_size=batch_size, cpu_workers=cpu_workers, cache=cache, coalesce=coalesce,
+                                   window_minutes=window_minutes, kind="batch"):
+                prepared['error'] = "transcription failed"
+            prepared['transcribe_s'] = time.perf_counter() - transcribing
+        report.append(prepared)
+    backend.close()
+    print_batch_report(report, time.perf_counter() - started)
+    return report
+
+
+def print_batch_report(report: list[dict], wall_s: float):
+    """
+    Real time factor per file, the time the file spent in preparation and transcription divided by its length,
+    below 1 is faster than real time. As the stages overlap the total is less than the sum of all files
+    """
+    print(f"{'file':<40} | {'audio':>8} | {'prepare':>8} | {'transcr.':>8} | {'RTF':>6}")
+    for each in report:
+        name = os.path.basename(each['audio_file'])[-40:]
+        if 'error' in each:
+            print(f"{name:<40} | failed - {each['error']}")
+            continue
+        busy = each['prepare_s'] + each['transcribe_s']
+        rtf = busy / each['audio_s'] if each['audio_s'] else 0.0
+        print(f"{name:<40} | {each['audio_s']:>7.0f}s | {each['prepare_s']:>7.1f}s | "
+              f"{each['transcribe_s']:>7.1f}s | {rtf:>6.3f}")
+    audio_s = sum(each['audio_s'] for each in report if 'error' not in each)
+    total = wall_s / audio_s if audio_s else 0.0
+    print(f"{len(report)} files, {audio_s:.0f}s of audio in {wall_s:.0f}s, overall RTF {total:.3f}")
+    logging.info(f"Batch: {len(report)} files, {audio_s:.0f}s of audio in {wall_s:.0f}s, overall RTF {total:.3f}")
+
+
+def print_run_metrics(rows: list):
+    """
+    One block per run, busy is the time a stage actually worked instead of waiting for its neighbours,
+    the rates are per busy second. RTF is wall time per second of audio, below 1 is faster than real time
+    """
+    if not rows:
+        print("No runs recorded yet")
+        return
+    run_id = None
+    for row in rows:
+        if row['run_id'] != run_id:
+            run_id = row['run_id']
+            print(f"\n== project {row['project_id']} | {row['kind']} | {row['model'] or '-'} | run {run_id} | "
+                  f"{row['created']}")
+            print(f"   {'stage':<11} | {'wall':>8} | {'busy':>8} | {'cpu':>8} | {'lines':>6} | {'lines/s':>8} | "
+                  f"{'audio s/s':>9} | {'peak RSS':>9}")
+        busy = row['busy_s'] or 0.0
+        rate = row['segments'] / busy if busy else 0.0
+        audio_rate = row['audio_s'] / busy if busy else 0.0
+        rss = f"{row['peak_rss_mb']:>6.0f} MB" if row['peak_rss_mb'] is not None else f"{'-':>9}"
+        print(f"   {row['stage']:<11} | {row['wall_s']:>7.1f}s | {busy:>7.1f}s | {row['cpu_s']:>7.1f}s | "
+              f"{row['segments']:>6} | {rate:>8.1f} | {audio_rate:>9.1f} | {rss}")
+        if row['stage'] == "total" and row['audio_s']:
+            print(f"   RTF {row['wall_s'] / row['audio_s']:.3f} for {row['audio_s']:.0f}s of audio")
+
+
+def resume_project(project_id: int,
+                   language=None,
+                   temp_folder="./temp/",
+                   model_size="medium",
+                   db_file="transcrypts.db",
+                   export_clips=False,
+                   batch_size=16,
+                   cpu_workers=0,
+                   cache=None,
+                   coalesce=None,
+                   window_minutes=0,
+                   pcm_folder="./pcm/"):
+    """
+    Picks a project up wherever it stopped. Every line knows its state and the state is written in the same
+    transaction as the text it stands for, so only unfinished lines get sliced and transcribed again and a
+    crash costs at most the batch that was in flight
+
+    A project that is still 'Unprocessed' has an incomplete diarization, its lines get dropped and it is
+    diarized again, with the transcription cache the lines that were done already come back for free
+
+    :param int project_id: existing project in any status
+    :return: true/false whether the project is transcribed now
+    """
     logging.info(f"Trying to continue a project, ID: {project_id}")
-    backend = CryptDB("transcrypts.db")
+    backend = CryptDB(db_file)
     project = backend.fetch_project(project_id)
-    if project['status'] != 1:
-        logging.warning(f"Can not continue {project_id} because its in the wrong status")
-        return False
-    db_pipe = backend.fetch_project_lines(project_id, 99999)
-    check = util.speech_parts(project['file_path'], db_pipe, temp_folder, backend)
-    if not check:
+    if not project:
         return False
-    # don't like this part
-    db_pipe = backend.fetch_project_lines(project_id, 99999)
-    logging.info(
-        "Created temp files for each singular line, this might be many, calling whisper now, embrace your GPU Ram!")
+    if project['status'] == 0:
+        logging.info(f"Project {project_id} never finished its diarization, starting that over")
+        backend.delete_project_lines(project_id)
+        fingerprint = util.file_fingerprint(project['file_path'])
+        pcm_file = project['pcm_path'] or pcm_cache.pcm_path(project['file_path'], pcm_folder, fingerprint)
+        backend.update_project(project_id, pcm_path=pcm_file)
+        return process_project(backend, project_id, project['file_path'], fingerprint, pcm_file, language,
+                               temp_folder, model_size, db_file, export_clips, batch_size, cpu_workers, cache,
+                               coalesce, window_minutes)  # a full run again, its RTF compares to any other
+    states = backend.count_line_states(project_id)
+    unfinished = sum(lines for state, lines in states.items() if state < CryptDB.LINE_TRANSCRIBED)
+    logging.info(f"Project {project_id}: " + ", ".join(
+        f"{lines} {CryptDB.line_state_map.get(state, state)}" for state, lines in sorted(states.items())))
+    if not unfinished:
+        logging.info(f"Nothing left to do for project {project_id}")
+        return True
+    columns = ("start_ms", "stop_ms", "speaker_id")
+    metrics = RunMetrics("resume", model_size, project_id)
+    metrics.expect(unfinished)
+    with metrics.stage("decode"):
+        samples = pcm_cache.project_samples(backend, project, pcm_folder)  # decoded only if there is no copy yet
+    if export_clips:
+        with metrics.stage("slice") as stage:
+            for each in util.speech_parts(project['file_path'], backend.iter_project_lines(
+                    project_id, columns=columns, below_state=CryptDB.LINE_SLICED), temp_folder, backend, samples):
+                stage.add(each)
+    logging.info(f"Handing {unfinished} unfinished lines to whisper, embrace your GPU Ram!")
+    transcribe_rows(backend, samples,
+                    backend.iter_project_lines(project_id, columns=columns, below_state=CryptDB.LINE_TRANSCRIBED),
+                    model_size, language, batch_size, cpu_workers, cache, metrics)
+    if project['status'] < 2:
+        backend.update_project(project_id, status=2)
+    # only part of the recording got transcribed, the real time factor is about the speech of that part
+    metrics.finish(backend, project_id, metrics.stages[-1].audio_s)
+    if cache:
+        logging.info(f"Transcription cache: {cache.stats()}")
+    return True
+
+
+# job options that are handed through from --enqueue to the worker, everything else is up to the worker
+job_options = ("language", "model_size", "export_clips", "temp_folder", "batch_size", "coalesce", "window_minutes")
 
-    devices = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    model = whisper.load_model("medium", device=devices)
 
-    for each in db_pipe:
-        crypt = util.transcribe_line(each, model, language)
-        if crypt:
-            backend.update_line(each['uid'],
-                                content=each['transcribe']['text'],
-                                language=each['transcribe'].get('language', "un"))
-            # TODO: delete file after processing and reference in db
-    backend.update_project(project_id, status=3)
+def job_params(args) -> dict:
+    """The processing options of the command line that travel with a job"""
+    return {"language": args.language, "model_size": args.modelsize, "export_clips": args.clips,
+            "temp_folder": args.tempfolder, "batch_size": args.batchsize, "window_minutes": args.window,
+            "coalesce": None if args.nocoalesce else {"max_gap_ms": args.mergegap, "min_length_ms": args.minlength}}
+
+
+def process_job(backend: CryptDB, job, worker: str, defaults: dict):
+    """
+    Does the work of one claimed job, a job that was claimed before resumes the project of the previous attempt
+
+    :param CryptDB backend: the connection of the worker
+    :param Job job: the claimed job
+    :param str worker: name of the worker, the project only gets assigned as long as it holds the lease
+    :param dict defaults: keyword arguments of the worker for process_project including db_file and pcm_folder,
+        the job options win
+    """
+    params = dict(defaults)
+    params.update({key: value for key, value in json.loads(job['options'] or "{}").items() if key in job_options})
+    pcm_folder = params.pop('pcm_folder', "./pcm/")
+    if job['project_id']:
+        done = resume_project(job['project_id'], pcm_folder=pcm_folder, **params)
+    else:
+        p_id, fingerprint, pcm_file = new_project(backend, job['file_path'], pcm_folder)
+        if not backend.assign_job_project(job['uid'], worker, p_id):
+            raise RuntimeError(f"job {job['uid']} got claimed by another worker")
+        done = process_project(backend, p_id, job['file_path'], fingerprint, pcm_file, **params)
+    if not done:
+        raise RuntimeError(f"processing '{job['file_path']}' failed, see the log")
 
 
 def cli():
@@ -207,6 +580,19 @@ def cli():
     processings.add_argument("-i", "--input", type=str, help="Input file, preferably .wav")
     processings.add_argument("-r", "--resume", type=int,
                         help="continues the given project_id if there is something to continue in that project")
+    processings.add_argument("-l", "--list", action="store_true", help="lists all projects in the database")
+    processings.add_argument("-e", "--export", type=int,
+                             help="writes the stage script of the given project_id to --output or stdout")
+    processings.add_argument("-m", "--metrics", type=int, nargs="?", const=0,
+                             help="timings of the last runs per stage, of the given project_id or of all projects")
+    processings.add_argument("-s", "--stems", type=int,
+                             help="writes one wav file per speaker of the given project_id, --output is the prefix")
+    processings.add_argument("-b", "--batch", type=str,
+                             help="processes all audio files of a directory or glob, eg. 'hearings/*.mp3'")
+    processings.add_argument("--enqueue", type=str, nargs="+",
+                             help="puts the given files into the job queue with the current options, see --worker")
+    processings.add_argument("--worker", action="store_true",
+                             help="keeps the models loaded and processes queued jobs until stopped")
     parser.add_argument("-o", "--output", type=str, help="theater style script with default names")
     parser.add_argument("--timestamps", action="store_true", help="adds timestamps in script")
     parser.add_argument("--modelsize", type=str, help="size of the whisper model", default="medium")
@@ -216,21 +602,135 @@ def cli():
                         help="json files with biases for specific languages")
     parser.add_argument("--tempfolder", type=str, default="./temp/",
                         help="Manually defines folder for temporary audiofiles")
+    parser.add_argument("--clips", action="store_true",
+                        help="additionally exports every line as wav file into the temp folder")
+    parser.add_argument("--preload", action="store_true",
+                        help="loads whisper and pyannote in the background right away so the first job does not wait")
+    parser.add_argument("--modelmemory", type=int,
+                        help="upper limit in MB for resident models, least recently used ones get unloaded")
+    parser.add_argument("--batchsize", type=int, default=16,
+                        help="number of lines whisper decodes at once, lower it if your GPU Ram runs out")
+    parser.add_argument("--cpuworkers", type=int, default=0,
+                        help="transcribes with that many cpu processes instead of the GPU, one model each")
+    parser.add_argument("--cache", type=str, default="transcache.db",
+                        help="sqlite file that remembers transcriptions of identical audio")
+    parser.add_argument("--cachesize", type=int, default=512,
+                        help="upper limit in MB for the transcription cache, least recently used entries go first")
+    parser.add_argument("--nocache", action="store_true", help="always transcribes, neither reads nor fills the cache")
+    parser.add_argument("--mergegap", type=int, default=500,
+                        help="turns of the same speaker closer than this many ms become one line")
+    parser.add_argument("--minlength", type=int, default=300,
+                        help="turns shorter than this many ms get absorbed by a neighbour or dropped")
+    parser.add_argument("--nocoalesce", action="store_true",
+                        help="every diarization turn becomes its own line, no merging at all")
+    parser.add_argument("--pcmfolder", type=str, default="./pcm/",
+                        help="folder for the decoded 16 kHz copies of the recordings, they get reused on every resume")
+    parser.add_argument("--window", type=float, default=0,
+                        help="diarizes in overlapping windows of that many minutes, keeps memory flat on long files")
+    parser.add_argument("--lease", type=int, default=300,
+                        help="seconds a worker may go without a sign of life before its job gets claimed again")
+    parser.add_argument("--drain", action="store_true", help="the worker exits once the queue is empty")
+    parser.add_argument("--progress", action="store_true",
+                        help="shows every stage with its lines done, RTF and ETA on the console while it runs")
+    parser.add_argument("--profile", action="store_true",
+                        help="writes cProfile stats and the biggest allocations of every stage next to the log")
 
 
     args = parser.parse_args()
 
     print(args)
 
+    if args.profile:
+        profiling.enable()
+    if args.progress:
+        progress.subscribe(progress.TerminalProgress())
+    if args.modelmemory:
+        registry.memory_limit = args.modelmemory * 1024 * 1024
+    if args.preload:
+        registry.preload(whisper_name=args.modelsize, auth_token=read_api_key())
+
+    if args.list:
+        backend = CryptDB(args.databasepath)
+        for project in backend.list_project(limit=-1):
+            status = CryptDB.status_map.get(project['status'], CryptDB.status_map[-1])
+            print(f"{project['uid']:>5} | {status:<12} | {project['num_lines'] or 0:>6} lines | "
+                  f"{project['given_name'] or ''} | {project['file_path'] or ''}")
+        backend.close()
+        return
+
+    if args.metrics is not None:
+        backend = CryptDB(args.databasepath)
+        print_run_metrics(backend.fetch_run_metrics(args.metrics or None))
+        backend.close()
+        return
+
+    if args.export:
+        params = {"project_id": args.export, "db_file": args.databasepath}
+        if args.output:
+            params['out_file'] = str(args.output)
+        if args.biases:
+            params['bias_file'] = str(args.biases)
+        if args.language:
+            params['language'] = str(args.language)
+        export_stage_script(**params)
+        return
+
+    if args.stems:
+        prefix = str(args.output) if args.output else os.path.join(str(args.tempfolder), f"project{args.stems}_")
+        export_project_stems(args.stems, prefix, args.databasepath, str(args.pcmfolder))
+        return
+
+    if args.enqueue:
+        backend = CryptDB(args.databasepath)
+        for each in args.enqueue:
+            if not os.path.exists(each):
+                logging.warning(f"'{each}' does not exist, not enqueued")
+                continue
+            job_id = backend.enqueue_job(os.path.abspath(each), job_params(args))  # workers might run elsewhere
+            print(f"{job_id:>5} | {each}")
+        backend.close()
+        return
+
+    if args.batch:
+        cache = None if args.nocache else TranscriptionCache(args.cache, max_mb=args.cachesize)
+        if not args.preload:  # whisper loads while the first file gets diarized
+            registry.preload(whisper_name=args.modelsize)
+        try:
+            cli_process_batch(str(args.batch), db_file=str(args.databasepath), cpu_workers=args.cpuworkers,
+                              cache=cache, pcm_folder=str(args.pcmfolder), **job_params(args))
+        finally:
+            if cache:
+                cache.close()
+        return
+
+    if args.worker:
+        logging.getLogger().addHandler(logging.StreamHandler())
+        cache = None if args.nocache else TranscriptionCache(args.cache, max_mb=args.cachesize)
+        defaults = dict(job_params(args), db_file=str(args.databasepath), cpu_workers=args.cpuworkers,
+                        cache=cache, pcm_folder=str(args.pcmfolder))
+        if not args.preload:  # a worker without resident models would be pointless
+            registry.preload(whisper_name=args.modelsize, auth_token=read_api_key())
+        worker = JobWorker(args.databasepath, lambda backend, job, name: process_job(backend, job, name, defaults),
+                           lease_s=args.lease)
+        try:
+            worker.run(drain=args.drain)
+        finally:
+            if cache:
+                cache.close()
+        return
+
     if args.textui or (not args.input and not args.resume):
         from tui import TCApp  # <- I googled a bit around, and it seems to be okay in this specific case
-        app = TCApp()
+        app = TCApp(str(args.databasepath), dict(job_params(args), cpu_workers=args.cpuworkers,
+                                                 pcm_folder=str(args.pcmfolder)))
         app.run()
 
-    if args.input:
-        params = {
-            "audio_file": str(args.input)
-        }
+    if args.input or args.resume:
+        params = {"db_file": str(args.databasepath)}
+        if args.input:
+            params['audio_file'] = str(args.input)
+        else:
+            params['project_id'] = args.resume
         if args.biases:
             params['bias_file'] = str(args.biases)
         if args.tempfolder:
@@ -239,13 +739,33 @@ def cli():
             params['language'] = str(args.language)
         if args.modelsize:
             params['model_size'] = str(args.modelsize)
-        if args.output:
+        if args.clips:
+            params['export_clips'] = True
+        if not args.nocache:
+            params['cache'] = TranscriptionCache(args.cache, max_mb=args.cachesize)
+        if not args.nocoalesce:
+            params['coalesce'] = {"max_gap_ms": args.mergegap, "min_length_ms": args.minlength}
+        if args.output and args.input:
             params['out_file'] = str(args.output)
+            params.pop('db_file')
             cli_process_plain(**params)
         else:
-            cli_process_db(**params)
+            if args.batchsize:
+                params['batch_size'] = int(args.batchsize)
+            if args.cpuworkers:
+                params['cpu_workers'] = int(args.cpuworkers)
+            if args.window:
+                params['window_minutes'] = float(args.window)
+            if args.pcmfolder:
+                params['pcm_folder'] = str(args.pcmfolder)
+            if args.input:
+                cli_process_db(**params)
+            else:
+                params.pop('bias_file', None)
+                resume_project(**params)
+        if params.get('cache', None):
+            params['cache'].close()
 
 
 if __name__ == "__main__":
     cli()
-    #continue_from_refined(2, ".\\temp\\", "de")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+pyannote likes to chop one person talking into a dozen turns with tiny pauses in between and sprinkles
+67 ms slivers of somebody else over it. Every one of them would be its own line and its own whisper call,
+and whisper does not exactly shine on a single syllable either. This runs between the diarization and the
+database and glues all of that into proper lines.
+
+Every resulting segment carries 'turns', the positions of the diarization turns it is made of, in the
+order pyannote delivered them, which is also the order they are stored in the diarization table.
+"""
+
+import logging
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+def coalesce_segments(segments: Iterable[dict], max_gap_ms=500, min_length_ms=300,
+                      max_length_ms=30000) -> Iterator[dict]:
+    """
+    Streams over diarized segments ordered by start and yields merged ones. Turns of the same speaker
+    close to each other are merged, a sliver is swallowed by the segment right before or after it if it
+    is close enough, no matter whose it is, and dropped otherwise
+
+    :param segments: iterable of dictionaries with 'start_ms', 'stop_ms' and 'speaker_id'
+    :param int max_gap_ms: turns of the same speaker with at most this much silence in between become one
+    :param int min_length_ms: shorter turns are slivers, they get absorbed by a neighbour or dropped, 0 keeps all
+    :param int max_length_ms: merged segments do not grow beyond this, 30 s keeps them in one whisper window
+    :return: iterator of dictionaries with 'start_ms', 'stop_ms', 'speaker_id' and 'turns'
+    """
+    current = None
+    held = []  # slivers that did not reach the segment before them, maybe they reach the next one
+    count = merged = dropped = 0
+
+    def fits(seg: dict, start_ms: int, stop_ms: int) -> bool:
+        return (start_ms - seg['stop_ms'] <= max_gap_ms
+                and max(seg['stop_ms'], stop_ms) - seg['start_ms'] <= max_length_ms)
+
+    for turn, each in enumerate(segments):
+        count += 1
+        start, stop = each['start_ms'], each['stop_ms']
+        sliver = stop - start < min_length_ms
+        if current and not held and (sliver or each['speaker_id'] == current['speaker_id']) \
+                and fits(current, start, stop):
+            current['stop_ms'] = max(current['stop_ms'], stop)
+            current['turns'].append(turn)
+            merged += 1
+            continue
+        if sliver:
+            held.append((turn, each))
+            continue
+        if current:
+            yield current
+        current = {"start_ms": start, "stop_ms": stop, "speaker_id": each['speaker_id'], "turns": [turn]}
+        # held slivers are ordered by start, only the tail that is close enough can be taken along
+        reach = start
+        for held_turn, held_each in reversed(held):
+            if reach - held_each['stop_ms'] > max_gap_ms \
+                    or current['stop_ms'] - held_each['start_ms'] > max_length_ms:
+                break
+            current['start_ms'] = min(current['start_ms'], held_each['start_ms'])
+            current['turns'].insert(0, held_turn)
+            reach = held_each['start_ms']
+            held.pop()
+            merged += 1
+        dropped += len(held)
+        held = []
+    if current:
+        yield current
+    dropped += len(held)
+    logger.info(f"Coalesce: {count} turns, {merged} merged into others, {dropped} slivers dropped")
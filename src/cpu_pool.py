@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+For machines with many cores and no GPU. A single torch model does not really scale over all cores,
+several processes with one model each and a handful of threads each do. The decoded audio is put into
+shared memory once, the workers only get told which part of it they should look at.
+"""
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator
+
+from batch_transcribe import BatchTranscriber, SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+_worker = {}  # per process state, filled by _init_worker
+
+
+def load_cpu_whisper(model_size: str):
+    import whisper
+    return whisper.load_model(model_size, device="cpu")
+
+
+def _init_worker(shm_name: str, num_samples: int, loader, loader_args: tuple, language, threads: int):
+    """Runs once per worker process, pins the torch threads, attaches the audio and loads the model"""
+    import numpy as np
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except ImportError:  # only the stub model gets along without torch
+        pass
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm  # has to stay referenced or the buffer goes away under our feet
+    _worker['samples'] = np.ndarray((num_samples,), dtype=np.float32, buffer=shm.buf)
+    _worker['engine'] = BatchTranscriber(loader(*loader_args), language=language, batch_size=4, fp16=False)
+
+
+def _transcribe_shard(shard: list[tuple]) -> list[tuple]:
+    """
+    :param shard: list of (uid, start_ms, stop_ms)
+    :return: list of (uid, whisper result dict)
+    """
+    samples = _worker['samples']
+    sliced = ((uid, samples[start_ms * SAMPLE_RATE // 1000:stop_ms * SAMPLE_RATE // 1000])
+              for uid, start_ms, stop_ms in shard)
+    return list(_worker['engine'].transcribe_lines(sliced))
+
+
+def transcribe_cpu_pool(samples,
+                        lines: Iterable[dict],
+                        model_size="medium",
+                        language=None,
+                        workers=None,
+                        threads=None,
+                        shard_size=8,
+                        loader=load_cpu_whisper,
+                        loader_args=None,
+                        cache=None) -> Iterator[tuple]:
+    """
+    Shards the lines over `workers` processes that each keep one model loaded, results are yielded in
+    the order they finish, not in the order of the lines. Cached lines are answered right here and
+    never reach a worker
+
+    :param numpy.ndarray samples: 16 kHz mono float32 audio of the whole recording
+    :param lines: iterable of dicts with at least 'uid', 'start_ms' and 'stop_ms'
+    :param str model_size: whisper model size, every worker loads its own
+    :param str language: optional language code, None lets whisper detect it
+    :param int workers: number of processes, by default one per four cores
+    :param int threads: torch intra-op threads per worker, by default cores divided by workers
+    :param int shard_size: lines per task, small shards balance better, big ones have less overhead
+    :param loader: picklable callable that loads the model inside the worker
+    :param tuple loader_args: arguments for the loader, by default (model_size,)
+    :param TranscriptionCache cache: optional, only the main process reads and writes it
+    :return: iterator of (uid, whisper result dict)
+    """
+    import numpy as np
+
+    cores = os.cpu_count() or 1
+    workers = workers or max(1, cores // 4)
+    threads = threads or max(1, cores // workers)
+    loader_args = loader_args if loader_args is not None else (model_size,)
+    samples = np.ascontiguousarray(samples, dtype=np.float32)
+    # same options as the engines inside the workers, a cpu run without the pool shares these entries
+    options = {"fp16": False, "without_timestamps": True}
+    keys = {}
+    shards = []
+    for each in lines:
+        if cache:
+            start, stop = int(each['start_ms']), int(each['stop_ms'])
+            key = cache.make_key(samples[start * SAMPLE_RATE // 1000:stop * SAMPLE_RATE // 1000],
+                                 model_size, language, options)
+            cached = cache.get(key)
+            if cached is not None:
+                yield each['uid'], cached
+                continue
+            keys[each['uid']] = key
+        if not shards or len(shards[-1]) >= shard_size:
+            shards.append([])
+        shards[-1].append((each['uid'], int(each['start_ms']), int(each['stop_ms'])))
+    if not shards:
+        return
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, samples.nbytes))
+    try:
+        np.ndarray(samples.shape, dtype=np.float32, buffer=shm.buf)[:] = samples
+        logger.info(f"CPUPool: {len(shards)} shards on {workers} workers with {threads} threads each")
+        # torch and fork do not like each other, spawn is slower to start but safe
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(shm.name, len(samples), loader, loader_args, language, threads)) as pool:
+            futures = [pool.submit(_transcribe_shard, shard) for shard in shards]
+            for future in as_completed(futures):
+                for uid, result in future.result():
+                    if uid in keys:
+                        cache.put(keys.pop(uid), result)
+                    yield uid, result
+    finally:
+        shm.close()
+        shm.unlink()
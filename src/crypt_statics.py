@@ -52,6 +52,79 @@ db_schema['speaker'] = """CREATE TABLE IF NOT EXISTS speaker (
                         speaker_id TEXT NOT NULL,
                         name TEXT NOT NULL
                         );"""
+db_schema['schema_version'] = """CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER NOT NULL,
+                        applied TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        );"""
+
+# applied on every connection, WAL lets the TUI read while the CLI writes
+db_pragmas = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # in WAL mode still safe against application crashes, only power loss may cost the last commits
+    "cache_size": -65536,  # negative means KiB, so 64 MiB
+    "mmap_size": 268435456,  # 256 MiB
+    "temp_store": "MEMORY",
+    "foreign_keys": "OFF",  # previous/next get written before their target exists
+}
+
+# forward only, each entry (version, [statements]) runs once in its own transaction, never change an existing one,
+# append a new version instead
+db_migrations = [
+    (1, ["CREATE INDEX IF NOT EXISTS idx_line_project_start ON line(project_id, start_ms)"]),
+    (2, ["DELETE FROM speaker WHERE uid NOT IN (SELECT MIN(uid) FROM speaker GROUP BY project_id, speaker_id)",
+         "CREATE UNIQUE INDEX IF NOT EXISTS idx_speaker_project_speaker ON speaker(project_id, speaker_id)"]),
+    (3, ["""CREATE TABLE IF NOT EXISTS diarization (
+            uid INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER REFERENCES project(uid),
+            fingerprint TEXT NOT NULL,
+            num_segments INTEGER,
+            segments TEXT NOT NULL,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );""",
+         "CREATE INDEX IF NOT EXISTS idx_diarization_fingerprint ON diarization(fingerprint)",
+         "CREATE UNIQUE INDEX IF NOT EXISTS idx_diarization_project ON diarization(project_id)"]),
+    # positions of the diarization turns a line is made of as json list, see coalesce.py
+    (4, ["ALTER TABLE line ADD COLUMN turns TEXT"]),
+    # decoded 16 kHz mono float32 copy of the recording, see pcm_cache.py
+    (5, ["ALTER TABLE project ADD COLUMN pcm_path TEXT"]),
+    # how far a line got, see CryptDB.line_state_map, lines from before only tell by their content
+    (6, ["ALTER TABLE line ADD COLUMN state INTEGER NOT NULL DEFAULT 0",
+         "UPDATE line SET state = 2 WHERE content IS NOT NULL",
+         "UPDATE line SET state = 1 WHERE content IS NULL AND sub_file_path IS NOT NULL",
+         "CREATE INDEX IF NOT EXISTS idx_line_project_state ON line(project_id, state)"]),
+    # work queue for --enqueue and --worker, lease_until is a unix timestamp, see CryptDB.claim_job
+    (7, ["""CREATE TABLE IF NOT EXISTS job (
+            uid INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_path TEXT NOT NULL,
+            options TEXT,
+            status INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            project_id INTEGER REFERENCES project(uid),
+            error TEXT,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished TIMESTAMP
+            );""",
+         "CREATE INDEX IF NOT EXISTS idx_job_status ON job(status, uid)"]),
+    # one row per stage of a run plus one with stage 'total', see metrics.py
+    (8, ["""CREATE TABLE IF NOT EXISTS run_metrics (
+            uid INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            project_id INTEGER REFERENCES project(uid),
+            kind TEXT,
+            model TEXT,
+            stage TEXT NOT NULL,
+            wall_s REAL,
+            busy_s REAL,
+            cpu_s REAL,
+            segments INTEGER,
+            audio_s REAL,
+            peak_rss_mb REAL,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );""",
+         "CREATE INDEX IF NOT EXISTS idx_run_metrics_project ON run_metrics(project_id, run_id)"]),
+]
 
 if __name__ == "__name__":
     print("This is a static config file, dont execute it please, you are scaring the bits and bytes.")
@@ -23,9 +23,12 @@ import os
 import sqlite3
 import logging
 import json
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
-from crypt_statics import db_schema
+from crypt_statics import db_schema, db_pragmas, db_migrations
+from dto import Project, Line, Speaker, Job, RunMetric
 
 logger = logging.getLogger(__name__)
 
@@ -34,25 +37,83 @@ class CryptDB:
 
     status_map = {0: "Unprocessed", 1: "Annotated", 2: "Transcribed", 3: "Done", -1: "Unknown"}
 
+    # per line progress, a line only ever moves up, resume picks up everything below LINE_TRANSCRIBED
+    LINE_REGISTERED, LINE_SLICED, LINE_TRANSCRIBED = 0, 1, 2
+    line_state_map = {LINE_REGISTERED: "Registered", LINE_SLICED: "Sliced", LINE_TRANSCRIBED: "Transcribed"}
+
+    job_status_map = {0: "Queued", 1: "Running", 2: "Done", 3: "Failed"}
+
+    line_parameters = {"content": str, "length_ms": int, "language": str, "start_ms": int, "stop_ms": int,
+                       "previous": int, "next": int, "sub_file_path": str, "speaker_id": str, "project_id": int,
+                       "turns": str, "state": int}
+
     def __init__(self, filepath: str, dummy=False):
         self.db = None
         self.cur = None
+        self._batch = None  # uid: pending columns of the line while inside `with batch()`
+        self._batch_size = 0
         self._open(filepath)
 
     def _open(self, db_path: str) -> bool:
         if not os.path.exists(db_path):
             logger.warning(f"CryptDB: db file '{db_path}' does not exist, creating one")
-            self.db = sqlite3.connect(db_path)
+            self.db = sqlite3.connect(db_path, timeout=30)
             self.db.row_factory = sqlite3.Row  # ! changes behaviour of all future cursors
             self.cur = self.db.cursor()
+            self._apply_pragmas()
             self._create_scheme()
         else:
             try:
-                self.db = sqlite3.connect(f"file:{db_path}?mode=rw", uri=True)
+                self.db = sqlite3.connect(f"file:{db_path}?mode=rw", uri=True, timeout=30)
                 self.db.row_factory = sqlite3.Row  # ! changes behaviour of all future cursors
                 self.cur = self.db.cursor()
+                self._apply_pragmas()
             except sqlite3.OperationalError as err:
                 logger.error(f"CryptDB-Exception: {err}")
+                return False
+        return self._migrate()
+
+    def _apply_pragmas(self):
+        for pragma, value in db_pragmas.items():
+            try:
+                self.cur.execute(f"PRAGMA {pragma} = {value}")
+            except sqlite3.Error as err:
+                logger.warning(f"CryptDB: could not set pragma {pragma} - {err}")
+
+    def _migrate(self) -> bool:
+        """
+        Brings older database files up to the current schema, every migration that has not been applied yet
+        runs in its own transaction and gets recorded in `schema_version`. Several workers might open the same
+        file at once, so each migration takes the write lock first and looks again whether somebody else was
+        faster, ALTER TABLE cannot be run twice
+
+        :return: false if a migration failed, the file stays at the last good version then
+        """
+        self.cur.execute(db_schema['schema_version'])
+        self.db.commit()
+        current = self.schema_version()
+        for version, statements in db_migrations:
+            if version <= current:
+                continue
+            try:
+                self.cur.execute("BEGIN IMMEDIATE")
+                current = self.schema_version()
+                if version <= current:
+                    self.db.rollback()
+                    continue
+                for statement in statements:
+                    self.cur.execute(statement)
+                self.cur.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+                self.db.commit()
+                logger.info(f"CryptDB: migrated schema to version {version}")
+            except sqlite3.Error as err:
+                self.db.rollback()
+                logger.error(f"CryptDB|Migration: could not migrate to version {version} - {err}")
+                return False
+        return True
+
+    def schema_version(self) -> int:
+        return self.cur.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
 
     def _create_scheme(self):
         for value in db_schema.values():
@@ -68,21 +129,97 @@ class CryptDB:
                 logger.error(f"CryptDB|Error: {err}")
         self.db.commit()
 
-    def fetch_project(self, project_id: int) -> dict:  # TODO: develop project Data Transfer Object
+    def _commit(self):
+        """Commits, unless we are inside a batch, then the batch decides when"""
+        if self._batch is None:
+            self.db.commit()
+
+    @contextmanager
+    def batch(self, size=500):
+        """
+        Unit of work for many small writes. Inside the `with` block update_line only collects its changes,
+        several updates of the same line merge into one and the last value of a column wins. Once `size`
+        lines have changes they get written with executemany in a single transaction. All other
+        writing methods skip their commit and become part of the running transaction. On leaving the block
+        everything that is left gets flushed, even if the block raised, the work done so far is kept. A flush
+        that fails rolls back and raises its sqlite3.Error, out of update_line or out of the `with`, as the
+        updates it held are gone the caller has to know.
+
+        Fetches inside the block do not see updates that are not flushed yet, call flush() before if needed
+
+        with backend.batch(1000):
+            for each in lines:
+                backend.update_line(each['uid'], content=...)
+
+        :param int size: number of lines with collected updates that trigger a flush
+        """
+        if self._batch is not None:  # nested batch, the outer one is in charge
+            yield self
+            return
+        self._batch = {}
+        self._batch_size = max(1, int(size))
+        try:
+            yield self
+        finally:
+            try:
+                self.flush()
+            finally:
+                self._batch = None
+
+    def flush(self) -> int:
+        """
+        Writes all collected line updates in one transaction
+
+        :return: number of rows that actually got updated
+        :raises sqlite3.Error: if the transaction failed, none of the collected updates got written then
+        """
+        if self._batch is None:
+            return 0
+        pending, self._batch = self._batch, {}
+        grouped = {}  # every line is in there once, so the order of the groups does not matter
+        for line_id, update in pending.items():
+            grouped.setdefault(tuple(update.keys()), []).append(tuple(update.values()) + (line_id,))
+        changed = 0
+        try:
+            for columns, rows in grouped.items():
+                query = "UPDATE line SET " + " = ?, ".join(columns) + " = ? WHERE uid = ?"
+                self.cur.executemany(query, rows)
+                changed += self.cur.rowcount
+            self.db.commit()
+        except sqlite3.Error as err:
+            self.db.rollback()
+            logger.error(f"CryptDB|Sqlite3Error: couldn't flush the updates of {len(pending)} lines - {err}")
+            raise
+        if changed < len(pending):
+            logger.warning(f"CryptDB: flushed updates of {len(pending)} lines but only {changed} existed")
+        return changed
+
+    def _query(self, dto, query: str, params: tuple) -> sqlite3.Cursor:
+        """
+        Executes on a fresh cursor whose rows come out as the given DTO instead of sqlite3.Row
+
+        :param dto: Project, Line or Speaker
+        :return: the cursor, ready for fetching
+        """
+        cursor = self.db.cursor()
+        cursor.execute(query, params)
+        cursor.row_factory = dto.row_factory(cursor.description)  # applies to fetching, not executing
+        return cursor
+
+    def fetch_project(self, project_id: int) -> Project:
         """
         Fetches a singular project with the exact, given unique id
 
         :param project_id: unique identifier for a line
-        :return: a dictionary with `column_name: column_value` notation
-        :rtype: dict
+        :return: the project, or an empty dictionary if there is none
+        :rtype: Project
         """
         query = "SELECT * FROM project WHERE uid = ? LIMIT 1"
-        self.cur.execute(query, (project_id,))
-        row = self.cur.fetchone()
-        if not row or len(row) <= 0:
+        row = self._query(Project, query, (project_id,)).fetchone()
+        if not row:
             logger.error(f"CryptDB: Can not fetch project '{project_id}' because it does not exist")
             return {}
-        return {key: row[key] for key in row.keys()}
+        return row
 
     def list_project(self, limit=20, **kwargs) -> list[dict]:
         """
@@ -93,8 +230,8 @@ class CryptDB:
         :key max_speakers: int, maximum amount of speakers, equals 'x <= ?'
         :key min_speakers: int, minimum amount of speakers, equals 'x >= ?'
         :key speakers: int, exact number of speakers, equals 'x = ?'
-        :return: a list of dictionaries that are in the format `column_name: column_value`
-        :rtype: list(dict)
+        :return: a list of projects
+        :rtype: list[Project]
         """
         parameters = {
             "num_speaker": {
@@ -106,48 +243,88 @@ class CryptDB:
         query = "SELECT * FROM project"
         query += " LIMIT ?"
         try:
-            self.cur.execute(query, (limit, ))
-            all_rows = self.cur.fetchall()
+            return self._query(Project, query, (limit, )).fetchall()
         except sqlite3.Error as err:
             logger.error(f"CryptDB: Can not list projects because: '{err}'\n Query: '{query}'")
             return []
-        return [{key: row[key] for key in row.keys()} for row in all_rows]
 
-    def fetch_line(self, line_id: int) -> dict:  # TODO: develop line DTO
+    def fetch_line(self, line_id: int) -> Line:
         """
         Fetches a singular line with the exact, given unique id
 
         :param line_id: unique identifier for a line
-        :return: a dictionary with `column_name: column_value` notation
-        :rtype: dict
+        :return: the line, or an empty dictionary if there is none
+        :rtype: Line
         """
         query = "SELECT * FROM line WHERE uid = ? LIMIT 1"
-        self.cur.execute(query, (line_id,))
-        row = self.cur.fetchone()
-        if not row or len(row) <= 0:
+        row = self._query(Line, query, (line_id,)).fetchone()
+        if not row:
             logger.error(f"CryptDB: Can not fetch line '{line_id}' because it does not exist")
             return {}
-        return {key: row[key] for key in row.keys()}
+        return row
 
-    def fetch_project_lines(self, project_id: int, limit=500) -> list[dict]:
+    def fetch_project_lines(self, project_id: int, limit=500) -> list[Line]:
         """
-        Fetches as many as `limit` lines belonging to a project
+        Fetches as many as `limit` lines belonging to a project, ordered by their start. For anything that
+        wants all lines of a project use iter_project_lines
 
         :param int project_id: existing id of a project
         :param int limit: maximum number of lines per this query, default = 500
-        :return: list of line dictionaries with `column_name: column_value` notation
-        :rtype: list[dict]
+        :return: list of lines
+        :rtype: list[Line]
         """
-        query = "SELECT * FROM line WHERE project_id = ? LIMIT ?"
+        query = "SELECT * FROM line WHERE project_id = ? ORDER BY start_ms, uid LIMIT ?"
         try:
-            self.cur.execute(query, (project_id, limit))
-            all_rows = self.cur.fetchall()
+            return self._query(Line, query, (project_id, limit)).fetchall()
         except sqlite3.Error as err:
             logger.error(f"CryptDB: Can not list project lines because: '{err}'")
             return []
-        return [{key: row[key] for key in row.keys()} for row in all_rows]
 
-    def fetch_speaker(self, project_id: int, speaker_id: str) -> dict:  # TODO: develop speaker DTO
+    def iter_project_lines(self, project_id: int, page_size=1000, columns=None, below_state=None):
+        """
+        Streams all lines of a project ordered by start_ms with keyset pagination, only one page is in memory
+        at any time and every page is a cheap index seek, no matter how deep into the project it is. Writes
+        between two pages are fine, every page uses its own cursor
+
+        :param int project_id: existing id of a project
+        :param int page_size: number of lines per query
+        :param columns: optional iterable of column names, 'uid' and 'start_ms' are always included
+        :param int below_state: only lines whose state is lower, eg. LINE_TRANSCRIBED for all unfinished ones
+        :return: iterator of lines, with a projection only the selected fields are set
+        """
+        if columns:
+            unknown = set(columns) - set(self.line_parameters) - {"uid"}
+            if unknown:
+                logger.error(f"CryptDB: Can not stream lines, unknown columns: {', '.join(sorted(unknown))}")
+                return
+            selected = ["uid", "start_ms"] + [c for c in columns if c not in ("uid", "start_ms")]
+        else:
+            selected = ["*"]
+        base = f"SELECT {', '.join(selected)} FROM line WHERE project_id = ?"
+        params = (project_id,)
+        if below_state is not None:
+            base += " AND state < ?"
+            params += (below_state,)
+        # lines without a start come first, like ORDER BY would do it, (NULL, uid) cannot be compared though
+        pages = (
+            (base + " AND start_ms IS NULL AND uid > ? ORDER BY uid LIMIT ?",
+             lambda row: (row['uid'],), (-1,)),
+            (base + " AND (start_ms, uid) > (?, ?) ORDER BY start_ms, uid LIMIT ?",
+             lambda row: (row['start_ms'], row['uid']), (float("-inf"), -1)),
+        )
+        for query, key, after in pages:
+            while True:
+                try:
+                    rows = self._query(Line, query, (*params, *after, page_size)).fetchall()
+                except sqlite3.Error as err:
+                    logger.error(f"CryptDB: Can not stream project lines because: '{err}'")
+                    return
+                yield from rows
+                if len(rows) < page_size:
+                    break
+                after = key(rows[-1])
+
+    def fetch_speaker(self, project_id: int, speaker_id: str) -> Speaker:
         """
         Fetches a singular speaker alias row with the exact given project_id and speaker_id
 
@@ -155,30 +332,27 @@ class CryptDB:
 
         :param project_id: unique identifier for a specific project
         :param speaker_id: text speaker id, assigned by pyannotate
-        :return: a dictionary with `column_name: column_value` notation
-        :rtype: dict
+        :return: the speaker, or an empty dictionary if there is none
+        :rtype: Speaker
         """
         query = "SELECT * FROM speaker WHERE project_id = ? and speaker_id = ? LIMIT 1"
         try:
-            self.cur.execute(query, (project_id, speaker_id))
-            row = self.cur.fetchone()
+            row = self._query(Speaker, query, (project_id, speaker_id)).fetchone()
         except sqlite3.Error as err:
             logger.error(f"CryptDB: Can not fetch speaker 'Proj:{project_id}-{speaker_id}' because: '{err}'")
             return []
-        if not row or len(row) <= 0:
+        if not row:
             logger.error(f"CryptDB: Can not fetch speaker 'Proj:{project_id}-{speaker_id}' because it does not exist")
             return {}
-        return {key: row[key] for key in row.keys()}
+        return row
 
-    def fetch_project_speaker(self, project_id:int) -> list[dict]:
+    def fetch_project_speaker(self, project_id:int) -> list[Speaker]:
         query = "SELECT * FROM speaker WHERE project_id = ?"
         try:
-            self.cur.execute(query, (project_id, ))
-            all_rows = self.cur.fetchall()
+            return self._query(Speaker, query, (project_id, )).fetchall()
         except sqlite3.Error as err:
             logger.error(f"CryptDB: Can not list project speakers because: '{err}'")
             return []
-        return [{key: row[key] for key in row.keys()} for row in all_rows]
 
     def create_project(self, **kwargs) -> int:
         """
@@ -191,11 +365,12 @@ class CryptDB:
         :key status: int, current processing status
         :key num_lines: int, number of detected audio lines
         :key num_true_lines: int, number of detected audio lines with actual content
+        :key pcm_path: str, path to the decoded copy of the audio file
         :return: the uid of the newly created project
         :rtype: int
         """
         parameters = {"given_name": str, "num_speakers": int, "length_ms": int, "file_path": str,
-                      "status": int, "num_lines": int, "num_true_lines": int}
+                      "status": int, "num_lines": int, "num_true_lines": int, "pcm_path": str}
         insert = {}
         for key, value in kwargs.items():
             if key in parameters:
@@ -209,7 +384,7 @@ class CryptDB:
             self.cur.execute(query, tuple(insert.values()))
             # row = self.cur.fetchone()  # if only RETURNING uid would work
             inserted_id = self.cur.lastrowid if self.cur.lastrowid else -1
-            self.db.commit()
+            self._commit()
             return inserted_id
         except sqlite3.Error as err:
             logger.error(f"CryptDB|Sqlite3Error: Couldn't create new project - {err}\n Query: '{query}'")
@@ -226,6 +401,7 @@ class CryptDB:
         :key status: int, current processing status
         :key num_lines: int, number of detected audio lines
         :key num_true_lines: int, number of detected audio lines with actual content
+        :key pcm_path: str, path to the decoded copy of the audio file
         :return:
         """
         # check if the project actually exists
@@ -235,7 +411,7 @@ class CryptDB:
             logger.warning(f"CryptDB: Cannot update project '{project_id}' because it does not exist")
             return False
         parameters = {"given_name": str, "num_speakers": int, "length_ms": int, "file_path": str,
-                      "status": int, "num_lines": int, "num_true_lines": int}
+                      "status": int, "num_lines": int, "num_true_lines": int, "pcm_path": str}
         update = {}
         for key, value in kwargs.items():
             if key in parameters:
@@ -250,11 +426,59 @@ class CryptDB:
         query += " WHERE uid = ?"
         try:
             self.cur.execute(query, (tuple(update.values()) + (project_id, )))
-            self.db.commit()
+            self._commit()
+            return True
         except sqlite3.Error as err:
             logger.error(f"CryptDB|Sqlite3Error: couldn't update project - {project_id} - {err}\n Query: '{query}'")
             return False
 
+    def save_diarization(self, project_id: int, fingerprint: str, segments: list[dict]) -> bool:
+        """
+        Keeps the raw pyannote segments of a project, so the same recording never has to be diarized twice.
+        A project has at most one, saving again replaces it
+
+        :param int project_id: existing uid from the database
+        :param str fingerprint: util.file_fingerprint of the audio file
+        :param segments: list of dictionaries with 'start_ms', 'stop_ms' and 'speaker_id'
+        :return: True if it got saved
+        """
+        compact = [[each['start_ms'], each['stop_ms'], each['speaker_id']] for each in segments]
+        query = """INSERT OR REPLACE INTO diarization (project_id, fingerprint, num_segments, segments)
+                   VALUES (?, ?, ?, ?)"""
+        try:
+            self.cur.execute(query, (project_id, fingerprint, len(compact), json.dumps(compact, separators=(",", ":"))))
+            self._commit()
+            return True
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB|Sqlite3Error: couldn't save diarization of project {project_id} - {err}")
+            return False
+
+    def fetch_diarization(self, fingerprint: str) -> list[dict]:
+        """
+        Newest stored diarization of any project whose audio has the given fingerprint
+
+        :param str fingerprint: util.file_fingerprint of the audio file
+        :return: list of dictionaries with 'start_ms', 'stop_ms' and 'speaker_id', empty if that file is unknown
+        """
+        query = "SELECT segments FROM diarization WHERE fingerprint = ? ORDER BY uid DESC LIMIT 1"
+        try:
+            row = self.cur.execute(query, (fingerprint,)).fetchone()
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB|Sqlite3Error: couldn't fetch diarization '{fingerprint}' - {err}")
+            return []
+        if not row:
+            return []
+        return [{"start_ms": start, "stop_ms": stop, "speaker_id": speaker}
+                for start, stop, speaker in json.loads(row['segments'])]
+
+    def fetch_project_fingerprint(self, project_id: int) -> str:
+        """
+        :return: fingerprint of the audio the project got diarized from, empty if it never was
+        """
+        query = "SELECT fingerprint FROM diarization WHERE project_id = ? LIMIT 1"
+        row = self.cur.execute(query, (project_id,)).fetchone()
+        return row['fingerprint'] if row else ""
+
     def create_line(self, project_id: int, speaker_id: str, **kwargs) -> int:
         """
         Creates a 'line', words spoken from a singular speaker, divided by the detection of another speaker
@@ -269,6 +493,8 @@ class CryptDB:
         :key previous: int, UID of the line that is logically before this one
         :key next: int, UID of the line that logically after this one
         :key sub_file_path: str, path to the temporally audio file created while processing
+        :key turns: list[int], positions of the diarization turns this line got coalesced from
+        :key state: int, processing state, see line_state_map
         :return:
         """
         # check if the project actually exists
@@ -279,7 +505,9 @@ class CryptDB:
             return -1
         insert = {"speaker_id": speaker_id, "project_id": project_id}
         parameters = {"content": str, "length_ms": int, "language": str, "start_ms": int, "stop_ms": int,
-                      "previous": int, "sub_file_path": str}  # ,"next": int  # logically you cannot know which ID the next one got
+                      "previous": int, "sub_file_path": str, "turns": str, "state": int}  # ,"next": int  # logically you cannot know which ID the next one got
+        if isinstance(kwargs.get('turns', None), list):
+            kwargs['turns'] = self._turns_text(kwargs['turns'])
         for key, value in kwargs.items():
             if key in parameters:
                 if isinstance(value, parameters[key]):
@@ -292,7 +520,7 @@ class CryptDB:
         try:
             self.cur.execute(query, tuple(insert.values()))
             inserted_id = self.cur.lastrowid if self.cur.lastrowid else -1
-            self.db.commit()
+            self._commit()
             return inserted_id
         except sqlite3.Error as err:
             logger.error(f"CryptDB|Sqlite3Error: couldn't insert line for - {project_id} - {err}\n Query: '{query}'")
@@ -300,13 +528,15 @@ class CryptDB:
 
     def create_bulk_line(self, project_id, refined_pipe: list[dict]) -> bool:
         """
-        Takes a refined-pipe dictionary from the pyannotate input and creates the appropriate amount of entries
+        Takes a refined-pipe dictionary from the pyannotate input and creates the appropriate amount of entries,
+        the previous/next links of the whole project get rebuilt in the same transaction
 
         :param int project_id: existing uid from the database
-        :param refined_pipe: dictionary with keys ['start_ms', 'stop_ms', 'speaker_id']
+        :param refined_pipe: dictionary with keys ['start_ms', 'stop_ms', 'speaker_id'] and optionally 'turns'
         :return: true/false whether the operation succeded or not
         """
-        query = "INSERT INTO line (project_id, start_ms, stop_ms, length_ms, speaker_id) VALUES (?, ?, ?, ?, ?)"
+        query = """INSERT INTO line (project_id, start_ms, stop_ms, length_ms, speaker_id, turns)
+                   VALUES (?, ?, ?, ?, ?, ?)"""
         speaker_set = set()
         [speaker_set.add(e['speaker_id']) for e in refined_pipe]  # comprehension abuse, yeah
         for each in speaker_set:
@@ -317,23 +547,82 @@ class CryptDB:
                                   e['start_ms'],
                                   e['stop_ms'],
                                   e['stop_ms']-e['start_ms'],
-                                  e['speaker_id'])
+                                  e['speaker_id'],
+                                  self._turns_text(e.get('turns', None)))
                                   for e in refined_pipe]
                                  )
-            self.db.commit()
+            self._reorder(project_id)
+            self._commit()
             return True
         except sqlite3.Error as err:
             logger.error(f"CryptDB|Sqlite3Error: couldn't insert line for - {project_id} - {err}")
             return False
 
-    def reorder_lines(self, project_id: int):
+    def count_line_states(self, project_id: int) -> dict:
+        """
+        :param int project_id: existing uid from the database
+        :return: dictionary `state: number of lines`, states without lines are missing
+        """
+        query = "SELECT state, COUNT(*) AS lines FROM line WHERE project_id = ? GROUP BY state"
+        try:
+            return {row['state']: row['lines'] for row in self.cur.execute(query, (project_id,))}
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB|Sqlite3Error: couldn't count lines of project {project_id} - {err}")
+            return {}
+
+    def delete_project_lines(self, project_id: int) -> bool:
+        """
+        Removes all lines and speakers of a project, the project itself and its diarization stay
+
+        :param int project_id: existing uid from the database
+        :return: true/false whether the operation succeeded or not
+        """
+        try:
+            self.cur.execute("DELETE FROM line WHERE project_id = ?", (project_id,))
+            self.cur.execute("DELETE FROM speaker WHERE project_id = ?", (project_id,))
+            self._commit()
+            return True
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB|Sqlite3Error: couldn't delete lines of project {project_id} - {err}")
+            return False
+
+    def reorder_lines(self, project_id: int) -> bool:
         """
         Indexes all lines of a projects and sorts them by starting time, rearranging the previous/next key
 
+        One statement for the whole project, no matter how many lines there are
+
         :param int project_id: existing uid from the database
-        :return:
+        :return: true/false whether the operation succeeded or not
         """
-        pass
+        try:
+            self._reorder(project_id)
+            self._commit()
+            return True
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB|Sqlite3Error: couldn't reorder lines of project {project_id} - {err}")
+            return False
+
+    def _reorder(self, project_id: int):
+        """The actual statement of reorder_lines, without commit, only touches lines whose links changed"""
+        ordered = """SELECT uid,
+                            LAG(uid) OVER (ORDER BY start_ms, uid) AS prev_uid,
+                            LEAD(uid) OVER (ORDER BY start_ms, uid) AS next_uid
+                     FROM line WHERE project_id = ?"""
+        if sqlite3.sqlite_version_info >= (3, 33, 0):
+            query = f"""UPDATE line SET previous = ordered.prev_uid, next = ordered.next_uid
+                        FROM ({ordered}) AS ordered
+                        WHERE line.uid = ordered.uid
+                          AND (line.previous IS NOT ordered.prev_uid OR line.next IS NOT ordered.next_uid)"""
+            self.cur.execute(query, (project_id,))
+        else:  # no UPDATE ... FROM before 3.33, a temporary table keeps it set based anyway
+            self.cur.execute("DROP TABLE IF EXISTS temp.line_order")
+            self.cur.execute(f"CREATE TEMP TABLE line_order AS {ordered}", (project_id,))
+            self.cur.execute("""UPDATE line SET
+                                previous = (SELECT prev_uid FROM temp.line_order o WHERE o.uid = line.uid),
+                                next = (SELECT next_uid FROM temp.line_order o WHERE o.uid = line.uid)
+                                WHERE project_id = ?""", (project_id,))
+            self.cur.execute("DROP TABLE temp.line_order")
 
     def update_line(self, line_id: int, **kwargs) -> bool:
         """
@@ -350,16 +639,10 @@ class CryptDB:
         :key previous: int, UID of the line that is logically before this one
         :key next: int, UID of the line that logically after this one
         :key sub_file_path: str, path to the temporally audio file created while processing
-        :return: bool
+        :key state: int, processing state, see line_state_map, set it in the same call as the data it stands for
+        :return: bool, inside a batch only whether the update got queued, a flush that fails raises sqlite3.Error
         """
-        # check if the project actually exists
-        query = "SELECT uid FROM line WHERE uid = ? LIMIT 1"
-        row = self.cur.execute(query, (line_id,)).fetchone()
-        if not row or len(row) <= 0:
-            logger.warning(f"CryptDB: Cannot update line '{line_id}' because it does not exist")
-            return False
-        parameters = {"content": str, "length_ms": int, "language": str, "start_ms": int, "stop_ms": int,
-                      "previous": int, "next": int, "sub_file_path": str, "speaker_id": str, "project_id": int}
+        parameters = self.line_parameters
         update = {}
         for key, value in kwargs.items():
             if key in parameters:
@@ -368,12 +651,24 @@ class CryptDB:
         if len(update) <= 0:
             logger.warning(f"CryptDB: trying to update line '{line_id}' with empty data, nothing happens")
             return False
+        if self._batch is not None:  # existence gets checked by rowcount when flushing
+            self._batch.setdefault(line_id, {}).update(update)
+            if len(self._batch) >= self._batch_size:
+                self.flush()
+            return True
+        # check if the project actually exists
+        query = "SELECT uid FROM line WHERE uid = ? LIMIT 1"
+        row = self.cur.execute(query, (line_id,)).fetchone()
+        if not row or len(row) <= 0:
+            logger.warning(f"CryptDB: Cannot update line '{line_id}' because it does not exist")
+            return False
         query = "UPDATE line SET "
         query += " = ?, ".join(update.keys()) + " = ?"  # * straight 6 out of 10 in terms of ugly hacks
         query += " WHERE uid = ?"
         try:
             self.cur.execute(query, (tuple(update.values()) + (line_id,)))
-            self.db.commit()
+            self._commit()
+            return True
         except sqlite3.Error as err:
             logger.error(f"CryptDB|Sqlite3Error: couldn't update line - {line_id} - {err}\n Query: '{query}'")
             return False
@@ -387,19 +682,18 @@ class CryptDB:
         :param speaker_id:
         :return:
         """
-        # check for existing entry
-        query = "SELECT EXISTS (SELECT uid FROM speaker WHERE project_id = ? and speaker_id = ? LIMIT 1)"
-        num = self.cur.execute(query, (project_id, speaker_id)).fetchone()[0]
-        if num:
-            logger.warning(
-                f"CryptDB: trying to create speaker '{speaker_id}' for project '{project_id}', but it exists")
-            return False
-        query = "INSERT INTO speaker (project_id, speaker_id, name) VALUES (?, ?, ?)"
+        # the unique index on (project_id, speaker_id) does the existence check for us
+        query = "INSERT OR IGNORE INTO speaker (project_id, speaker_id, name) VALUES (?, ?, ?)"
         if not alias:
             alias = speaker_id
         try:
             self.cur.execute(query, (project_id, speaker_id, alias))
-            self.db.commit()
+            if self.cur.rowcount <= 0:
+                self._commit()  # do not keep the write lock of an empty transaction
+                logger.warning(
+                    f"CryptDB: trying to create speaker '{speaker_id}' for project '{project_id}', but it exists")
+                return False
+            self._commit()
             return True
         except sqlite3.Error as err:
             logger.error(f"CryptDB|Sqlite3Error: couldn't insert speaker - {project_id}|{speaker_id} - {err}\n Query: '{query}'")
@@ -416,12 +710,184 @@ class CryptDB:
             alias = speaker_id
         try:
             self.cur.execute(query, (alias, project_id, speaker_id))
-            self.db.commit()
+            self._commit()
             return True
         except sqlite3.Error as err:
             logger.error(f"CryptDB|Sqlite3Error: couldn't update speaker - {project_id}|{speaker_id} - {err}\n Query: '{query}'")
             return False
 
+    def save_run_metrics(self, project_id: int, run_id: str, kind: str, model: str, stages: list[dict]) -> bool:
+        """
+        :param int project_id: the project of the run
+        :param str run_id: groups the stages of one run
+        :param str kind: what the run did, eg. 'process', 'batch' or 'resume'
+        :param str model: whisper model of the run
+        :param stages: dictionaries with the keys of StageMetrics.to_dict
+        :return: true/false whether the operation succeeded or not
+        """
+        query = """INSERT INTO run_metrics (run_id, project_id, kind, model, stage, wall_s, busy_s, cpu_s, segments,
+                                            audio_s, peak_rss_mb)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+        try:
+            self.cur.executemany(query, [(run_id, project_id, kind, model, e['stage'], e['wall_s'], e['busy_s'],
+                                          e['cpu_s'], e['segments'], e['audio_s'], e['peak_rss_mb']) for e in stages])
+            self._commit()
+            return True
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB|Sqlite3Error: couldn't save metrics of run {run_id} - {err}")
+            return False
+
+    def fetch_run_metrics(self, project_id=None, runs=10) -> list[RunMetric]:
+        """
+        :param int project_id: only runs of this project, all projects by default
+        :param int runs: number of most recent runs
+        :return: the stages of these runs, oldest run first and the stages in the order they started
+        """
+        where = "WHERE project_id = ?" if project_id else ""
+        params = (project_id, runs) if project_id else (runs,)
+        query = f"""SELECT * FROM run_metrics WHERE run_id IN (
+                        SELECT run_id FROM run_metrics {where} GROUP BY run_id ORDER BY MAX(uid) DESC LIMIT ?)
+                    ORDER BY uid"""
+        try:
+            return self._query(RunMetric, query, params).fetchall()
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB: Can not fetch run metrics because: '{err}'")
+            return []
+
+    def fetch_project_rtf(self) -> dict:
+        """
+        Only full runs count, a resume measures its RTF on the speech it transcribed and not on the length of
+        the recording, a profiled run is slowed down by the profiler. A batch run decodes and diarizes the
+        recording in the background, that time is not part of its total. None of them compares to a normal run
+
+        :return: dictionary `project_id: real time factor` of the latest full run of every project that has one
+        """
+        query = """SELECT project_id, wall_s / audio_s AS rtf FROM run_metrics
+                   WHERE uid IN (SELECT MAX(uid) FROM run_metrics WHERE stage = 'total' AND kind = 'process'
+                                 GROUP BY project_id)
+                     AND audio_s > 0"""
+        try:
+            return {row['project_id']: row['rtf'] for row in self.cur.execute(query)}
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB: Can not fetch project RTF because: '{err}'")
+            return {}
+
+    def enqueue_job(self, file_path: str, options=None) -> int:
+        """
+        Puts a recording into the work queue, any worker on any connection to this file can pick it up
+
+        :param str file_path: path to the recording, as the workers will see it
+        :param dict options: keyword arguments for the processing that differ from the worker defaults
+        :return: uid of the job, -1 on failure
+        """
+        query = "INSERT INTO job (file_path, options) VALUES (?, ?)"
+        try:
+            self.cur.execute(query, (str(file_path), json.dumps(options or {})))
+            self._commit()
+            return self.cur.lastrowid
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB|Sqlite3Error: couldn't enqueue '{file_path}' - {err}")
+            return -1
+
+    def claim_job(self, worker: str, lease_s=300, max_attempts=3) -> Job:
+        """
+        Takes the oldest queued job, or one whose worker let its lease run out. The whole claim runs in one
+        IMMEDIATE transaction, sqlite allows only one of those at a time, so two workers can never end up
+        with the same job. A job that lost its worker `max_attempts` times is marked as failed instead
+
+        :param str worker: unique name of the claiming worker, eg. host and pid
+        :param int lease_s: seconds the job belongs to the worker, renew_job extends it
+        :param int max_attempts: claims per job before it is given up
+        :return: the claimed job or None if there is nothing to do
+        """
+        now = time.time()
+        try:
+            self.db.commit()  # BEGIN fails inside an open transaction
+            self.cur.execute("BEGIN IMMEDIATE")
+            self.cur.execute("""UPDATE job SET status = 3, error = 'lease ran out too often', finished = CURRENT_TIMESTAMP
+                                WHERE status = 1 AND lease_until < ? AND attempts >= ?""", (now, max_attempts))
+            row = self.cur.execute("""SELECT uid FROM job
+                                      WHERE status = 0 OR (status = 1 AND lease_until < ?)
+                                      ORDER BY uid LIMIT 1""", (now,)).fetchone()
+            if row:
+                self.cur.execute("""UPDATE job SET status = 1, worker = ?, lease_until = ?, attempts = attempts + 1
+                                    WHERE uid = ?""", (worker, now + lease_s, row['uid']))
+            self.db.commit()
+        except sqlite3.Error as err:
+            self.db.rollback()
+            logger.error(f"CryptDB|Sqlite3Error: couldn't claim a job for {worker} - {err}")
+            return None
+        return self.fetch_job(row['uid']) if row else None
+
+    def fetch_job(self, job_id: int) -> Job:
+        """
+        :return: the job or None if there is none with that uid
+        """
+        return self._query(Job, "SELECT * FROM job WHERE uid = ? LIMIT 1", (job_id,)).fetchone()
+
+    def list_jobs(self, limit=50, status=None) -> list[Job]:
+        """
+        :param int limit: maximum number of jobs, newest first, -1 for all
+        :param int status: only jobs in that status, see job_status_map
+        """
+        query = "SELECT * FROM job" + (" WHERE status = ?" if status is not None else "")
+        query += " ORDER BY uid DESC LIMIT ?"
+        params = (status, limit) if status is not None else (limit,)
+        try:
+            return self._query(Job, query, params).fetchall()
+        except sqlite3.Error as err:
+            logger.error(f"CryptDB: Can not list jobs because: '{err}'")
+            return []
+
+    def _update_owned_job(self, job_id: int, worker: str, assignments: str, params: tuple):
+        """
+        Every change after the claim only goes through as long as the worker still holds the lease
+
+        :return: true if it went through, false if the job belongs to somebody else now, None if the database
+            could not be asked, eg. because it was locked for longer than the timeout, try again then
+        """
+        query = f"UPDATE job SET {assignments} WHERE uid = ? AND worker = ? AND status = 1"
+        try:
+            self.cur.execute(query, params + (job_id, worker))
+            self._commit()
+        except sqlite3.Error as err:
+            self.db.rollback()
+            logger.error(f"CryptDB|Sqlite3Error: couldn't update job {job_id} - {err}")
+            return None
+        if self.cur.rowcount < 1:
+            logger.warning(f"CryptDB: job {job_id} does not belong to {worker} anymore")
+            return False
+        return True
+
+    def renew_job(self, job_id: int, worker: str, lease_s=300):
+        """
+        :return: false if the lease ran out and somebody else claimed the job in the meantime, None if the
+            database could not be reached, the lease is still as good as it was then
+        """
+        return self._update_owned_job(job_id, worker, "lease_until = ?", (time.time() + lease_s,))
+
+    def assign_job_project(self, job_id: int, worker: str, project_id: int) -> bool:
+        """Remembers the project of a job, whoever claims it after a crash resumes that one"""
+        return self._update_owned_job(job_id, worker, "project_id = ?", (project_id,))
+
+    def complete_job(self, job_id: int, worker: str, error=None):
+        """
+        :param str error: marks the job as failed with that message
+        :return: false if the job does not belong to the worker anymore, its result counts for nothing then,
+            None if the database could not be reached
+        """
+        return self._update_owned_job(job_id, worker, "status = ?, error = ?, finished = CURRENT_TIMESTAMP",
+                                      (3 if error else 2, error))
+
+    def release_job(self, job_id: int, worker: str) -> bool:
+        """Puts a claimed job back into the queue, eg. when the worker gets stopped, it does not count as attempt"""
+        return self._update_owned_job(job_id, worker, "status = 0, worker = NULL, lease_until = NULL, "
+                                                      "attempts = attempts - 1", ())
+
+    @staticmethod
+    def _turns_text(turns) -> str:
+        return json.dumps(turns, separators=(",", ":")) if turns else None
+
     @staticmethod
     def _speaker_alias_escape(speaker_aliases: list) -> list:
         """
@@ -453,26 +919,24 @@ class CryptDB:
                                       status=4,
                                       num_lines=len(raw_dict),
                                       file_path=original_audio_file_path)
-        previous = -1
         speaker_set = set()
         total_length = 0
-        for each in raw_dict:
-            current = self.create_line(proj_id,
-                                        each.get('speaker', each.get('speaker_id', None)),
-                                        start_ms=each.get('start', each.get('start_ms', None)),
-                                        stop_ms=each.get('end', each.get('stop_ms', None)),
-                                        sub_file_path=each['file'],
-                                        content=each['transcribe']['text'],
-                                        language=each['transcribe'].get('language', "un"),
-                                        length_ms=each.get('end', each.get('stop_ms', None))-each.get('start', each.get('start_ms', None)),
-                                        previous=previous)
-            if previous > 0:
-                self.update_line(previous, next=current)
-            previous = current
-            total_length += each.get('end', each.get('stop_ms', None))-each.get('start', each.get('start_ms', None))
-            speaker_set.add(each.get('speaker', each.get('speaker_id', None)))
-        for each in speaker_set:
-            self.create_speaker_id(proj_id, each, "")
+        with self.batch():
+            for each in raw_dict:
+                self.create_line(proj_id,
+                                 each.get('speaker', each.get('speaker_id', None)),
+                                 start_ms=each.get('start', each.get('start_ms', None)),
+                                 stop_ms=each.get('end', each.get('stop_ms', None)),
+                                 sub_file_path=each['file'],
+                                 content=each['transcribe']['text'],
+                                 language=each['transcribe'].get('language', "un"),
+                                 state=self.LINE_TRANSCRIBED,
+                                 length_ms=each.get('end', each.get('stop_ms', None))-each.get('start', each.get('start_ms', None)))
+                total_length += each.get('end', each.get('stop_ms', None))-each.get('start', each.get('start_ms', None))
+                speaker_set.add(each.get('speaker', each.get('speaker_id', None)))
+            self._reorder(proj_id)  # previous/next for all of them in one go
+            for each in speaker_set:
+                self.create_speaker_id(proj_id, each, "")
         self.update_project(proj_id, num_speakers=len(speaker_set), length_ms=total_length)
 
     def close(self):
@@ -487,11 +951,11 @@ class CryptDB:
 if __name__ == "__main__":
     test = CryptDB("./transcrypt.db")
     raw = test.fetch_project(1)
-    print(json.dumps(raw, indent=3))
+    print(json.dumps(raw.to_dict() if raw else raw, indent=3))
     raw = test.list_project()
-    print(json.dumps(raw, indent=3))
+    print(json.dumps([each.to_dict() for each in raw], indent=3))
     rawest = test.fetch_project_lines(1, 20)
-    print(json.dumps(rawest))
+    print(json.dumps([each.to_dict() for each in rawest]))
     print(test.fetch_project_speaker(1))
     exit()
     test._debug_import_annowhisper_json("./terrible.json", "./hunttest.wav")
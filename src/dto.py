@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Data Transfer Objects for the rows of CryptDB. They use __slots__ so a line costs a fraction of a dict and
+they get built straight from the raw row tuples by a row factory. To not break everything that treated the
+rows as dictionaries so far, they still answer to `row['key']`, `row.get('key')` and `'key' in row`.
+Only JSON export needs actual dictionaries, that is what to_dict() is for.
+"""
+
+
+class _Row:
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def row_factory(cls, description):
+        """
+        Creates a row factory for the columns of an already executed query, set it on the cursor after
+        execute and before fetching
+
+        cursor.execute("SELECT * FROM line")
+        cursor.row_factory = Line.row_factory(cursor.description)
+
+        :param description: cursor.description of the executed query
+        :return: callable(cursor, row) that builds an instance of cls
+        """
+        names = tuple(column[0] for column in description)
+        unknown = set(names) - set(cls.__slots__)
+        if unknown:
+            raise KeyError(f"{cls.__name__} has no field(s) {', '.join(sorted(unknown))}")
+        new = cls.__new__
+        setters = tuple(getattr(cls, name).__set__ for name in names)  # slot descriptors, skips setattr lookup
+
+        def factory(cursor, row):
+            obj = new(cls)
+            for setter, value in zip(setters, row):
+                setter(obj, value)
+            return obj
+        return factory
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__ and hasattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self) -> list[str]:
+        """Only the fields that were actually selected"""
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.keys()}
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in self.keys())})"
+
+
+class Project(_Row):
+    __slots__ = ("uid", "given_name", "num_speakers", "length_ms", "file_path", "status", "num_lines",
+                 "num_true_lines", "last_change", "created", "pcm_path")
+
+
+class Line(_Row):
+    __slots__ = ("uid", "project_id", "speaker_id", "content", "sub_file_path", "length_ms", "language",
+                 "start_ms", "stop_ms", "previous", "next", "turns", "state")
+
+
+class Speaker(_Row):
+    __slots__ = ("uid", "project_id", "speaker_id", "name")
+
+
+class RunMetric(_Row):
+    __slots__ = ("uid", "run_id", "project_id", "kind", "model", "stage", "wall_s", "busy_s", "cpu_s", "segments",
+                 "audio_s", "peak_rss_mb", "created")
+
+
+class Job(_Row):
+    __slots__ = ("uid", "file_path", "options", "status", "worker", "lease_until", "attempts", "project_id",
+                 "error", "created", "finished")
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Timings of every stage of a run, stored in the run_metrics table. The stages of a Pipeline all live as long
+as the whole run, so their wall time alone says nothing. Each stage also counts the time it spent waiting
+for the stage before it or for the one after it to take its results, what is left is 'busy', the time the
+stage actually worked. CPU time is that of the thread the stage runs in, minus the waiting as well.
+
+Peak RSS is the peak of the whole process up to the end of the stage, there is no such thing per thread.
+On Windows there is no resource module, it stays empty there.
+"""
+
+import os
+import sys
+import time
+import logging
+import itertools
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, Iterator
+
+import profiling
+import progress
+
+logger = logging.getLogger(__name__)
+
+_run_counter = itertools.count(1)  # a worker easily finishes two runs within the same second
+
+
+def peak_rss_mb():
+    """Highest resident memory of this process so far in MiB, None where the platform does not tell"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+class StageMetrics:
+    __slots__ = ("stage", "wall_s", "busy_s", "cpu_s", "segments", "audio_s", "peak_rss_mb", "_waiting",
+                 "_waiting_cpu", "_progress")
+
+    def __init__(self, stage: str, reporter=None):
+        """
+        :param progress.Reporter reporter: gets told about every item, it decides itself how often to pass it on
+        """
+        self.stage = stage
+        self.wall_s = self.busy_s = self.cpu_s = self.audio_s = 0.0
+        self.segments = 0
+        self.peak_rss_mb = None
+        self._waiting = self._waiting_cpu = 0.0
+        self._progress = reporter
+
+    def add(self, item):
+        """Counts an item that went through the stage, lines and segments also add their length"""
+        self.segments += 1
+        try:
+            self.audio_s += (item['stop_ms'] - item['start_ms']) / 1000
+        except (KeyError, TypeError, IndexError):
+            pass
+        if self._progress:
+            self._progress.segment(self.stage, self.segments, self.audio_s)
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__ if not key.startswith("_")}
+
+
+class RunMetrics:
+    def __init__(self, kind="process", model_name="", project_id=None):
+        """
+        :param str kind: what the run did, eg. 'process' or 'resume'
+        :param str model_name: whisper model of the run, RTF is only comparable for the same model
+        :param int project_id: only for the progress events, finish gets told again
+        """
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_run_counter)}"
+        self.profiler = profiling.for_run(self.run_id)
+        self.progress = progress.for_run(self.run_id, project_id)
+        self.kind = f"{kind}-profiled" if self.profiler else kind  # numbers of profiled runs are no RTF to go by
+        self.model_name = model_name
+        self.stages = []
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measures whatever happens inside the block in the current thread
+
+        with metrics.stage("transcribe") as stage:
+            for each in lines:
+                stage.add(each)
+        """
+        metrics = StageMetrics(name, self.progress)
+        self.stages.append(metrics)
+        if self.progress:
+            self.progress.start(name)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            with self.profiler.stage(name) if self.profiler else nullcontext():
+                yield metrics
+        finally:
+            metrics.wall_s = time.perf_counter() - wall
+            metrics.busy_s = max(0.0, metrics.wall_s - metrics._waiting)
+            metrics.cpu_s = max(0.0, time.thread_time() - cpu - metrics._waiting_cpu)
+            metrics.peak_rss_mb = peak_rss_mb()
+            if self.progress:
+                self.progress.end(name, metrics.segments, metrics.audio_s)
+
+    def measured(self, name: str, stage: Callable[[Iterator], Iterator], items: Iterable = ()) -> Iterator:
+        """
+        Runs a stage over `items` and yields its output, the time spent getting the next input and the time
+        the consumer keeps us waiting after each output do not count as busy
+        """
+        with self.stage(name) as metrics:
+            for item in stage(self._pulled(metrics, items)):
+                metrics.add(item)
+                wall, cpu = time.perf_counter(), time.thread_time()
+                yield item
+                metrics._waiting += time.perf_counter() - wall
+                metrics._waiting_cpu += time.thread_time() - cpu
+
+    def wrap(self, name: str, stage: Callable[[Iterator], Iterator]) -> Callable[[Iterator], Iterator]:
+        """Measured version of a Pipeline stage"""
+        def measured_stage(items: Iterator) -> Iterator:
+            return self.measured(name, stage, items)
+        measured_stage.__name__ = getattr(stage, "__name__", name)
+        return measured_stage
+
+    def source(self, name: str, items: Iterable) -> Iterator:
+        """Measured version of the source of a Pipeline, eg. the diarization"""
+        return self.measured(name, lambda _: items)
+
+    @staticmethod
+    def _pulled(metrics: StageMetrics, items: Iterable) -> Iterator:
+        iterator = iter(items)
+        while True:
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                metrics._waiting += time.perf_counter() - wall
+                metrics._waiting_cpu += time.thread_time() - cpu
+            yield item
+
+    def expect(self, lines: int):
+        """Tells the progress events how many lines the coming stages will see, if it is known up front"""
+        if self.progress:
+            self.progress.expect(lines)
+
+    def total(self, audio_s: float, segments=None) -> StageMetrics:
+        """
+        :param float audio_s: length of the whole recording
+        :param int segments: lines of the run, by default the most any stage saw
+        :return: the numbers of the run as a whole, wall and cpu of the process since the start
+        """
+        total = StageMetrics("total")
+        total.wall_s = total.busy_s = time.perf_counter() - self._started
+        total.cpu_s = time.process_time() - self._cpu_started
+        total.segments = segments if segments is not None else max((each.segments for each in self.stages), default=0)
+        total.audio_s = audio_s
+        total.peak_rss_mb = peak_rss_mb()
+        return total
+
+    def finish(self, backend, project_id: int, audio_s: float) -> list[dict]:
+        """
+        Stores all stages and the total of the run
+
+        :param CryptDB backend: open database handler
+        :param int project_id: the project of the run
+        :param float audio_s: length of the whole recording
+        :return: the stored rows
+        """
+        total = self.total(audio_s)
+        rows = [each.to_dict() for each in self.stages + [total]]
+        backend.save_run_metrics(project_id, self.run_id, self.kind, self.model_name, rows)
+        if self.progress:
+            self.progress.project_id = project_id
+            self.progress.finish(audio_s)
+        rtf = total.wall_s / audio_s if audio_s else 0.0
+        logger.info(f"Metrics: run {self.run_id} of project {project_id}, {total.wall_s:.1f}s for {audio_s:.0f}s "
+                    f"of audio, RTF {rtf:.3f} - " + ", ".join(f"{each.stage} {each.busy_s:.1f}s" for each in self.stages))
+        return rows
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Loading whisper or the pyannote pipeline takes ages, loading them again for every file is just wasteful.
+This keeps them around for the lifetime of the process, the least recently used one gets kicked out
+if there are too many or they take too much memory.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PIPELINE = "pyannote/speaker-diarization"
+
+
+def default_device() -> str:
+    """The first GPU if there is one, otherwise the cpu"""
+    import torch
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
+class ModelRegistry:
+    def __init__(self, max_models=4, memory_limit_mb=None):
+        """
+        :param int max_models: maximum number of resident models
+        :param int memory_limit_mb: optional ceiling for the summed up parameter size of all resident models
+        """
+        self.max_models = max_models
+        self.memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        self._models = OrderedDict()  # (kind, name, device) -> (model, size in bytes)
+        self._loading = {}  # (kind, name, device) -> threading.Event for loads that are still running
+        self._lock = threading.RLock()
+
+    def get(self, kind: str, name: str, device: str, loader):
+        """
+        Returns the resident model for the given key or loads it with `loader()`. If another thread
+        is already loading the very same model this waits for it instead of loading it twice
+
+        :param str kind: 'whisper', 'pipeline' or whatever else one wants to keep around
+        :param str name: name of the model, eg. 'medium'
+        :param str device: device the model lives on, eg. 'cuda:0'
+        :param loader: callable without arguments that returns the loaded model
+        :return: the model
+        """
+        key = (kind, name, str(device))
+        while True:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key][0]
+                waiting = self._loading.get(key, None)
+                if not waiting:
+                    self._loading[key] = threading.Event()
+                    break
+            waiting.wait()
+        try:
+            logger.info(f"ModelRegistry: loading {kind} '{name}' on {device}")
+            model = loader()
+            with self._lock:
+                self._models[key] = (model, self._model_size(model))
+                self._evict(keep=key)
+            return model
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+
+    def whisper(self, name="medium", device=None):
+        """
+        :param str name: whisper model size, tiny to large
+        :param str device: torch device, by default the first GPU if available
+        :return: loaded whisper model
+        """
+        device = device or default_device()
+
+        def loader():
+            import whisper
+            return whisper.load_model(name, device=device)
+
+        return self.get("whisper", name, device, loader)
+
+    def pipeline(self, auth_token: str, name=DEFAULT_PIPELINE, device=None):
+        """
+        :param str auth_token: hugging face api key
+        :param str name: name of the pretrained pipeline
+        :param str device: torch device, by default the first GPU if available
+        :return: loaded pyannote pipeline
+        """
+        device = device or default_device()
+
+        def loader():
+            from pyannote.audio import Pipeline
+            pipe = Pipeline.from_pretrained(name, use_auth_token=auth_token, cache_dir="model")
+            if hasattr(pipe, "to"):  # older pyannote versions stay on the cpu no matter what
+                import torch
+                pipe.to(torch.device(device))
+            return pipe
+
+        return self.get("pipeline", name, device, loader)
+
+    def preload(self, whisper_name=None, auth_token=None, pipeline_name=DEFAULT_PIPELINE) -> threading.Thread:
+        """
+        Loads the given models in a background thread so they are resident by the time the first job
+        needs them, a job that asks earlier simply waits for the running load
+
+        :param str whisper_name: whisper model size, None to skip
+        :param str auth_token: hugging face api key, None to skip the pipeline
+        :param str pipeline_name: name of the pretrained pipeline
+        :return: the already started daemon thread
+        """
+        def work():
+            try:
+                if auth_token:
+                    self.pipeline(auth_token, pipeline_name)
+                if whisper_name:
+                    self.whisper(whisper_name)
+            except Exception as err:  # whatever goes wrong, the actual job will run into it again, loud
+                logger.warning(f"ModelRegistry: preloading failed - {err}")
+
+        thread = threading.Thread(target=work, name="ModelPreload", daemon=True)
+        thread.start()
+        return thread
+
+    def resident(self) -> list[tuple]:
+        """List of keys of the currently loaded models, least recently used first"""
+        with self._lock:
+            return list(self._models.keys())
+
+    def memory_used(self) -> int:
+        with self._lock:
+            return sum(size for _, size in self._models.values())
+
+    def evict(self, kind: str, name: str, device: str) -> bool:
+        with self._lock:
+            entry = self._models.pop((kind, name, str(device)), None)
+        if entry:
+            self._release(str(device))
+        return entry is not None
+
+    def clear(self):
+        with self._lock:
+            devices = {key[2] for key in self._models}
+            self._models.clear()
+        for device in devices:
+            self._release(device)
+
+    def _evict(self, keep: tuple):
+        """Throws out the least recently used models until the limits fit again, never the one just loaded"""
+        while len(self._models) > 1:
+            over_count = len(self._models) > self.max_models
+            over_memory = self.memory_limit is not None and self.memory_used() > self.memory_limit
+            if not over_count and not over_memory:
+                break
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            self._models.pop(oldest)
+            logger.info(f"ModelRegistry: evicted {oldest[0]} '{oldest[1]}' from {oldest[2]}")
+            self._release(oldest[2])
+
+    @staticmethod
+    def _release(device: str):
+        if device.startswith("cuda"):
+            import torch
+            torch.cuda.empty_cache()
+
+    @staticmethod
+    def _model_size(model) -> int:
+        """
+        Sums up the parameter and buffer size of torch modules, pyannote pipelines are no modules themselves
+        but carry them as attributes
+        """
+        modules = []
+        if hasattr(model, "parameters"):
+            modules.append(model)
+        else:
+            for value in getattr(model, "__dict__", {}).values():
+                value = value if hasattr(value, "parameters") else getattr(value, "model", None)  # pyannote Inference
+                if hasattr(value, "parameters"):
+                    modules.append(value)
+        size = 0
+        for module in modules:
+            try:
+                size += sum(p.numel() * p.element_size() for p in module.parameters())
+                size += sum(b.numel() * b.element_size() for b in module.buffers())
+            except (AttributeError, TypeError):
+                continue
+        return size
+
+
+registry = ModelRegistry()  # the process wide one, everything should use this
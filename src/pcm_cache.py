@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Every recording gets decoded exactly once, by ffmpeg straight into a raw file of 16 kHz mono float32
+samples, chunk by chunk so the whole thing is never in memory. Afterwards it is only ever opened as
+numpy.memmap, which costs nothing up front and the OS pages in just the parts that get sliced. The file is
+named after the fingerprint of the recording, so the same audio under another name shares it.
+
+Raw float32 is twice the size of 16 bit, roughly 230 MB per hour, but slices are real numpy views that
+whisper takes as they are.
+"""
+
+import os
+import logging
+import subprocess
+
+import util
+
+logger = logging.getLogger(__name__)
+
+PCM_SUFFIX = ".f32"
+
+
+def pcm_path(audio_file: str, folder="./pcm/", fingerprint=None) -> str:
+    """
+    :param str audio_file: original recording
+    :param str folder: where the decoded files live
+    :param str fingerprint: util.file_fingerprint of the recording if it is known already
+    :return: path of the cache file for this recording, it might not exist yet
+    """
+    return os.path.join(folder, f"{fingerprint or util.file_fingerprint(audio_file)}{PCM_SUFFIX}")
+
+
+def decode_pcm(audio_file: str, out_file: str, sample_rate=util.SAMPLE_RATE, chunk_size=1 << 20) -> int:
+    """
+    Streams the decoded audio from an ffmpeg pipe into `out_file`, the file only appears once it is complete
+
+    :param str audio_file: path to any audio file ffmpeg can read
+    :param str out_file: target path, usually from pcm_path
+    :param int sample_rate: target sample rate
+    :param int chunk_size: bytes read from the pipe at once
+    :return: number of samples written
+    """
+    os.makedirs(os.path.dirname(out_file) or ".", exist_ok=True)
+    part = f"{out_file}.{os.getpid()}.part"  # two processes decoding the same file do not trip over each other
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", audio_file,
+           "-f", "f32le", "-ac", "1", "-acodec", "pcm_f32le", "-ar", str(sample_rate), "-"]
+    written = 0
+    try:
+        with open(part, "wb") as pcm_fh, \
+                subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as ffmpeg:
+            while chunk := ffmpeg.stdout.read(chunk_size):
+                pcm_fh.write(chunk)
+                written += len(chunk)
+            error = ffmpeg.stderr.read()
+        if ffmpeg.returncode != 0:
+            raise RuntimeError(f"ffmpeg could not decode '{audio_file}' - {error.decode(errors='replace')}")
+        os.replace(part, out_file)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+    logger.info(f"PCMCache: decoded '{audio_file}' into '{out_file}', {written // 4 / sample_rate:.0f}s of audio")
+    return written // 4
+
+
+def open_pcm(path: str):
+    """
+    :return: read only numpy.memmap of float32 samples, or an empty array for an empty file
+    """
+    import numpy as np
+    if os.path.getsize(path) == 0:  # mmap refuses empty files
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(path, dtype="<f4", mode="r")
+
+
+def load(audio_file: str, path=None, folder="./pcm/"):
+    """
+    Memory mapped samples of the recording, it gets decoded first if there is no cache file yet
+
+    :param str audio_file: original recording
+    :param str path: cache file, by default the one pcm_path gives for `folder`
+    :param str folder: where the decoded files live
+    :return: numpy.memmap of 16 kHz mono float32 samples
+    """
+    path = path or pcm_path(audio_file, folder)
+    if not os.path.exists(path):
+        decode_pcm(audio_file, path)
+    return open_pcm(path)
+
+
+def project_samples(backend, project, folder="./pcm/"):
+    """
+    Samples of a project, links the project to its cache file if it is not yet
+
+    :param CryptDB backend: open database handler
+    :param Project project: as fetched from the database
+    :param str folder: where a missing cache file gets decoded to
+    :return: numpy.memmap of 16 kHz mono float32 samples
+    """
+    path = project.get('pcm_path', None)
+    if not path or not os.path.exists(path):
+        path = pcm_path(project['file_path'], folder)
+        samples = load(project['file_path'], path)
+        backend.update_project(project['uid'], pcm_path=path)
+        return samples
+    return open_pcm(path)
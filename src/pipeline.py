@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Instead of doing diarization, slicing, transcription and writing strictly one after another, every step
+is a generator that runs in its own thread and hands its results to the next one through a bounded
+queue. The next step starts as soon as the first item arrives and a slow step simply blocks the faster
+ones before it, so there is never more than `maxsize` items per queue in memory.
+
+A stage is any callable that takes an iterator and returns an iterator, eg. a generator function.
+"""
+
+import queue
+import logging
+import threading
+from typing import Callable, Iterable, Iterator
+
+import util
+import pcm_cache
+from batch_transcribe import BatchTranscriber
+from db_util import CryptDB
+from model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # end of stream marker
+
+
+class Pipeline:
+    def __init__(self, maxsize=64):
+        """
+        :param int maxsize: maximum number of items waiting between two stages
+        """
+        self.maxsize = maxsize
+        self._abort = threading.Event()
+        self._errors = []
+        self._threads = []
+
+    @property
+    def aborted(self) -> bool:
+        """True if any stage failed or the consumer stopped early, stages should skip their wrap up then"""
+        return self._abort.is_set()
+
+    def run(self, source: Iterable, *stages: Callable[[Iterator], Iterator]) -> Iterator:
+        """
+        Starts all stages and returns the output of the last one, consuming that output is what keeps
+        everything running. An exception in any stage stops all of them and is raised again here
+
+        :param source: iterable that gets fed into the first stage
+        :param stages: callables that take an iterator and return an iterator
+        :return: iterator over the output of the last stage
+        """
+        inbox = queue.Queue(self.maxsize)
+        self._start("source", self._feed, iter(source), inbox)
+        for stage in stages:
+            outbox = queue.Queue(self.maxsize)
+            self._start(getattr(stage, "__name__", type(stage).__name__), self._work, stage, inbox, outbox)
+            inbox = outbox
+        try:
+            yield from self._drain(inbox)
+        finally:
+            self._abort.set()  # in case the consumer stops early
+            for thread in self._threads:
+                thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def run_all(self, source: Iterable, *stages: Callable[[Iterator], Iterator]) -> int:
+        """Same as run but swallows the output, returns the number of items that came out at the end"""
+        count = 0
+        for _ in self.run(source, *stages):
+            count += 1
+        return count
+
+    def _start(self, name: str, target, *args):
+        thread = threading.Thread(target=target, args=args, name=f"Pipeline-{name}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _put(self, box: queue.Queue, item) -> bool:
+        while not self._abort.is_set():
+            try:
+                box.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _drain(self, box: queue.Queue) -> Iterator:
+        while True:
+            try:
+                item = box.get(timeout=0.1)
+            except queue.Empty:
+                if self._abort.is_set():
+                    return
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _fail(self, err: Exception):
+        logger.error(f"Pipeline: stage '{threading.current_thread().name}' failed - {err}")
+        self._errors.append(err)
+        self._abort.set()
+
+    def _feed(self, source: Iterator, outbox: queue.Queue):
+        try:
+            for item in source:
+                if not self._put(outbox, item):
+                    return
+            self._put(outbox, _DONE)
+        except Exception as err:
+            self._fail(err)
+
+    def _work(self, stage: Callable, inbox: queue.Queue, outbox: queue.Queue):
+        try:
+            for item in stage(self._drain(inbox)):
+                if not self._put(outbox, item):
+                    return
+            self._put(outbox, _DONE)
+        except Exception as err:
+            self._fail(err)
+
+
+def register_lines(pipe: Pipeline, db_file: str, project_id: int, on_done=None, chunk_size=64) -> Callable:
+    """
+    Stage that writes diarized segments as lines into the database so they get their uid
+
+    :param Pipeline pipe: the pipeline this stage runs in
+    :param str db_file: path to the database, the stage opens its own connection in its own thread
+    :param int project_id: existing project
+    :param on_done: optional callable(backend, num_lines, num_speakers) that runs if all segments got registered
+    :param int chunk_size: segments that get inserted in one transaction before they are passed on
+    """
+    def register(segments: Iterator[dict]) -> Iterator[dict]:
+        backend = CryptDB(db_file)  # sqlite connections belong to the thread that opened them
+        speakers = set()
+        count = 0
+        try:
+            for chunk in chunked(segments, chunk_size):
+                registered = []
+                with backend.batch():  # has to be committed before the writer stage touches the lines
+                    for each in chunk:
+                        if each['speaker_id'] not in speakers:
+                            backend.create_speaker_id(project_id, each['speaker_id'], "")
+                            speakers.add(each['speaker_id'])
+                        uid = backend.create_line(project_id, each['speaker_id'],
+                                                  start_ms=each['start_ms'],
+                                                  stop_ms=each['stop_ms'],
+                                                  length_ms=each['stop_ms'] - each['start_ms'],
+                                                  turns=each.get('turns', None))
+                        registered.append(dict(each, uid=uid, project_id=project_id))
+                count += len(registered)
+                yield from registered
+            if not pipe.aborted:
+                backend.reorder_lines(project_id)
+            if on_done and not pipe.aborted:
+                on_done(backend, count, len(speakers))
+        finally:
+            backend.close()
+    return register
+
+
+def slice_lines(audio_file: str, sub_folder=None, pcm_file=None) -> Callable:
+    """
+    Stage that attaches the audio of each line as 'samples', the recording gets decoded as soon as this
+    stage starts, which is while the diarization is still running
+
+    :param str audio_file: path to the original audio file
+    :param str sub_folder: if given, every line is also exported as wav file into this folder
+    :param str pcm_file: decoded copy of the recording, see pcm_cache, gets created if it does not exist yet
+    """
+    def slice_audio(lines: Iterator[dict]) -> Iterator[dict]:
+        samples = pcm_cache.load(audio_file, pcm_file) if pcm_file else util.load_audio_array(audio_file)
+        for each in lines:
+            each['samples'] = util.slice_samples(samples, each['start_ms'], each['stop_ms'])
+            if sub_folder:
+                each['sub_file_path'] = f"{sub_folder}{audio_file}_{each['uid']}.wav"
+                util.export_samples_wav(each['samples'], each['sub_file_path'])
+            yield each
+    return slice_audio
+
+
+def transcribe_lines(model_size: str, language=None, batch_size=16, cache=None) -> Callable:
+    """
+    Stage that runs the sliced lines through the batched whisper engine
+
+    :param TranscriptionCache cache: optional, lines that were transcribed before skip the model
+    """
+    def transcribe(lines: Iterator[dict]) -> Iterator[dict]:
+        engine = BatchTranscriber(registry.whisper(model_size), language=language, batch_size=batch_size,
+                                  cache=cache, model_name=model_size)
+        pending = {}
+
+        def feed():
+            for each in lines:
+                pending[each['uid']] = each
+                yield each['uid'], each['samples']
+
+        for uid, result in engine.transcribe_lines(feed()):
+            line = pending.pop(uid)
+            line.pop('samples')
+            line['transcribe'] = result
+            yield line
+    return transcribe
+
+
+def write_lines(db_file: str, batch_size=64) -> Callable:
+    """
+    Final stage, writes the transcriptions back into the database with its own connection
+
+    :param str db_file: path to the database
+    :param int batch_size: number of lines that get written in one transaction
+    """
+    def write(lines: Iterator[dict]) -> Iterator[int]:
+        backend = CryptDB(db_file)
+        try:
+            with backend.batch(batch_size):
+                for each in lines:
+                    update = {"content": each['transcribe']['text'],
+                              "language": each['transcribe'].get('language', "un"),
+                              "state": CryptDB.LINE_TRANSCRIBED}
+                    if each.get('sub_file_path', None):
+                        update['sub_file_path'] = each['sub_file_path']
+                    backend.update_line(each['uid'], **update)
+                    yield each['uid']
+        finally:
+            backend.close()
+    return write
+
+
+def chunked(items: Iterator, size: int) -> Iterator[list]:
+    """Groups a stream into lists of at most `size` items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
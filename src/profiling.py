@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Opt-in profiling of every stage a RunMetrics measures, switched on once with enable(), usually by --profile.
+Each stage gets its own cProfile in the thread it runs in and a tracemalloc snapshot before and after, the
+results end up in a folder per run next to the log:
+
+    profile-<run_id>/01-diarize.pstats      python -m pstats, snakeviz or whatever you like
+    profile-<run_id>/01-diarize.alloc.txt   lines that allocated the most memory during the stage
+
+tracemalloc only knows one heap for the whole process, stages of a Pipeline run at the same time, so the
+allocations of a stage include whatever its neighbours did meanwhile. Look at the lines, not at the sum.
+Profiled runs are a good deal slower, their run_metrics rows are stored with the kind '<kind>-profiled'.
+
+As long as it is not enabled, all this costs one check per stage, not per line.
+"""
+
+import os
+import logging
+import itertools
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_folder = None
+TOP_ALLOCATIONS = 25
+
+
+def log_folder() -> str:
+    """Folder of the first log file of the root logger, the working directory if it logs to no file"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler):
+            return os.path.dirname(handler.baseFilename)
+    return os.getcwd()
+
+
+def enable(folder=None, frames=1):
+    """
+    Profiles every stage of every run from now on
+
+    :param str folder: where the profile folders go, next to the log by default
+    :param int frames: depth of the tracebacks tracemalloc keeps, more is slower and hungrier
+    """
+    global _folder
+    _folder = folder or log_folder()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    logger.info(f"Profiling: every stage gets profiled into '{_folder}'")
+
+
+def disable():
+    global _folder
+    _folder = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enabled() -> bool:
+    return _folder is not None
+
+
+def for_run(run_id: str):
+    """
+    :return: a StageProfiler for the run, None if profiling is not enabled
+    """
+    if _folder is None:
+        return None
+    return StageProfiler(os.path.join(_folder, f"profile-{run_id}"))
+
+
+class StageProfiler:
+    def __init__(self, folder: str):
+        """
+        :param str folder: gets created with the first stage
+        """
+        self.folder = folder
+        self._count = itertools.count(1)  # the stages of a Pipeline start in their own threads
+
+    @contextmanager
+    def stage(self, name: str):
+        """Profiles the block in the current thread and the memory it leaves behind"""
+        prefix = os.path.join(self.folder, f"{next(self._count):02d}-{name}")
+        before = _snapshot()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as err:  # from 3.12 on there can only be one active profiler at a time
+            logger.warning(f"Profiling: stage {name} runs without cProfile - {err}")
+            profile = None
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            after = _snapshot() if before else None  # before writing anything, that allocates as well
+            self._write(name, prefix, profile, before, after)
+
+    def _write(self, name: str, prefix: str, profile, before, after):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            if profile:
+                profile.dump_stats(f"{prefix}.pstats")
+            if before:
+                write_allocations(f"{prefix}.alloc.txt", name, before, after)
+        except OSError as err:
+            logger.warning(f"Profiling: could not write the profile of stage {name} - {err}")
+            return
+        logger.info(f"Profiling: stage {name} written to '{prefix}.*'")
+
+
+def _snapshot():
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+
+
+def write_allocations(path: str, name: str, before, after, top=TOP_ALLOCATIONS):
+    """
+    Writes the lines whose allocations grew the most between both snapshots
+
+    :param str path: target text file
+    :param str name: of the stage, for the headline
+    :param tracemalloc.Snapshot before: taken when the stage started
+    :param tracemalloc.Snapshot after: taken when it ended
+    :param int top: number of lines in the report
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    with open(path, "w", encoding="utf-8") as alloc_fh:
+        alloc_fh.write(f"Stage {name}, traced memory now {current / 1024 / 1024:.1f} MiB, "
+                       f"peak of the process {peak / 1024 / 1024:.1f} MiB\n")
+        alloc_fh.write(f"Top {top} lines by memory allocated during the stage and still held at its end\n\n")
+        for stat in after.compare_to(before, "lineno")[:top]:
+            alloc_fh.write(f"{stat}\n")
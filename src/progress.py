@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Progress events of every run, for progress bars instead of log lines. Every stage RunMetrics measures tells
+when it starts, every so often how far it is and when it ends, the run tells when it is finished. Anything
+that wants to know subscribes a callback, much like a logging handler:
+
+    progress.subscribe(print)
+
+Callbacks get called from the thread of the stage, several stages run at the same time, so a callback has to
+be quick and thread safe, a GUI hands the event over to its own thread. Segment events come at most every
+`interval` seconds per stage, start and end always. Without any subscriber there is no reporter at all and a
+stage costs one check per line.
+
+The total of lines is not known before the diarization is done, until then `total` is None. Whenever a stage
+ends, its number of lines becomes the total for the stages after it, unless the run knew it up front.
+"""
+
+import sys
+import time
+import logging
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = 0.2  # seconds between two segment events of the same stage
+
+_listeners = []
+
+
+class ProgressEvent:
+    START, SEGMENT, END, FINISHED = "start", "segment", "end", "finished"
+    __slots__ = ("run_id", "project_id", "kind", "stage", "done", "total", "audio_s", "elapsed_s",
+                 "stage_elapsed_s")
+
+    def __init__(self, run_id: str, project_id, kind: str, stage: str, done: int, total, audio_s: float,
+                 elapsed_s: float, stage_elapsed_s=None):
+        """
+        :param str kind: one of START, SEGMENT, END and FINISHED, the latter with the stage 'total'
+        :param int done: lines the stage has handled so far
+        :param int total: lines the stage will handle, None as long as nobody knows
+        :param float audio_s: seconds of speech in the lines done
+        :param float elapsed_s: since the start of the run
+        :param float stage_elapsed_s: since the start of the stage, the same as elapsed_s if not given
+        """
+        self.run_id = run_id
+        self.project_id = project_id
+        self.kind = kind
+        self.stage = stage
+        self.done = done
+        self.total = total
+        self.audio_s = audio_s
+        self.elapsed_s = elapsed_s
+        self.stage_elapsed_s = elapsed_s if stage_elapsed_s is None else stage_elapsed_s
+
+    @property
+    def rtf(self):
+        """Real time factor of the stage so far, the time it runs by the audio it got through"""
+        return self.stage_elapsed_s / self.audio_s if self.audio_s else None
+
+    @property
+    def eta_s(self):
+        """Seconds until the stage is done at the pace so far, None if that cannot be told yet"""
+        if not self.total or not self.done or self.kind != self.SEGMENT:
+            return None
+        return self.stage_elapsed_s / self.done * max(0, self.total - self.done)
+
+    def __repr__(self):
+        return (f"ProgressEvent({self.kind} {self.stage} {self.done}/{self.total}, {self.audio_s:.1f}s of audio, "
+                f"{self.elapsed_s:.1f}s)")
+
+
+def subscribe(callback: Callable[[ProgressEvent], None]):
+    """Every run started from now on reports to the callback"""
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def unsubscribe(callback: Callable[[ProgressEvent], None]):
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def for_run(run_id: str, project_id=None, interval=INTERVAL):
+    """
+    :return: a Reporter for the run, None if nobody listens
+    """
+    if not _listeners:
+        return None
+    return Reporter(run_id, project_id, list(_listeners), interval)
+
+
+class Reporter:
+    def __init__(self, run_id: str, project_id, listeners: list, interval=INTERVAL):
+        """
+        :param str run_id: of the RunMetrics
+        :param int project_id: project of the run, if known
+        :param listeners: callbacks that get every event
+        :param float interval: minimum seconds between two segment events of a stage
+        """
+        self.run_id = run_id
+        self.project_id = project_id
+        self.listeners = listeners
+        self.interval = interval
+        self.total = None
+        self._expected = False
+        self._started = time.perf_counter()
+        self._last = {}  # stage: time of its last segment event
+        self._stage_started = {}  # stage: when it started
+
+    def expect(self, lines: int):
+        """Sets the total up front, stage ends do not change it anymore"""
+        self.total = lines
+        self._expected = True
+
+    def start(self, stage: str):
+        self._stage_started[stage] = time.perf_counter()
+        self._emit(ProgressEvent.START, stage, 0, 0.0)
+
+    def segment(self, stage: str, done: int, audio_s: float):
+        """Called for every line, only passes it on if the last event of the stage is long enough ago"""
+        now = time.perf_counter()
+        if now - self._last.get(stage, 0.0) < self.interval:
+            return
+        self._last[stage] = now
+        self._emit(ProgressEvent.SEGMENT, stage, done, audio_s, now)
+
+    def end(self, stage: str, done: int, audio_s: float):
+        if done and not self._expected:  # a stage without lines, eg. decoding, says nothing about the total
+            self.total = done
+        self._emit(ProgressEvent.END, stage, done, audio_s)
+
+    def finish(self, audio_s: float):
+        """
+        :param float audio_s: length of what the run covered, the event carries the final RTF
+        """
+        self._emit(ProgressEvent.FINISHED, "total", self.total or 0, audio_s)
+
+    def _emit(self, kind: str, stage: str, done: int, audio_s: float, now=None):
+        now = now or time.perf_counter()
+        event = ProgressEvent(self.run_id, self.project_id, kind, stage, done, self.total, audio_s,
+                              now - self._started, now - self._stage_started.get(stage, self._started))
+        for callback in self.listeners:
+            try:
+                callback(event)
+            except Exception as err:  # a broken progress bar is no reason to lose a six hour run
+                logger.warning(f"Progress: listener {callback!r} failed - {err}")
+
+
+class TerminalProgress:
+    """Renders the events as one line per run on the terminal, every running stage with its count"""
+
+    def __init__(self, stream=None):
+        """
+        :param stream: where the line goes, stderr by default, without a tty only stage ends get printed
+        """
+        self.stream = stream or sys.stderr
+        self.live = self.stream.isatty()
+        self._stages = {}  # stage: latest event, in the order they started
+        self._lock = threading.Lock()
+
+    def __call__(self, event: ProgressEvent):
+        with self._lock:
+            self._stages[event.stage] = event
+            if event.kind == ProgressEvent.FINISHED:
+                rtf = f", RTF {event.rtf:.3f}" if event.rtf else ""
+                self._write(f"Run {event.run_id} done in {format_seconds(event.elapsed_s)}{rtf}", True)
+                self._stages.clear()
+            elif event.kind == ProgressEvent.END and not self.live:
+                self._write(f"{event.stage} done, {event.done} lines in {format_seconds(event.stage_elapsed_s)}", True)
+            elif self.live:
+                self._write(self.render())
+
+    def render(self) -> str:
+        parts = []
+        current = None
+        for stage, event in self._stages.items():
+            if event.kind == ProgressEvent.END:
+                parts.append(f"{stage} done")
+                continue
+            parts.append(f"{stage} {event.done}/{event.total}" if event.total else f"{stage} {event.done}")
+            current = event  # the last stage that is still running is the one the run waits for
+        if current and current.rtf:
+            parts.append(f"RTF {current.rtf:.2f}")
+        if current and current.eta_s is not None:
+            parts.append(f"ETA {format_seconds(current.eta_s)}")
+        return " | ".join(parts)
+
+    def _write(self, text: str, newline=False):
+        if self.live:
+            self.stream.write(f"\r\x1b[K{text}" + ("\n" if newline else ""))
+        else:
+            self.stream.write(f"{text}\n")
+        self.stream.flush()
+
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Whisper is deterministic enough that the same samples with the same model, language and options give the
+same text. So the result gets stored under a hash of exactly that, resuming a project, running the same
+file twice or importing it again costs a lookup instead of GPU time. Lives in its own sqlite file next to
+the project database, the least recently used entries go once it grows over the size limit.
+
+Several workers share one cache file, so no write transaction stays open, every put commits right away. A
+hit only moves the entry up in the least recently used order, that is remembered here and written in one go
+with the next eviction, every `touch_every` hits or on close.
+"""
+
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+_schema = """CREATE TABLE IF NOT EXISTS transcription (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+             );"""
+
+
+def _sample_bytes(samples):
+    try:
+        return memoryview(samples).cast("B")  # numpy arrays, no copy
+    except TypeError:  # plain lists, mostly in tests
+        return array("f", samples).tobytes()
+
+
+class TranscriptionCache:
+    def __init__(self, path="transcache.db", max_mb=512, touch_every=256):
+        """
+        :param str path: sqlite file of the cache, created if it does not exist
+        :param int max_mb: size limit of all stored results, oldest used entries get evicted above it
+        :param int touch_every: number of hits whose new last_used time is kept in memory before it gets written
+        """
+        self.path = path
+        self.max_bytes = max_mb * 1024 * 1024
+        self.touch_every = max(1, touch_every)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._touched = {}  # key: time of its last hit, not written yet
+        self._lock = threading.Lock()
+        # autocommit, every statement is its own short transaction and nobody else waits for us
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute(_schema)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_transcription_used ON transcription(last_used)")
+        self._size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM transcription").fetchone()[0]
+
+    @staticmethod
+    def make_key(samples, model_name: str, language=None, options=None) -> str:
+        """
+        :param samples: 16 kHz float32 audio of one line
+        :param str model_name: eg. 'medium', a different model gives different text
+        :param str language: language code or None for detection
+        :param dict options: anything else that changes the result, eg. fp16 or batched decoding
+        :return: hex digest
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(_sample_bytes(samples))
+        digest.update(json.dumps([model_name, language, options or {}], sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        :return: the stored whisper result dict or None
+        """
+        with self._lock:
+            row = self.db.execute("SELECT result FROM transcription WHERE key = ?", (key,)).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_every:
+                self._write_touches()
+        return json.loads(row[0])
+
+    def put(self, key: str, result: dict):
+        value = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock:
+            old = self.db.execute("SELECT size FROM transcription WHERE key = ?", (key,)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO transcription (key, result, size, last_used) VALUES (?, ?, ?, ?)",
+                            (key, value, len(value), time.time()))
+            self._touched.pop(key, None)
+            self._size += len(value) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _write_touches(self):
+        """Writes the last_used times of all hits since the last time in one short transaction"""
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.executemany("UPDATE transcription SET last_used = MAX(last_used, ?) WHERE key = ?",
+                                [(used, key) for key, used in touched.items()])
+            self.db.execute("COMMIT")
+        except sqlite3.Error as err:  # only the eviction order suffers
+            if self.db.in_transaction:
+                self.db.execute("ROLLBACK")
+            logger.warning(f"TranscriptionCache: could not write {len(touched)} last used times - {err}")
+
+    def _evict(self):
+        """Drops the least recently used entries until the cache is back at 90% of its limit"""
+        self._write_touches()  # the order has to be right before anything goes
+        query = """DELETE FROM transcription WHERE key IN (
+                       SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS newer
+                                        FROM transcription)
+                       WHERE newer > ?)"""
+        cursor = self.db.execute(query, (int(self.max_bytes * 0.9),))
+        self.evicted += max(cursor.rowcount, 0)
+        self._size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM transcription").fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted,
+                "hit_rate": self.hits / total if total else 0.0, "size_mb": self._size / 1024 / 1024}
+
+    def close(self):
+        with self._lock:
+            self._write_touches()
+            self.db.close()
@@ -20,13 +20,16 @@
 # @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
 
 from textual.app import App, ComposeResult
-from textual.widgets import Footer, Button, Static, Label, DataTable, Input, RichLog
-from textual.containers import Container, Horizontal, Grid
+from textual.widgets import Footer, Button, Static, Label, DataTable, Input, RichLog, ProgressBar
+from textual.containers import Container, Horizontal, Grid, Vertical
 from textual.screen import Screen
+from textual.worker import Worker, WorkerState
 
+from itertools import islice
 from time import monotonic
+import progress
 from db_util import CryptDB
-from util import shorten_left_pad
+from util import relocate_project, project_columns, project_table_rows
 from i18n import ROOi18nProvider
 
 
@@ -54,8 +57,9 @@ class MAIN(Screen):
         self.query_one("#label_01").update(str(monotonic()))
 
     def _generate_datatable(self, table_id: str or DataTable) -> None:
-        backend = CryptDB("transcrypts.db")
+        backend = CryptDB(self.app.db_file)
         projects = backend.list_project()
+        rtf = backend.fetch_project_rtf()
         backend.close()
 
         if isinstance(table_id, DataTable):
@@ -63,19 +67,8 @@ class MAIN(Screen):
         else:
             table: DataTable = self.query_one(f"#{table_id}", DataTable)
 
-        selected = ('uid', 'given_name', 'num_lines', 'num_speakers', 'status', 'last_change', 'file_path')
-        shorten = {'file_path': 50, 'given_name': 24}
-
-        table.add_columns(*self.i18n.translate_tuple(selected))
-        for row in projects:
-            one_row = []
-            for col in selected:
-                if col in shorten:
-                    one_row.append(shorten_left_pad(row.get(col, ""), shorten[col]))
-                elif col == "status":
-                    one_row.append(CryptDB.status_map[row.get('status', -1)])
-                else:
-                    one_row.append(row.get(col, ""))
+        table.add_columns(*self.i18n.translate_tuple(project_columns))
+        for one_row in project_table_rows(projects, rtf=rtf):
             table.add_row(*one_row)
 
     def on_mount(self) -> None:
@@ -115,7 +108,7 @@ class ProjectMenu(Screen):
             yield Input(id="in_name", placeholder="Project Name")
             yield Label(self.i18n.t("file_path"))
             with Horizontal():
-                yield Label("", id="in_path")
+                yield Input(id="in_path", placeholder="Audio File")
                 yield Button("..", id="btn_relocate", classes="small_button")
             yield Label(self.i18n.t("status"))
             yield Label("", id="lbl_status")
@@ -127,24 +120,121 @@ class ProjectMenu(Screen):
                 yield Button(self.i18n.t("Cancel"), variant="warning", id="btn_cancel", classes="small_button")
 
     def on_mount(self) -> None:
-        backend = CryptDB("transcrypts.db")
+        backend = CryptDB(self.app.db_file)
         project = backend.fetch_project(self.project_id)
-        lines = backend.fetch_project_lines(self.project_id, 20)
         preview = ""
-        if project.get('status', 0) > 1 and len(lines) > 0:
-            for each in lines:
-                preview += each['content'] + "\n"
-        else:
+        if (project.get('status', 0) or 0) > 1:
+            lines = backend.iter_project_lines(self.project_id, page_size=20, columns=("content",))
+            preview = "".join((each['content'] or "") + "\n" for each in islice(lines, 20))
+        if not preview:
             preview = self.i18n.t("No Preview available")
         backend.close()
         self.query_one("#in_name").value = str(project['given_name'])
-        self.query_one("#in_path").update(str(project['file_path']))
+        self.query_one("#in_path").value = str(project['file_path'])
         self.query_one("#lbl_status").update(CryptDB.status_map[project.get('status', -1)])
         self.query_one("#tl_translated").write(preview)
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "btn_cancel":
             self.app.pop_screen()
+        elif event.button.id == "btn_relocate":
+            self.relocate(self.query_one("#in_path").value)
+
+    def relocate(self, file_path: str) -> None:
+        """Takes the new path if it is the same recording, nothing gets diarized or transcribed again"""
+        backend = CryptDB(self.app.db_file)
+        moved = relocate_project(backend, self.project_id, file_path)
+        backend.close()
+        if moved:
+            self.notify(self.i18n.t("Project relocated"))
+        else:
+            self.notify(self.i18n.t("Not the same recording"), severity="warning")
+
+
+class NewProcess(Screen):
+    """Processes one recording in a worker thread and shows every stage with its own progress bar"""
+
+    def __init__(self, i18n: ROOi18nProvider, db_file="transcrypts.db", options=None):
+        """
+        :param str db_file: the database the tui was started with
+        :param dict options: keyword arguments for process_project from the command line, pcm_folder included
+        """
+        super().__init__()
+        self.i18n = i18n
+        self.db_file = db_file
+        self.options = options or {}
+        self.bars = {}  # stage: its ProgressBar, mounting happens later, a query would not find it yet
+
+    def compose(self) -> ComposeResult:
+        with Grid(id="DialogScreen", classes="dialogue-info"):
+            yield Label(self.i18n.t("New Processing"), classes="grid_span2")
+            yield Label(self.i18n.t("file_path"))
+            yield Input(id="in_file", placeholder="Audio File")
+            yield Vertical(id="stages", classes="grid_span2")
+            yield Label("", id="lbl_progress", classes="grid_span2")
+            with Horizontal(classes="grid_span2"):
+                yield Button(self.i18n.t("Start"), variant="primary", id="btn_start", classes="small_button")
+                yield Button(self.i18n.t("Cancel"), variant="warning", id="btn_cancel", classes="small_button")
+
+    def on_mount(self) -> None:
+        progress.subscribe(self.on_progress)
+
+    def on_unmount(self) -> None:
+        progress.unsubscribe(self.on_progress)
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        if event.button.id == "btn_cancel":
+            self.app.pop_screen()
+        elif event.button.id == "btn_start":
+            audio_file = self.query_one("#in_file").value
+            event.button.disabled = True
+            self.query_one("#stages").remove_children()
+            self.bars.clear()
+            self.run_worker(lambda: self.process(audio_file), thread=True, exclusive=True)
+
+    def process(self, audio_file: str) -> bool:
+        from cli import new_project, process_project  # cli starts the tui, the other way round would be a loop
+        options = dict(self.options)
+        pcm_folder = options.pop('pcm_folder', "./pcm/")
+        backend = CryptDB(self.db_file)
+        try:
+            p_id, fingerprint, pcm_file = new_project(backend, audio_file, pcm_folder)
+            return process_project(backend, p_id, audio_file, fingerprint, pcm_file, db_file=self.db_file, **options)
+        finally:
+            backend.close()
+
+    def on_progress(self, event: progress.ProgressEvent) -> None:
+        """Comes from the thread of the stage, the widgets only get touched in the thread of the app"""
+        self.app.call_from_thread(self.show_progress, event)
+
+    def show_progress(self, event: progress.ProgressEvent) -> None:
+        if event.kind == progress.ProgressEvent.FINISHED:
+            self.query_one("#lbl_progress").update(
+                f"{progress.format_seconds(event.elapsed_s)}, RTF {event.rtf or 0:.3f}")
+            return
+        bar = self.bars.get(event.stage, None)
+        if not bar:
+            bar = self.bars[event.stage] = ProgressBar(show_eta=False)
+            self.query_one("#stages").mount(Horizontal(Label(event.stage, classes="stage_name"), bar))
+        if event.kind == progress.ProgressEvent.END:
+            bar.update(total=event.done or 1, progress=event.done or 1)
+        else:
+            bar.update(total=event.total, progress=event.done)
+        info = [f"{event.stage} {event.done}/{event.total or '?'}", f"{event.audio_s:.0f}s audio"]
+        if event.rtf:
+            info.append(f"RTF {event.rtf:.2f}")
+        if event.eta_s is not None:
+            info.append(f"ETA {progress.format_seconds(event.eta_s)}")
+        self.query_one("#lbl_progress").update(" | ".join(info))
+
+    def on_worker_state_changed(self, event: Worker.StateChanged) -> None:
+        if event.state == WorkerState.SUCCESS and event.worker.result:
+            self.notify(self.i18n.t("Processing done"))
+        elif event.state in (WorkerState.SUCCESS, WorkerState.ERROR):
+            self.notify(self.i18n.t("Processing failed"), severity="error")
+        elif event.state != WorkerState.CANCELLED:
+            return
+        self.query_one("#btn_start").disabled = False
 
 
 class TCApp(App):
@@ -159,8 +249,14 @@ class TCApp(App):
         "main": MAIN(ROOi18nProvider("src/assets/i18n.json"))
     }
 
-    def __init__(self):
+    def __init__(self, db_file="transcrypts.db", process_options=None):
+        """
+        :param str db_file: database the projects are read from and new processings go into
+        :param dict process_options: keyword arguments for process_project, see NewProcess
+        """
         self.i18n = ROOi18nProvider("src/assets/i18n.json")
+        self.db_file = db_file
+        self.process_options = process_options or {}
         super().__init__()
 
     def compose(self) -> ComposeResult:
@@ -170,7 +266,7 @@ class TCApp(App):
         self.dark = not self.dark
 
     def action_new_process(self):
-        self.query_one("#label_01").value = "New Process started"
+        self.push_screen(NewProcess(self.i18n, self.db_file, self.process_options))
 
     def on_mount(self) -> None:
         self.push_screen("main")
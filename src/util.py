@@ -19,41 +19,142 @@
 #
 # @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
 
+import os
 import re
+import glob
+import hashlib
 import logging
 from pathlib import PurePath
-
-from pydub import AudioSegment
-from whisper import Whisper
+from typing import TYPE_CHECKING
 
 from db_util import CryptDB
+from model_registry import registry
+
 
 
+if TYPE_CHECKING:  # whisper drags torch along, nobody wants to wait for that just to open the TUI
+    from whisper import Whisper
 
 logger = logging.getLogger(__name__)
 
+SAMPLE_RATE = 16000  # whisper works exclusively on 16 kHz mono, everything else gets resampled anyway
+
+_audio_formats = {"mp3": "mp3", "wav": "wav", "wave": "wav", "ogg": "ogg", "opus": "ogg",
+                  "flac": "flac", "3gp": "3gp", "aac": "aac", "ac3": "aac", "mp4": "aac"}
+
 
-def single_out_speaker(audiofile: str, piped_list: list[dict], speaker: str, out_file: str):
-    raw_audio = AudioSegment.from_file(audiofile, "wav")
-    raw_audio.set_frame_rate(44100)
-    new_audio = AudioSegment.silent(0, 44100)
+def single_out_speaker(audiofile: str, piped_list: list[dict], speaker: str, out_file: str, samples=None):
+    """
+    Writes a wav file as long as the recording in which only the given speaker can be heard, for all
+    speakers at once use export_speaker_stems, it needs the same single pass
+
+    :param str audiofile: original recording
+    :param piped_list: segments with 'start_ms', 'stop_ms' and 'speaker_id'
+    :param str speaker: the speaker_id to keep
+    :param str out_file: path of the new wav file
+    :param numpy.ndarray samples: optional already decoded audio, eg. the memmap of pcm_cache
+    """
+    samples = load_audio_array(audiofile) if samples is None else samples
     logger.debug(f"Speaker is {speaker}")
-    last_segment = 0
-    for i, each in enumerate(piped_list, start=1):
-        if each['speaker_id'] == speaker:
-            silence = each['start_ms']-last_segment
-            logger.debug(f"{speaker} found [{each['start']}:{each['stop_ms']}] - {len(raw_audio[each['start_ms']:each['stop_ms']])} - {silence}ms Silence")
-            new_audio += AudioSegment.silent(duration=silence, frame_rate=44100)
-            new_audio += raw_audio[each['start_ms']:each['stop_ms']]
-            last_segment = each['stop_ms']
-        if i == len(piped_list):  # last round
-            # putting silence till the end of the file
-            if last_segment < each['stop_ms']:
-                silence = each['stop_ms'] - last_segment
-                new_audio += AudioSegment.silent(duration=silence, frame_rate=44100)
-                logger.debug(f"adding {silence}ms of end silence")
-    logger.debug(f"Done - {len(new_audio)}")
-    new_audio.export(out_file, format="wav")
+    export_speaker_stems(samples, (each for each in piped_list if each['speaker_id'] == speaker),
+                         lambda _: out_file)
+
+
+def export_speaker_stems(samples, segments, out_file, sample_rate=SAMPLE_RATE) -> dict:
+    """
+    One wav file per speaker, each as long as the whole recording and silent wherever that speaker is not
+    talking. The files get allocated at their final size right away, silence is just the zeros of a fresh
+    file, and are written through a memory map, so every segment is copied exactly once no matter how many
+    there are
+
+    :param numpy.ndarray samples: float32 audio of the whole recording
+    :param segments: iterable of dictionaries with 'start_ms', 'stop_ms' and 'speaker_id', one pass over them
+    :param out_file: callable(speaker_id) -> path of the wav file for that speaker
+    :param int sample_rate: sample rate of the given samples
+    :return: dictionary `speaker_id: path`
+    """
+    import numpy as np
+    stems = {}
+    for each in segments:
+        speaker = each['speaker_id']
+        if speaker not in stems:
+            path = out_file(speaker)
+            stems[speaker] = (path, _allocate_wav(path, len(samples), sample_rate))
+        start = max(0, each['start_ms'] * sample_rate // 1000)
+        stop = min(len(samples), each['stop_ms'] * sample_rate // 1000)
+        if stop > start:
+            stems[speaker][1][start:stop] = np.clip(samples[start:stop], -1.0, 1.0) * 32767
+    for path, pcm in stems.values():
+        if pcm is not None:
+            pcm.flush()
+    logger.debug(f"Util.Stems: wrote {len(stems)} speaker tracks")
+    return {speaker: path for speaker, (path, _) in stems.items()}
+
+
+def _allocate_wav(out_file: str, num_samples: int, sample_rate: int):
+    """
+    Creates a silent 16 bit mono wav file of the given length and maps its sample data
+
+    :return: writable numpy.memmap of int16 samples, None for an empty file as those cannot be mapped
+    """
+    import struct
+    import numpy as np
+    data_size = num_samples * 2
+    header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, 1,
+                         sample_rate, sample_rate * 2, 2, 16, b"data", data_size)
+    with open(out_file, "wb") as wav_fh:
+        wav_fh.write(header)
+        wav_fh.truncate(len(header) + data_size)  # sparse zeros on most file systems
+    if num_samples == 0:
+        return None
+    return np.memmap(out_file, dtype="<i2", mode="r+", offset=len(header), shape=(num_samples,))
+
+
+def file_fingerprint(file_path: str, block_size=65536, blocks=16) -> str:
+    """
+    Identifies an audio file without reading all of it, the size plus a hash of `blocks` blocks spread evenly
+    over the file. Small files get hashed completely. Good enough to recognize the same recording under a
+    different name or folder, not meant against anyone who tries to fool it
+
+    :param str file_path: path to the file
+    :param int block_size: bytes per sampled block
+    :param int blocks: number of sampled blocks, first and last one included
+    :return: string like '<size>-<hex digest>'
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as audio_fh:
+        if size <= block_size * blocks:
+            digest.update(audio_fh.read())
+        else:
+            step = (size - block_size) // (blocks - 1)
+            for i in range(blocks):
+                audio_fh.seek(i * step)
+                digest.update(audio_fh.read(block_size))
+    return f"{size}-{digest.hexdigest()}"
+
+
+def relocate_project(backend: CryptDB, project_id: int, file_path: str) -> bool:
+    """
+    Points a project to its recording at a new place. Only accepted if it is the same audio the project got
+    diarized from, then all lines stay valid and nothing has to run again
+
+    :param CryptDB backend: open database handler
+    :param int project_id: existing project
+    :param str file_path: new location of the audio file
+    :return: True if the project now uses the new path
+    """
+    if not os.path.isfile(file_path):
+        logger.warning(f"Relocate: '{file_path}' is not a file")
+        return False
+    known = backend.fetch_project_fingerprint(project_id)
+    fingerprint = file_fingerprint(file_path)
+    if known and known != fingerprint:
+        logger.warning(f"Relocate: '{file_path}' is not the recording project {project_id} was made from")
+        return False
+    if not known:  # projects from before fingerprints, cannot check, but the user will know best
+        logger.info(f"Relocate: project {project_id} has no fingerprint yet, taking '{file_path}' as is")
+    return backend.update_project(project_id, file_path=str(file_path))
 
 
 def _detect_audio(file_path: str) -> str:
@@ -63,40 +164,61 @@ def _detect_audio(file_path: str) -> str:
     :param file_path: absolute or relative file path
     :return: file type: mp3, wav, ogg, flac, 3gp, aac
     """
-    pure = str(PurePath(file_path).suffix).lower()
-    formats = {"mp3": "mp3", "wav": "wav", "wave": "wav", "ogg": "ogg", "opus": "ogg",
-               "flac": "flac", "3gp": "3gp", "aac": "aac", "ac3": "aac", "mp4": "aac"}
-    return formats.get(pure, "wav")
+    pure = str(PurePath(file_path).suffix).lower().lstrip(".")
+    return _audio_formats.get(pure, "wav")
+
+
+def audio_files(pattern: str) -> list[str]:
+    """
+    :param str pattern: a directory, all audio files directly in it are taken, or a glob like 'hearings/**/*.mp3'
+    :return: sorted list of paths
+    """
+    if os.path.isdir(pattern):
+        found = [os.path.join(pattern, name) for name in os.listdir(pattern)
+                 if PurePath(name).suffix.lower().lstrip(".") in _audio_formats]
+    else:
+        found = glob.glob(pattern, recursive=True)
+    return sorted(each for each in found if os.path.isfile(each))
 
 
 def speech_parts(main_audiofile: str,
                  piped_list: list[dict],
                  sub_folder=".\\temp\\",
-                 db_handler=None) -> list[dict]:
+                 db_handler=None,
+                 samples=None) -> list[dict]:
     """
-    Creates an audio file for each instance of speech found by PyAnnote
+    Creates an audio file for each instance of speech found by PyAnnote, 16 kHz mono as that is all whisper
+    wants anyway
 
     :param main_audiofile:
     :param piped_list:
     :param sub_folder:
     :param CryptDB db_handler: handler for database entry
+    :param numpy.ndarray samples: optional already decoded audio, eg. the memmap of pcm_cache
     :return:
     """
-    try:
-        raw_audio = AudioSegment.from_file(main_audiofile, _detect_audio(main_audiofile))
-        raw_audio.set_frame_rate(44100)
-    except FileNotFoundError as err:
-        logger.error(f"Util.SpeechParts: can not open audio file: {main_audiofile} - {err}")
-        return []
+    if samples is None:
+        try:
+            samples = load_audio_array(main_audiofile)
+        except (FileNotFoundError, RuntimeError) as err:
+            logger.error(f"Util.SpeechParts: can not open audio file: {main_audiofile} - {err}")
+            return []
+
+    if db_handler and isinstance(db_handler, CryptDB):
+        with db_handler.batch():
+            return _export_parts(main_audiofile, samples, piped_list, sub_folder, db_handler)
+    return _export_parts(main_audiofile, samples, piped_list, sub_folder, None)
 
+
+def _export_parts(main_audiofile: str, samples, piped_list: list[dict], sub_folder: str, db_handler) -> list[dict]:
     enriched_piped_list = []
     for i, each in enumerate(piped_list, start=1):
-        new_audio = raw_audio[each['start_ms']:each['stop_ms']]
         #  TODO: change this, its insane as it is
-        file_export_name = f"{sub_folder}{main_audiofile}_{i}.wav"
-        if db_handler and isinstance(db_handler, CryptDB) and 'uid' in each:
-            db_handler.update_line(each['uid'], sub_file_path=file_export_name)
-        new_audio.export(file_export_name, "wav")
+        # lines from the database are named by uid, a resume only exports some of them and must not shift names
+        file_export_name = f"{sub_folder}{main_audiofile}_{each.get('uid', i)}.wav"
+        export_samples_wav(slice_samples(samples, each['start_ms'], each['stop_ms']), file_export_name)
+        if db_handler and 'uid' in each:  # only once the file is actually there
+            db_handler.update_line(each['uid'], sub_file_path=file_export_name, state=CryptDB.LINE_SLICED)
         enriched_piped_list.append({
             "start_ms": each['start_ms'],
             "stop_ms": each['stop_ms'],
@@ -106,14 +228,135 @@ def speech_parts(main_audiofile: str,
     return enriched_piped_list
 
 
+def load_audio_array(audio_file: str, sample_rate=SAMPLE_RATE):
+    """
+    Decodes and resamples the whole audio file exactly once into a mono float32 array, this is the very
+    same thing whisper does internally for every single file path it gets handed
+
+    :param str audio_file: path to any audio file ffmpeg can read
+    :param int sample_rate: target sample rate, whisper wants 16 kHz
+    :return: numpy array of float32 samples in the range of -1.0 to 1.0
+    :rtype: numpy.ndarray
+    """
+    from whisper.audio import load_audio
+    return load_audio(audio_file, sr=sample_rate)
+
+
+def load_audio_window(audio_file: str, start_ms: int, duration_ms: int, sample_rate=SAMPLE_RATE):
+    """
+    Same as load_audio_array but only decodes the given part of the file, ffmpeg seeks to the start on
+    its own so memory only depends on the duration
+
+    :param str audio_file: path to any audio file ffmpeg can read
+    :param int start_ms: start of the window in milliseconds from the absolute start
+    :param int duration_ms: length of the window, less comes back at the end of the file
+    :param int sample_rate: target sample rate
+    :return: numpy array of float32 samples in the range of -1.0 to 1.0, empty after the end of the file
+    :rtype: numpy.ndarray
+    """
+    import subprocess
+    import numpy as np
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0", "-ss", f"{start_ms / 1000:.3f}", "-t", f"{duration_ms / 1000:.3f}",
+           "-i", audio_file, "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-"]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as err:
+        raise RuntimeError(f"Failed to load audio window: {err.stderr.decode(errors='replace')}") from err
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def slice_samples(samples, start_ms: int, stop_ms: int, sample_rate=SAMPLE_RATE):
+    """
+    Cuts a part out of a decoded audio array by millisecond offsets, as this is basic slicing numpy gives
+    us a view and not a copy
+
+    :param numpy.ndarray samples: decoded audio as created by load_audio_array
+    :param int start_ms: start of the chunk in milliseconds from the absolute start
+    :param int stop_ms: stop of the chunk in milliseconds from the absolute start
+    :param int sample_rate: sample rate of the given array
+    :return: view of the samples between start and stop
+    :rtype: numpy.ndarray
+    """
+    start = max(0, int(start_ms) * sample_rate // 1000)
+    stop = max(start, int(stop_ms) * sample_rate // 1000)
+    return samples[start:stop]
+
+
+def speech_samples(main_audiofile: str, piped_list: list[dict], samples=None) -> list[dict]:
+    """
+    In-memory counterpart of speech_parts, instead of exporting a wav file for each instance of speech
+    it attaches a view into the decoded audio under the key 'samples'
+
+    :param str main_audiofile: path to the original audio file
+    :param list[dict] piped_list: list with at least 'start_ms', 'stop_ms' and 'speaker_id'
+    :param numpy.ndarray samples: already decoded audio, if None the file gets decoded here
+    :return: list of dictionaries like speech_parts but with 'samples' instead of 'sub_file_path'
+    """
+    if samples is None:
+        try:
+            samples = load_audio_array(main_audiofile)
+        except (FileNotFoundError, RuntimeError) as err:  # whisper raises RuntimeError if ffmpeg fails
+            logger.error(f"Util.SpeechSamples: can not decode audio file: {main_audiofile} - {err}")
+            return []
+    enriched_piped_list = []
+    for each in piped_list:
+        enriched_piped_list.append({
+            "start_ms": each['start_ms'],
+            "stop_ms": each['stop_ms'],
+            "speaker_id": each['speaker_id'],
+            "samples": slice_samples(samples, each['start_ms'], each['stop_ms'])
+        })
+    return enriched_piped_list
+
+
+def export_samples_wav(samples, out_file: str, sample_rate=SAMPLE_RATE):
+    """
+    Writes float samples as 16 bit mono wav file, no pydub needed for that
+
+    :param numpy.ndarray samples: float32 audio in the range of -1.0 to 1.0
+    :param str out_file: path of the new wav file
+    :param int sample_rate: sample rate of the given samples
+    """
+    import wave
+    import numpy as np
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(out_file, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+
+
+def diarize(audio_file: str, auth_token: str):
+    """
+    Runs pyannote and yields the segments one after another, meant as source for a Pipeline
+
+    :param str audio_file: path to the audio file
+    :param str auth_token: hugging face api key
+    :return: iterator of dictionaries with the keys 'start_ms', 'stop_ms' and 'speaker_id'
+    """
+    yield from annotation2dict(create_annotation(audio_file, auth_token))
+
+
 def create_stage_script(finalized_piped_list: list[dict], names_map: dict, biases=None):
     # simplest form
-    output = []
-    for each in finalized_piped_list:
-        clear = cleanup_transcript(each['transcription'], biases)
+    return list(iter_stage_script(finalized_piped_list, names_map, biases))
+
+
+def iter_stage_script(lines, names_map: dict, biases=None, text_key="transcription"):
+    """
+    Same as create_stage_script but one line at a time, so it also works on streamed database lines
+
+    :param lines: iterable of dictionaries with 'speaker_id' and the text under `text_key`
+    :param dict names_map: `speaker_id: name`
+    :param biases: list of phrases that are known hallucinations and get dropped
+    :param str text_key: 'transcription' for pipeline lists, 'content' for database lines
+    :return: iterator of formatted script lines
+    """
+    for each in lines:
+        clear = cleanup_transcript(each[text_key] or "", biases)
         if clear:
-            output.append(f"[{names_map.get(each['speaker_id'], each['speaker_id'])}]: {clear}\n")
-    return output
+            yield f"[{names_map.get(each['speaker_id'], each['speaker_id'])}]: {clear}\n"
 
 
 def cleanup_transcript(input_txt: str, biases=None):
@@ -125,25 +368,24 @@ def cleanup_transcript(input_txt: str, biases=None):
     return trimmed
 
 
-def transcribe_enriched(enriched_piped_list: list[dict], model="medium", language="en"):
+def transcribe_enriched(enriched_piped_list: list[dict], model="medium", language="en", cache=None):
     """
     This uses the GPU..or CPU, but big time in any case. I really hate this because it uses some model it will
     download from somewhere and just do magic stuff, but without this it wouldnt work half as well.
 
-    What it does is using whisper and torch to transcribe the temporary files created be enriched pipe
+    What it does is using whisper and torch to transcribe the temporary files created be enriched pipe, or
+    the in-memory samples if the list was created by speech_samples
 
-    :param enriched_piped_list: the list[dict] created by util.speech_parts
+    :param enriched_piped_list: the list[dict] created by util.speech_parts or util.speech_samples
     :param str model:
+    :param TranscriptionCache cache: optional, only used for lines that come with samples
     :return:
     """
-    import torch
-    import whisper
-
-    devices = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    model = whisper.load_model(model, device=devices)
+    model_name, model = model, registry.whisper(model)
 
     for each in enriched_piped_list:
-        result = model.transcribe(each['sub_file_path'], language=language)
+        result = _transcribe_cached(model, model_name, each.get('samples', None), each.get('sub_file_path', None),
+                                    language, cache)
         logger.debug(result)
         each['transcription'] = str(result['text'])
         each['transcribe'] = result
@@ -151,7 +393,7 @@ def transcribe_enriched(enriched_piped_list: list[dict], model="medium", languag
     return enriched_piped_list
 
 
-def transcribe_line(line: dict, model: Whisper, language="en") -> dict:
+def transcribe_line(line: dict, model: "Whisper", language="en", samples=None, cache=None, model_name="") -> dict:
     """
     Takes a singular 'line' dictionary as input, only relevant part is the 'file' path,
     everything else just gets passed along
@@ -159,28 +401,39 @@ def transcribe_line(line: dict, model: Whisper, language="en") -> dict:
     :param dict line:
     :param Whisper model: loaded Whisper model
     :param str language: optional language specifier, default "en"
+    :param numpy.ndarray samples: optional 16 kHz float32 audio of this line, if given the 'sub_file_path' is ignored
+    :param TranscriptionCache cache: optional, samples that were transcribed before skip the model
+    :param str model_name: size of the given model, part of the cache key
     :return: the same line dictionary but with 'transcribe' and 'transcription' as additional
     keys, the first containing all whisper json data, the latter just the transcribed text
     """
-    result = model.transcribe(line['sub_file_path'], language=language)
+    result = _transcribe_cached(model, model_name, samples, line.get('sub_file_path', None), language, cache)
     logger.debug(result)
     line['transcription'] = str(result['text'])
     line['transcribe'] = result
     return line  # as its a dict it should already be updated by reference
 
 
-def _unspecific_timestring_to_mill(time: str):
+def _transcribe_cached(model: "Whisper", model_name: str, samples, file_path, language, cache=None) -> dict:
     """
-    Takes a string of the format '00:00:07.095' to become time in milliseconds
-    :param time:
-    :return:
+    model.transcribe on the samples if there are some, the file otherwise. Only samples get looked up
+    in the cache, a file path says nothing about its content
     """
-    spl = time.split(":")
-    s = (int)((int(spl[0]) * 60 * 60 + int(spl[1]) * 60 + float(spl[2]) )* 1000)
-    return s
-
-
-def create_pipelinetxt(audio_file, auth_token):
+    if samples is None:
+        return model.transcribe(file_path, language=language)
+    key = None
+    if cache:
+        key = cache.make_key(samples, model_name, language, {"transcribe": True})
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    result = model.transcribe(samples, language=language)
+    if key:
+        cache.put(key, result)
+    return result
+
+
+def create_annotation(audio_file, auth_token):
     """
     This uses your CPU/GPU for torch neuronal network stuff and also torch under the hood. Its even worse than
     whisper because it will use some pretrained model we just obtain "somehow" via the internet. You actually
@@ -188,49 +441,73 @@ def create_pipelinetxt(audio_file, auth_token):
 
     :param audio_file:
     :param auth_token:
-    :return:
+    :return: the pyannote.core.Annotation of the file
     """
-    from pyannote.audio import Pipeline
-    pipeline = Pipeline.from_pretrained('pyannote/speaker-diarization',
-                                        use_auth_token=auth_token, cache_dir="model")
+    pipeline = registry.pipeline(auth_token)
     one_file = {
         'uri': "notnecessary",
         'audio': audio_file
     }
-    pipe_txt = pipeline(one_file)
+    return pipeline(one_file)
+
+
+def create_pipelinetxt(audio_file, auth_token):
+    """
+    Same as create_annotation but as the text pyannote prints, only for raw dumps, everything else should
+    take the segments straight from the annotation with annotation2dict
+    """
+    return str(create_annotation(audio_file, auth_token))
+
+
+def annotation2dict(annotation):
+    """
+    Reads the segments directly from the tracks of a pyannote annotation, no detour over its text form
+
+    :param pyannote.core.Annotation annotation: output of the diarization pipeline
+    :return: iterator of dictionaries with the keys 'start_ms', 'stop_ms' and 'speaker_id', ordered by start
+    """
+    for segment, _, label in annotation.itertracks(yield_label=True):
+        yield {
+            "start_ms": int(round(segment.start * 1000)),
+            "stop_ms": int(round(segment.end * 1000)),
+            "speaker_id": str(label)
+        }
+
 
-    return str(pipe_txt)
+# '[ 00:00:01.240 -->  00:00:03.062] A SPEAKER_00', hours, minutes, seconds and fraction of both times,
+# the track name and the label
+_PIPELINE_LINE = re.compile(r"^\[[ \t]*((\d+):(\d+):(\d+)\.(\d+))[ \t]*-->[ \t]*((\d+):(\d+):(\d+)\.(\d+))[ \t]*\]"
+                            r"[ \t]+\S+[ \t]+(\S+)[ \t]*\r?$", re.MULTILINE)
+
+
+def _groups2mill(hours: str, minutes: str, seconds: str, fraction: str) -> int:
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(fraction[:3].ljust(3, "0"))
 
 
 def pipelinetxt2dict(inputblock: str, mode=0) -> list[dict]:
     """
-    Transforms the output of pyannote pipeline into something one can work with
+    Transforms the text output of pyannote into something one can work with, only needed for old dumps
+    as the pipeline itself uses annotation2dict nowadays
 
-    I really don't know why I have to do this, shouldn't there already be a function that does this for me?
+    One pass of a compiled pattern over the whole block, lines that do not look like a segment are skipped
 
     :param str inputblock: a block of cheese..or the output of pyannote
     :param int mode: if 0 millisecond timings, else string times will be used
     :return: list of dictionary with three keys: start, end, speaker
     """
-    pattern = r"\[\s([0-9]+:[0-9]+:[0-9]+\.[0-9]+)\s-->\s\s([0-9]+:[0-9]+:[0-9]+\.[0-9]+)\]\s+.+(SPEAKER_[0-9]+)"
-
-    lines = inputblock.split("\n")
     many_words = []
-    for each in lines:
-        groupos = re.search(pattern, each)
-        if len(groupos.regs) == 4:
-            f = groupos.regs
-            start = each[f[1][0]:f[1][1]]
-            end = each[f[2][0]:f[2][1]]
-            if mode == 0:
-                start = _unspecific_timestring_to_mill(start)
-                end = _unspecific_timestring_to_mill(end)
-            words = {
-                "start_ms": start,
-                "stop_ms": end,
-                "speaker_id": each[f[3][0]:f[3][1]]
-            }
-            many_words.append(words)
+    for match in _PIPELINE_LINE.finditer(inputblock):
+        parts = match.groups()
+        if mode == 0:
+            start = _groups2mill(*parts[1:5])
+            end = _groups2mill(*parts[6:10])
+        else:
+            start, end = parts[0], parts[5]
+        many_words.append({
+            "start_ms": start,
+            "stop_ms": end,
+            "speaker_id": parts[10]
+        })
     return many_words
 
 
@@ -248,6 +525,35 @@ def piped_speakers(piped_list: list[dict]) -> list:
     return list(speakers)
 
 
+project_columns = ('uid', 'given_name', 'num_lines', 'num_speakers', 'status', 'rtf', 'last_change', 'file_path')
+
+
+def project_table_rows(projects, columns=project_columns, shorten=None, rtf=None):
+    """
+    Display values of projects for the TUI table, lives here so it can be used without textual
+
+    :param projects: iterable of projects as listed by CryptDB
+    :param columns: the columns to show, in that order
+    :param dict shorten: `column: maximum length`, longer values get cut on the left side
+    :param dict rtf: `project_id: real time factor` as CryptDB.fetch_project_rtf gives it, for the column 'rtf'
+    :return: iterator of one list of values per project
+    """
+    shorten = shorten or {'file_path': 50, 'given_name': 24}
+    rtf = rtf or {}
+    for row in projects:
+        one_row = []
+        for col in columns:
+            if col in shorten:
+                one_row.append(shorten_left_pad(row.get(col, ""), shorten[col]))
+            elif col == "status":
+                one_row.append(CryptDB.status_map.get(row.get('status', -1), CryptDB.status_map[-1]))
+            elif col == "rtf":
+                one_row.append(f"{rtf[row['uid']]:.3f}" if row.get('uid') in rtf else "")
+            else:
+                one_row.append(row.get(col, ""))
+        yield one_row
+
+
 def shorten_left_pad(line: str, length: int, filler="..") -> str:
     """
     Simply shortens a string to a maximum length and adds some filler symbols to the left
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+pyannote wants the whole file at once, for a six hour hearing that means a lot of memory and no result
+at all until the very end. Here the recording is diarized in overlapping windows that get decoded one at a
+time. pyannote names the speakers anew in every window, so SPEAKER_00 in one window might be SPEAKER_02 in
+the next. The labels are linked over the part both windows share, whoever talks at the same time in both
+is the same person, and by comparing the speaker embeddings if the pipeline hands them out.
+
+Each window owns the half of its overlaps closest to it, a segment that crosses that middle gets cut
+there and the coalesce pass glues both halves back together.
+"""
+
+import math
+import logging
+from collections import defaultdict
+from typing import Callable, Iterator
+
+import util
+from model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+class SpeakerLinker:
+    """Translates the per window labels of pyannote into labels that are valid for the whole recording"""
+
+    def __init__(self, similarity=0.6):
+        """
+        :param float similarity: minimum cosine similarity of two embeddings to count as the same speaker
+        """
+        self.similarity = similarity
+        self.centroids = {}  # global label: (summed embedding, number of windows)
+        self.known = 0
+
+    def link(self, segments: list[dict], previous: list[dict], region: tuple, embeddings=None) -> dict:
+        """
+        :param segments: segments of the new window with its own labels, absolute times
+        :param previous: segments of the window before that reach into the shared region, already global labels
+        :param region: (start_ms, stop_ms) of the part both windows cover
+        :param dict embeddings: optional `local label: embedding vector` of the new window
+        :return: dictionary `local label: global label` for every label in segments
+        """
+        embeddings = {label: vector for label, vector in (embeddings or {}).items() if _usable(vector)}
+        together = defaultdict(int)
+        for each in segments:
+            if each['stop_ms'] <= region[0] or each['start_ms'] >= region[1]:
+                continue
+            for other in previous:
+                shared = (min(each['stop_ms'], other['stop_ms'], region[1])
+                          - max(each['start_ms'], other['start_ms'], region[0]))
+                if shared > 0:
+                    together[(each['speaker_id'], other['speaker_id'])] += shared
+        mapping = {}
+        taken = set()
+        for (local, known), _ in sorted(together.items(), key=lambda x: -x[1]):
+            if local not in mapping and known not in taken:
+                mapping[local] = known
+                taken.add(known)
+        for local in dict.fromkeys(each['speaker_id'] for each in segments):  # first appearance order
+            if local in mapping:
+                continue
+            match = self._closest(embeddings.get(local, None), taken)
+            if match is None:
+                match = f"SPEAKER_{self.known:02d}"
+                self.known += 1
+            mapping[local] = match
+            taken.add(match)
+        for local, known in mapping.items():
+            if local in embeddings:
+                summed, count = self.centroids.get(known, ([0.0] * len(embeddings[local]), 0))
+                self.centroids[known] = ([a + b for a, b in zip(summed, embeddings[local])], count + 1)
+        return mapping
+
+    def _closest(self, vector, taken: set):
+        if vector is None:
+            return None
+        best, best_score = None, self.similarity
+        for label, (summed, _) in self.centroids.items():
+            if label in taken:
+                continue
+            score = _cosine(vector, summed)
+            if score >= best_score:
+                best, best_score = label, score
+        return best
+
+
+def _usable(vector) -> bool:
+    """pyannote gives speakers with too little speech a NaN embedding"""
+    return vector is not None and len(vector) > 0 and not any(math.isnan(x) for x in vector)
+
+
+def _cosine(a, b) -> float:
+    dot = math.fsum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(math.fsum(x * x for x in a)) * math.sqrt(math.fsum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def pyannote_window(auth_token: str) -> Callable:
+    """
+    :return: callable(samples) -> (segments relative to the window, dictionary `label: embedding`)
+    """
+    pipeline = registry.pipeline(auth_token)
+
+    def diarize_window(samples):
+        import torch
+        audio = {"waveform": torch.from_numpy(samples).unsqueeze(0), "sample_rate": util.SAMPLE_RATE}
+        try:
+            annotation, vectors = pipeline(audio, return_embeddings=True)
+            embeddings = {label: [float(x) for x in vector] for label, vector in zip(annotation.labels(), vectors)}
+        except TypeError:  # before pyannote 3.1 the pipeline keeps its embeddings to itself
+            annotation, embeddings = pipeline(audio), {}
+        return list(util.annotation2dict(annotation)), embeddings
+    return diarize_window
+
+
+def diarize_windowed(audio_file: str,
+                     auth_token=None,
+                     window_ms=30 * 60 * 1000,
+                     overlap_ms=60 * 1000,
+                     similarity=0.6,
+                     load_window=util.load_audio_window,
+                     diarize_window=None) -> Iterator[dict]:
+    """
+    Drop in replacement for util.diarize that never holds more than one window of audio, segments are
+    yielded as soon as their window is done
+
+    :param str audio_file: path to the audio file
+    :param str auth_token: hugging face api key
+    :param int window_ms: length of one window
+    :param int overlap_ms: part of a window that is also in the one before, speakers get linked over it
+    :param float similarity: minimum cosine similarity of the embeddings for speakers that were silent in the overlap
+    :param load_window: callable(audio_file, start_ms, duration_ms) -> float32 samples
+    :param diarize_window: callable(samples) -> (segments, embeddings), by default pyannote
+    :return: iterator of dictionaries with the keys 'start_ms', 'stop_ms' and 'speaker_id'
+    """
+    if not 0 <= overlap_ms < window_ms:
+        raise ValueError(f"overlap of {overlap_ms} ms does not fit into windows of {window_ms} ms")
+    diarize_window = diarize_window or pyannote_window(auth_token)
+    linker = SpeakerLinker(similarity)
+    step = window_ms - overlap_ms
+    start = 0
+    index = 0
+    previous = []  # segments of the last window inside the region it shares with the next one
+    tail = []  # segments of the last window behind the middle of the next overlap
+    while True:
+        samples = load_window(audio_file, start, window_ms)
+        if len(samples) == 0:  # the window before ended exactly with the file, so it owns its tail after all
+            yield from tail
+            break
+        length_ms = len(samples) * 1000 // util.SAMPLE_RATE
+        last = length_ms < window_ms
+        local, embeddings = diarize_window(samples)
+        segments = sorted((dict(each, start_ms=each['start_ms'] + start, stop_ms=each['stop_ms'] + start)
+                           for each in local), key=lambda x: x['start_ms'])
+        mapping = linker.link(segments, previous, (start, start + overlap_ms), embeddings)
+        for each in segments:
+            each['speaker_id'] = mapping[each['speaker_id']]
+        own_from = start + overlap_ms // 2 if index else 0
+        own_to = float("inf") if last else start + step + overlap_ms // 2
+        count = 0
+        for each in _clip(segments, own_from, own_to):
+            count += 1
+            yield each
+        logger.info(f"Diarization: window {index + 1} ({start // 1000}s - {(start + length_ms) // 1000}s) "
+                    f"done, {count} segments, {linker.known} speakers so far")
+        if last:
+            break
+        tail = _clip(segments, own_to, float("inf"))
+        previous = [each for each in segments if each['stop_ms'] > start + step]
+        start += step
+        index += 1
+
+
+def _clip(segments: list[dict], from_ms, to_ms) -> list[dict]:
+    clipped = []
+    for each in segments:
+        start, stop = max(each['start_ms'], from_ms), min(each['stop_ms'], to_ms)
+        if stop > start:
+            clipped.append(dict(each, start_ms=start, stop_ms=stop))
+    return clipped
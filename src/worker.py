@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+"""
+Long running worker for the job table. It claims one job after the other and keeps its models resident in
+the registry the whole time, so only the first job pays for loading them. As many workers as the hardware
+allows can share one database file, a claim is a single sqlite write transaction.
+
+While a job runs a heartbeat thread renews the lease, if the worker dies the lease runs out and the next
+worker claims the job again and resumes the project the dead one left behind. A locked database only delays
+the renewal, the heartbeat keeps trying as long as the lease is still valid. If it really is gone somebody
+else might already work on the job, the heartbeat then interrupts the worker like ctrl+c would and the job
+is dropped without a result. That only works for a worker in the main thread, one in any other thread
+finishes the job and its result is ignored.
+"""
+
+import os
+import time
+import signal
+import socket
+import logging
+import _thread
+import threading
+from typing import Callable
+
+from db_util import CryptDB
+from dto import Job
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseLost(BaseException):
+    """Raised in the worker when its job belongs to somebody else now, no `except Exception` may swallow it"""
+
+
+class JobWorker:
+    def __init__(self, db_file: str, process: Callable, name=None, lease_s=300, poll_s=5.0):
+        """
+        :param str db_file: path to the database with the job table
+        :param process: callable(backend, job, worker name), does the work and raises if it fails
+        :param str name: unique name of this worker, host and pid by default
+        :param int lease_s: seconds a claim is valid without renewal, a third of it is the heartbeat interval
+        :param float poll_s: pause between two looks at an empty queue
+        """
+        self.db_file = db_file
+        self.process = process
+        self.name = name or worker_name()
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+        self.done = 0
+        self.failed = 0
+        self.lost = 0
+        self._stop = threading.Event()
+        self._abortable = False  # whether the heartbeat can interrupt the job, see _arm
+
+    def stop(self, *_):
+        """Finishes the running job and exits afterwards, usable as signal handler"""
+        logger.info(f"Worker {self.name}: stopping after the current job")
+        self._stop.set()
+
+    def run(self, drain=False, max_jobs=0) -> int:
+        """
+        Claims and processes jobs until stopped
+
+        :param bool drain: exit as soon as the queue is empty instead of waiting for new jobs
+        :param int max_jobs: exit after that many jobs, 0 for no limit
+        :return: number of jobs that got done
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+        backend = CryptDB(self.db_file)
+        logger.info(f"Worker {self.name}: started on '{self.db_file}'")
+        try:
+            while not self._stop.is_set():
+                job = backend.claim_job(self.name, self.lease_s)
+                if not job:
+                    if drain:
+                        break
+                    self._stop.wait(self.poll_s)
+                    continue
+                try:
+                    self._run_job(backend, job)
+                except LeaseLost:  # the interrupt came in just while the job was wrapped up
+                    self.lost += 1
+                if max_jobs and self.done + self.failed >= max_jobs:
+                    break
+        finally:
+            backend.close()
+        logger.info(f"Worker {self.name}: exits, {self.done} jobs done, {self.failed} failed, {self.lost} lost")
+        return self.done
+
+    def _run_job(self, backend: CryptDB, job: Job):
+        logger.info(f"Worker {self.name}: job {job['uid']} '{job['file_path']}', attempt {job['attempts']}")
+        started = time.perf_counter()
+        finished = threading.Event()
+        lost = threading.Event()
+        previous = self._arm(finished, lost)
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job['uid'], finished, lost),
+                                     name=f"Heartbeat-{job['uid']}", daemon=True)
+        heartbeat.start()
+        error = None
+        try:
+            self.process(backend, job, self.name)
+        except LeaseLost:
+            logger.error(f"Worker {self.name}: job {job['uid']} aborted, it belongs to another worker now")
+        except KeyboardInterrupt:
+            finished.set()
+            backend.release_job(job['uid'], self.name)
+            raise
+        except Exception as err:
+            error = f"{type(err).__name__}: {err}"
+            logger.exception(f"Worker {self.name}: job {job['uid']} failed")
+        finally:
+            finished.set()
+            heartbeat.join()
+            if previous is not None:
+                signal.signal(signal.SIGINT, previous)
+        if lost.is_set():
+            self.lost += 1
+            return
+        completed = backend.complete_job(job['uid'], self.name, error)
+        for _ in range(3):  # the database was locked for longer than its timeout, the lease is still ours
+            if completed is not None:
+                break
+            time.sleep(self.poll_s)
+            completed = backend.complete_job(job['uid'], self.name, error)
+        if completed:
+            if error:
+                self.failed += 1
+            else:
+                self.done += 1
+                logger.info(f"Worker {self.name}: job {job['uid']} done in {time.perf_counter() - started:.1f}s")
+
+    def _arm(self, finished: threading.Event, lost: threading.Event):
+        """
+        Lets the heartbeat abort the job with a SIGINT that becomes LeaseLost, a real ctrl+c stays what it is
+
+        :return: the previous SIGINT handler, None if the worker does not run in the main thread
+        """
+        self._abortable = threading.current_thread() is threading.main_thread()
+        if not self._abortable:
+            return None
+        previous = signal.getsignal(signal.SIGINT)
+
+        def interrupted(signum, frame):
+            if lost.is_set():
+                if not finished.is_set():
+                    raise LeaseLost()
+                return  # too late, the job is over anyway
+            if callable(previous):
+                return previous(signum, frame)
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGINT, interrupted)
+        return previous
+
+    def _heartbeat(self, job_id: int, finished: threading.Event, lost: threading.Event):
+        """Renews the lease until the job is finished, with its own connection as sqlite wants it"""
+        backend = CryptDB(self.db_file)
+        interval = self.lease_s / 3
+        valid_until = time.monotonic() + self.lease_s
+        wait = interval
+        try:
+            while not finished.wait(wait):
+                renewed = backend.renew_job(job_id, self.name, self.lease_s)
+                if renewed:
+                    valid_until = time.monotonic() + self.lease_s
+                    wait = interval
+                    continue
+                wait = self.lease_s / 10
+                if renewed is None and time.monotonic() + wait < valid_until:
+                    logger.warning(f"Worker {self.name}: could not renew the lease of job {job_id}, trying again")
+                    continue
+                lost.set()
+                if finished.is_set():
+                    return
+                if self._abortable:
+                    logger.error(f"Worker {self.name}: lost the lease of job {job_id}, aborting it")
+                    _thread.interrupt_main()
+                else:
+                    logger.error(f"Worker {self.name}: lost the lease of job {job_id}, its result will be ignored")
+                return
+        finally:
+            backend.close()
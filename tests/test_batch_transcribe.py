@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from batch_transcribe import BatchTranscriber, StubWhisper, SAMPLE_RATE, WINDOW_SAMPLES
+
+
+class TestBatchTranscriber(unittest.TestCase):
+    def test_results_map_back_to_uid(self):
+        lines = [(uid, [0.0] * (uid * 37)) for uid in range(1, 101)]
+        engine = BatchTranscriber(StubWhisper(), batch_size=8, sort_window=2)
+        results = engine.transcribe_all(lines)
+        self.assertEqual(len(results), 100)
+        for uid, samples in lines:
+            self.assertEqual(results[uid]['text'], StubWhisper.text_for(samples))
+
+    def test_batches_reduce_calls(self):
+        stub = StubWhisper()
+        lines = [(uid, [0.0] * SAMPLE_RATE) for uid in range(64)]
+        BatchTranscriber(stub, batch_size=16).transcribe_all(lines)
+        self.assertEqual(stub.calls, 4)
+
+    def test_long_lines_go_sequential(self):
+        stub = StubWhisper()
+        lines = [(1, [0.0] * (WINDOW_SAMPLES + 1)), (2, [0.0] * 10), (3, [0.0] * 20)]
+        results = BatchTranscriber(stub, batch_size=16).transcribe_all(lines)
+        self.assertEqual(set(results), {1, 2, 3})
+        self.assertEqual(stub.calls, 2)
+
+    def test_language_passthrough(self):
+        results = BatchTranscriber(StubWhisper(), language="de").transcribe_all([(7, [0.0])])
+        self.assertEqual(results[7]['language'], "de")
+
+    def test_no_speech_gets_blanked(self):
+        lines = [(uid, [0.0] * SAMPLE_RATE) for uid in range(4)]
+        results = BatchTranscriber(StubWhisper(no_speech_prob=0.9, avg_logprob=-1.5)).transcribe_all(lines)
+        self.assertEqual({result['text'] for result in results.values()}, {""})
+        # the same probability with a confident text is kept, just like whisper does
+        results = BatchTranscriber(StubWhisper(no_speech_prob=0.9, avg_logprob=-0.2)).transcribe_all(lines)
+        self.assertEqual(results[0]['text'], StubWhisper.text_for(lines[0][1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
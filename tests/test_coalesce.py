@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from coalesce import coalesce_segments
+
+
+def seg(start_ms: int, stop_ms: int, speaker: str) -> dict:
+    return {"start_ms": start_ms, "stop_ms": stop_ms, "speaker_id": f"SPEAKER_{speaker}"}
+
+
+class TestCoalesce(unittest.TestCase):
+    def test_same_speaker_merges_across_short_gaps(self):
+        merged = list(coalesce_segments([seg(0, 1000, "00"), seg(1200, 2000, "00"), seg(3000, 4000, "00")]))
+        self.assertEqual([(m['start_ms'], m['stop_ms'], m['turns']) for m in merged],
+                         [(0, 2000, [0, 1]), (3000, 4000, [2])])
+
+    def test_speaker_change_splits(self):
+        merged = list(coalesce_segments([seg(0, 1000, "00"), seg(1100, 2000, "01"), seg(2100, 3000, "00")]))
+        self.assertEqual([m['speaker_id'] for m in merged], ["SPEAKER_00", "SPEAKER_01", "SPEAKER_00"])
+
+    def test_slivers(self):
+        turns = [seg(0, 2000, "00"),
+                 seg(2100, 2167, "01"),   # absorbed by the turn before
+                 seg(2300, 4000, "00"),   # same speaker again, merges over the sliver
+                 seg(9000, 9050, "01"),   # too far from both sides, gets dropped
+                 seg(20000, 20040, "01"),  # close to the next one only
+                 seg(20300, 22000, "00")]
+        merged = list(coalesce_segments(turns))
+        self.assertEqual([(m['start_ms'], m['stop_ms'], m['speaker_id'], m['turns']) for m in merged], [
+            (0, 4000, "SPEAKER_00", [0, 1, 2]),
+            (20000, 22000, "SPEAKER_00", [4, 5]),
+        ])
+
+    def test_max_length(self):
+        turns = [seg(i * 1000, i * 1000 + 900, "00") for i in range(100)]
+        merged = list(coalesce_segments(turns, max_length_ms=10000))
+        self.assertTrue(all(m['stop_ms'] - m['start_ms'] <= 10000 for m in merged))
+        self.assertEqual([t for m in merged for t in m['turns']], list(range(100)))
+
+    def test_disabled(self):
+        turns = [seg(0, 50, "00"), seg(60, 100, "01")]
+        merged = list(coalesce_segments(turns, max_gap_ms=-1, min_length_ms=0))
+        self.assertEqual(len(merged), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import os
+import sys
+import tempfile
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from batch_transcribe import StubWhisper, SAMPLE_RATE
+from cpu_pool import transcribe_cpu_pool
+from transcribe_cache import TranscriptionCache
+
+try:
+    import numpy
+except ImportError:  # comes with whisper
+    numpy = None
+
+
+def broken_loader():
+    raise RuntimeError("the pool should not have been started")
+
+
+def shared_blocks() -> set:
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestCPUPool(unittest.TestCase):
+    def setUp(self):
+        self.samples = numpy.random.default_rng(1).uniform(-0.5, 0.5, SAMPLE_RATE * 30).astype(numpy.float32)
+        # lengths differ so much that the shards finish in some order that is not the one of the lines
+        self.lines = [{"uid": uid, "start_ms": uid * 400, "stop_ms": uid * 400 + (uid % 7 + 1) * 300}
+                      for uid in range(1, 41)]
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.cache = TranscriptionCache(os.path.join(self.work_dir.name, "cache.db"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.work_dir.cleanup()
+
+    def expected(self, line) -> str:
+        return StubWhisper.text_for(range((line['stop_ms'] - line['start_ms']) * SAMPLE_RATE // 1000))
+
+    def test_every_line_once(self):
+        before = shared_blocks() if os.path.isdir("/dev/shm") else None
+        results = list(transcribe_cpu_pool(self.samples, self.lines, "stub", workers=2, threads=1, shard_size=3,
+                                           loader=StubWhisper, loader_args=(0.0, 0.05), cache=self.cache))
+        self.assertEqual(Counter(uid for uid, _ in results), Counter(each['uid'] for each in self.lines))
+        texts = dict(results)
+        for each in self.lines:
+            self.assertEqual(texts[each['uid']]['text'], self.expected(each))
+        if before is not None:
+            self.assertEqual(shared_blocks() - before, set())  # the audio block got unlinked
+
+        # everything is cached now, a loader that cannot load proves that no worker got started
+        again = list(transcribe_cpu_pool(self.samples, self.lines, "stub", workers=2, loader=broken_loader,
+                                         cache=self.cache))
+        self.assertEqual(sorted(again, key=lambda x: x[0]), sorted(results, key=lambda x: x[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
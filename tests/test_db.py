@@ -23,9 +23,225 @@ import unittest
 
 import logging
 import os
+import sys
+import sqlite3
+import tempfile
+import threading
 logging.basicConfig(filename=os.devnull)  # hides logging that occurs when testing for exceptions
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import util
+from db_util import CryptDB
+from dto import Line
+from crypt_statics import db_schema, db_migrations
+
 
 class TestCryptDB(unittest.TestCase):
     def __init__(self, *args, **kwargs):
-        super(TestCryptDB, self).__init__(*args, **kwargs)
\ No newline at end of file
+        super(TestCryptDB, self).__init__(*args, **kwargs)
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.db = CryptDB(os.path.join(self.work_dir.name, "test.db"))
+        self.project_id = self.db.create_project(given_name="Test", file_path="test.wav", status=0)
+        self.db.create_bulk_line(self.project_id, [
+            {"start_ms": i * 1000, "stop_ms": i * 1000 + 800, "speaker_id": f"SPEAKER_0{i % 3}"} for i in range(50)
+        ])
+
+    def tearDown(self):
+        self.db.close()
+        self.work_dir.cleanup()
+
+    def test_batch_update(self):
+        lines = self.db.fetch_project_lines(self.project_id, 100)
+        with self.db.batch(size=7):
+            for each in lines:
+                self.assertTrue(self.db.update_line(each['uid'], content=f"text {each['uid']}"))
+            self.db.update_line(lines[0]['uid'], content="changed", language="de")
+        for each in self.db.fetch_project_lines(self.project_id, 100):
+            if each['uid'] == lines[0]['uid']:
+                self.assertEqual((each['content'], each['language']), ("changed", "de"))
+            else:
+                self.assertEqual(each['content'], f"text {each['uid']}")
+
+    def test_batch_keeps_the_last_update(self):
+        uid = self.db.fetch_project_lines(self.project_id, 1)[0]['uid']
+        with self.db.batch():
+            self.db.update_line(uid, content="first")
+            self.db.update_line(uid, content="second", state=CryptDB.LINE_TRANSCRIBED)
+            self.db.update_line(uid, content="third")
+        line = self.db.fetch_line(uid)
+        self.assertEqual((line['content'], line['state']), ("third", CryptDB.LINE_TRANSCRIBED))
+
+    def test_batch_flushes_on_error(self):
+        uid = self.db.fetch_project_lines(self.project_id, 1)[0]['uid']
+        with self.assertRaises(RuntimeError):
+            with self.db.batch():
+                self.db.update_line(uid, content="kept")
+                raise RuntimeError("something unrelated")
+        self.assertEqual(self.db.fetch_line(uid)['content'], "kept")
+
+    def test_schema_migrations(self):
+        self.assertEqual(self.db.schema_version(), db_migrations[-1][0])
+        indexes = {row['name'] for row in self.db.cur.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn("idx_line_project_start", indexes)
+        self.assertIn("idx_speaker_project_speaker", indexes)
+        self.assertEqual(self.db.cur.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_migrate_old_file(self):
+        old_path = os.path.join(self.work_dir.name, "old.db")
+        raw = sqlite3.connect(old_path)
+        for key in ("project", "line", "speaker"):
+            raw.execute(db_schema[key])
+        raw.execute("INSERT INTO speaker (project_id, speaker_id, name) VALUES (1, 'SPEAKER_00', 'a')")
+        raw.execute("INSERT INTO speaker (project_id, speaker_id, name) VALUES (1, 'SPEAKER_00', 'b')")
+        raw.execute("INSERT INTO line (project_id, speaker_id, start_ms, content) VALUES (1, 'SPEAKER_00', 0, 'hi')")
+        raw.execute("INSERT INTO line (project_id, speaker_id, start_ms) VALUES (1, 'SPEAKER_00', 10)")
+        raw.commit()
+        raw.close()
+        old = CryptDB(old_path)
+        self.assertEqual(old.schema_version(), db_migrations[-1][0])
+        self.assertEqual(len(old.fetch_project_speaker(1)), 1)
+        self.assertFalse(old.create_speaker_id(1, "SPEAKER_00", ""))
+        self.assertEqual(old.count_line_states(1), {CryptDB.LINE_REGISTERED: 1, CryptDB.LINE_TRANSCRIBED: 1})
+        old.close()
+
+    def test_concurrent_migration(self):
+        path = os.path.join(self.work_dir.name, "shared.db")
+        raw = sqlite3.connect(path)
+        for key in ("project", "line", "speaker"):
+            raw.execute(db_schema[key])
+        raw.commit()
+        raw.close()
+        start = threading.Barrier(4)
+        versions = []
+
+        def open_db():
+            start.wait()
+            backend = CryptDB(path)
+            versions.append(backend.schema_version())
+            backend.close()
+
+        workers = [threading.Thread(target=open_db) for _ in range(4)]
+        for each in workers:
+            each.start()
+        for each in workers:
+            each.join()
+        self.assertEqual(versions, [db_migrations[-1][0]] * 4)
+        raw = sqlite3.connect(path)
+        applied = [row[0] for row in raw.execute("SELECT version FROM schema_version ORDER BY version")]
+        raw.close()
+        self.assertEqual(applied, [version for version, _ in db_migrations])
+
+    def test_iter_project_lines(self):
+        self.db.create_line(self.project_id, "SPEAKER_00", start_ms=500, stop_ms=700)
+        streamed = list(self.db.iter_project_lines(self.project_id, page_size=4))
+        self.assertEqual(len(streamed), 51)
+        self.assertEqual([each['start_ms'] for each in streamed], sorted(each['start_ms'] for each in streamed))
+        self.assertEqual(streamed[1]['start_ms'], 500)
+        projected = next(self.db.iter_project_lines(self.project_id, columns=("content",)))
+        self.assertEqual(set(projected.keys()), {"uid", "start_ms", "content"})
+
+    def test_failed_flush_raises(self):
+        lines = list(self.db.iter_project_lines(self.project_id))
+        self.db.cur.execute("CREATE TRIGGER no_updates BEFORE UPDATE ON line BEGIN SELECT RAISE(ABORT, 'nope'); END")
+        with self.assertRaises(sqlite3.Error):
+            with self.db.batch(size=100):
+                for each in lines[:10]:
+                    self.assertTrue(self.db.update_line(each['uid'], content="lost", state=CryptDB.LINE_TRANSCRIBED))
+        self.db.cur.execute("DROP TRIGGER no_updates")
+        self.assertEqual(self.db.count_line_states(self.project_id), {CryptDB.LINE_REGISTERED: 50})
+        with self.db.batch(size=100):  # the handler is still usable afterwards
+            self.db.update_line(lines[0]['uid'], content="fine", state=CryptDB.LINE_TRANSCRIBED)
+        self.assertEqual(self.db.count_line_states(self.project_id)[CryptDB.LINE_TRANSCRIBED], 1)
+
+    def test_resume_only_unfinished(self):
+        lines = list(self.db.iter_project_lines(self.project_id))
+        with self.db.batch(size=8):
+            for each in lines[:30]:
+                self.db.update_line(each['uid'], content="done", state=CryptDB.LINE_TRANSCRIBED)
+            self.db.update_line(lines[30]['uid'], sub_file_path="clip.wav", state=CryptDB.LINE_SLICED)
+        self.assertEqual(self.db.count_line_states(self.project_id),
+                         {CryptDB.LINE_REGISTERED: 19, CryptDB.LINE_SLICED: 1, CryptDB.LINE_TRANSCRIBED: 30})
+        unfinished = list(self.db.iter_project_lines(self.project_id, page_size=3, columns=("state",),
+                                                     below_state=CryptDB.LINE_TRANSCRIBED))
+        self.assertEqual([each['uid'] for each in unfinished], [each['uid'] for each in lines[30:]])
+        unsliced = list(self.db.iter_project_lines(self.project_id, below_state=CryptDB.LINE_SLICED))
+        self.assertEqual(len(unsliced), 19)
+        self.assertTrue(self.db.delete_project_lines(self.project_id))
+        self.assertEqual(self.db.count_line_states(self.project_id), {})
+
+    def test_line_dto(self):
+        line = self.db.fetch_project_lines(self.project_id, 1)[0]
+        self.assertIsInstance(line, Line)
+        self.assertEqual(line['start_ms'], line.start_ms)
+        self.assertIn("uid", line)
+        self.assertIsNone(line.get("content"))
+        self.assertEqual(line.get("nonsense", 5), 5)
+        self.assertEqual(set(line.to_dict().keys()), set(Line.__slots__))
+        self.assertFalse(hasattr(line, "__dict__"))
+
+    def test_reorder_lines(self):
+        self.db.create_line(self.project_id, "SPEAKER_00", start_ms=1500, stop_ms=1600)
+        self.assertTrue(self.db.reorder_lines(self.project_id))
+        lines = list(self.db.iter_project_lines(self.project_id))
+        self.assertIsNone(lines[0]['previous'])
+        self.assertIsNone(lines[-1]['next'])
+        for before, after in zip(lines, lines[1:]):
+            self.assertEqual(before['next'], after['uid'])
+            self.assertEqual(after['previous'], before['uid'])
+
+    def test_bulk_insert_links(self):
+        lines = list(self.db.iter_project_lines(self.project_id))
+        self.assertEqual(lines[0]['next'], lines[1]['uid'])
+        self.assertEqual(lines[-1]['previous'], lines[-2]['uid'])
+
+    def test_update_missing_line(self):
+        self.assertFalse(self.db.update_line(999999, content="nope"))
+
+    def test_diarization_by_fingerprint(self):
+        audio = os.path.join(self.work_dir.name, "audio.wav")
+        with open(audio, "wb") as audio_fh:
+            audio_fh.write(os.urandom(3 * 1024 * 1024))
+        fingerprint = util.file_fingerprint(audio)
+        self.assertEqual(self.db.fetch_diarization(fingerprint), [])
+        segments = [{"start_ms": i * 10, "stop_ms": i * 10 + 5, "speaker_id": "SPEAKER_01"} for i in range(20)]
+        self.assertTrue(self.db.save_diarization(self.project_id, fingerprint, segments))
+        self.assertEqual(self.db.fetch_diarization(fingerprint), segments)
+        # a sampled block changes, so does the fingerprint
+        with open(audio, "r+b") as audio_fh:
+            audio_fh.write(b"changed")
+        self.assertNotEqual(util.file_fingerprint(audio), fingerprint)
+
+    def test_relocate_project(self):
+        original = os.path.join(self.work_dir.name, "original.wav")
+        other = os.path.join(self.work_dir.name, "other.wav")
+        for path, content in ((original, b"a" * 5000), (other, b"b" * 5000)):
+            with open(path, "wb") as audio_fh:
+                audio_fh.write(content)
+        self.db.save_diarization(self.project_id, util.file_fingerprint(original), [])
+        os.rename(original, original + ".moved")
+        self.assertFalse(util.relocate_project(self.db, self.project_id, other))
+        self.assertTrue(util.relocate_project(self.db, self.project_id, original + ".moved"))
+        self.assertEqual(self.db.fetch_project(self.project_id)['file_path'], original + ".moved")
+
+    def test_job_leases(self):
+        first = self.db.enqueue_job("a.wav", {"language": "de"})
+        second = self.db.enqueue_job("b.wav")
+        job = self.db.claim_job("one", lease_s=60)
+        self.assertEqual((job['uid'], job['status'], job['attempts']), (first, 1, 1))
+        self.assertEqual(self.db.claim_job("two", lease_s=60)['uid'], second)
+        self.assertIsNone(self.db.claim_job("three"))
+        self.assertFalse(self.db.complete_job(first, "two"))  # not its job
+        self.assertTrue(self.db.assign_job_project(first, "one", self.project_id))
+        # the lease of "one" runs out, "three" takes over and "one" can not finish anymore
+        self.db.cur.execute("UPDATE job SET lease_until = 0 WHERE uid = ?", (first,))
+        self.db.db.commit()
+        taken = self.db.claim_job("three", lease_s=60)
+        self.assertEqual((taken['uid'], taken['attempts'], taken['project_id']), (first, 2, self.project_id))
+        self.assertFalse(self.db.renew_job(first, "one"))
+        self.assertFalse(self.db.complete_job(first, "one"))
+        self.assertTrue(self.db.complete_job(first, "three"))
+        self.assertTrue(self.db.complete_job(second, "two", error="broken"))
+        self.assertEqual([each['status'] for each in self.db.list_jobs()], [3, 2])
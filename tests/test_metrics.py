@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import unittest
+
+import logging
+import os
+import sys
+import time
+import tempfile
+logging.basicConfig(filename=os.devnull)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from db_util import CryptDB
+import profiling
+from metrics import RunMetrics
+from pipeline import Pipeline
+
+
+class TestRunMetrics(unittest.TestCase):
+    def test_busy_excludes_waiting(self):
+        metrics = RunMetrics("process", "tiny")
+
+        def slow(items):
+            for each in items:
+                time.sleep(0.01)
+                yield each
+
+        segments = [{"start_ms": i * 1000, "stop_ms": i * 1000 + 500, "speaker_id": "SPEAKER_00"} for i in range(20)]
+        Pipeline(maxsize=2).run_all(metrics.source("diarize", segments),
+                                    metrics.wrap("transcribe", slow),
+                                    metrics.wrap("write", lambda items: (each for each in items)))
+        stages = {each.stage: each for each in metrics.stages}
+        self.assertEqual(list(stages), ["diarize", "transcribe", "write"])
+        for each in stages.values():
+            self.assertEqual((each.segments, each.audio_s), (20, 10.0))
+        self.assertGreaterEqual(stages['transcribe'].busy_s, 0.19)
+        # the other two spend their time waiting for the slow one
+        self.assertLess(stages['write'].busy_s, stages['transcribe'].busy_s / 2)
+        self.assertLess(stages['diarize'].busy_s, stages['transcribe'].busy_s / 2)
+        self.assertGreaterEqual(stages['write'].wall_s, 0.19)
+
+    def test_stored_per_run(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            backend = CryptDB(os.path.join(work_dir, "metrics.db"))
+            project_id = backend.create_project(given_name="Test", status=1)
+            for kind in ("process", "batch", "resume"):
+                metrics = RunMetrics(kind, "tiny")
+                with metrics.stage("transcribe") as stage:
+                    stage.add({"start_ms": 0, "stop_ms": 2000})
+                rows = metrics.finish(backend, project_id, 60.0)
+                self.assertEqual([each['stage'] for each in rows], ["transcribe", "total"])
+            stored = backend.fetch_run_metrics(project_id, runs=1)
+            self.assertEqual([(each['kind'], each['stage']) for each in stored], [("resume", "transcribe"),
+                                                                                  ("resume", "total")])
+            self.assertEqual(stored[0]['audio_s'], 2.0)
+            self.assertEqual(len(backend.fetch_run_metrics()), 6)
+            # neither the resume nor the batch run cover the whole recording, the project keeps the RTF of the full run
+            process, = [each for each in backend.fetch_run_metrics(project_id)
+                        if (each['kind'], each['stage']) == ("process", "total")]
+            rtf = backend.fetch_project_rtf()
+            self.assertAlmostEqual(rtf[project_id], process['wall_s'] / 60.0)
+            backend.close()
+
+    def test_profiled_stages(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            profiling.enable(work_dir)
+            try:
+                metrics = RunMetrics("process", "tiny")
+                Pipeline(maxsize=2).run_all(metrics.source("diarize", [{"start_ms": 0, "stop_ms": 500}] * 10),
+                                            metrics.wrap("write", lambda items: ([0] * 1000 for _ in items)))
+            finally:
+                profiling.disable()
+            self.assertEqual(metrics.kind, "process-profiled")
+            folder = os.path.join(work_dir, f"profile-{metrics.run_id}")
+            files = sorted(os.listdir(folder))
+            self.assertEqual(len(files), 4)
+            self.assertTrue(any(each.endswith("-write.pstats") for each in files))
+            self.assertTrue(any(each.endswith("-diarize.alloc.txt") for each in files))
+            self.assertIsNone(RunMetrics("process").profiler)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from model_registry import ModelRegistry
+
+
+class TestModelRegistry(unittest.TestCase):
+    def test_reuses_resident_model(self):
+        registry = ModelRegistry()
+        loads = []
+        for _ in range(3):
+            registry.get("whisper", "tiny", "cpu", lambda: loads.append(1) or object())
+        self.assertEqual(len(loads), 1)
+
+    def test_lru_eviction(self):
+        registry = ModelRegistry(max_models=2)
+        registry.get("whisper", "tiny", "cpu", object)
+        registry.get("whisper", "base", "cpu", object)
+        registry.get("whisper", "tiny", "cpu", object)  # tiny is now the most recent
+        registry.get("whisper", "small", "cpu", object)
+        self.assertEqual(registry.resident(), [("whisper", "tiny", "cpu"), ("whisper", "small", "cpu")])
+
+    def test_concurrent_load_happens_once(self):
+        registry = ModelRegistry()
+        loads = []
+
+        def slow_loader():
+            loads.append(1)
+            time.sleep(0.05)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get("p", "x", "cpu", slow_loader)))
+                   for _ in range(4)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len({id(r) for r in results}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
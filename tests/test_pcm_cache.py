@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+
+import os
+import sys
+import logging
+import tempfile
+import unittest
+from array import array
+logging.basicConfig(filename=os.devnull)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import pcm_cache
+from db_util import CryptDB
+
+try:
+    import numpy
+except ImportError:  # comes with whisper
+    numpy = None
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestPCMCache(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.audio = os.path.join(self.work_dir.name, "audio.wav")
+        with open(self.audio, "wb") as audio_fh:
+            audio_fh.write(b"not really audio")
+        self.folder = os.path.join(self.work_dir.name, "pcm")
+        os.makedirs(self.folder)
+        self.path = pcm_cache.pcm_path(self.audio, self.folder)
+        with open(self.path, "wb") as pcm_fh:
+            array("f", (i / 1000 for i in range(16000))).tofile(pcm_fh)
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_slices_are_views(self):
+        samples = pcm_cache.load(self.audio, folder=self.folder)
+        self.assertIsInstance(samples, numpy.memmap)
+        part = samples[1000:2000]
+        self.assertEqual(len(part), 1000)
+        self.assertAlmostEqual(float(part[0]), 1.0, places=5)
+        self.assertFalse(part.flags.owndata)
+
+    def test_project_gets_linked(self):
+        backend = CryptDB(os.path.join(self.work_dir.name, "test.db"))
+        project_id = backend.create_project(file_path=self.audio, status=1)
+        samples = pcm_cache.project_samples(backend, backend.fetch_project(project_id), self.folder)
+        self.assertEqual(len(samples), 16000)
+        self.assertEqual(backend.fetch_project(project_id)['pcm_path'], self.path)
+        backend.close()
+
+    def test_empty_file(self):
+        empty = os.path.join(self.folder, "empty.f32")
+        open(empty, "wb").close()
+        self.assertEqual(len(pcm_cache.open_pcm(empty)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
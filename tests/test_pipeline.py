@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from pipeline import Pipeline, chunked
+
+
+def double(items):
+    for item in items:
+        yield item * 2
+
+
+def explode_at_five(items):
+    for item in items:
+        if item == 5:
+            raise ValueError("five")
+        yield item
+
+
+class TestPipeline(unittest.TestCase):
+    def test_stages_in_order(self):
+        out = list(Pipeline(maxsize=2).run(range(100), double, lambda items: (i + 1 for i in items)))
+        self.assertEqual(out, [i * 2 + 1 for i in range(100)])
+
+    def test_error_stops_everything(self):
+        pipe = Pipeline(maxsize=2)
+        with self.assertRaises(ValueError):
+            pipe.run_all(range(10000), explode_at_five, double)
+        self.assertTrue(pipe.aborted)
+
+    def test_chunked(self):
+        self.assertEqual(list(chunked(iter(range(5)), 2)), [[0, 1], [2, 3], [4]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import unittest
+
+import io
+import logging
+import os
+import sys
+import time
+logging.basicConfig(filename=os.devnull)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import progress
+from metrics import RunMetrics
+from pipeline import Pipeline
+from progress import ProgressEvent
+
+
+class TestProgress(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        progress.subscribe(self.events.append)
+
+    def tearDown(self):
+        progress.unsubscribe(self.events.append)
+
+    def test_stage_events(self):
+        metrics = RunMetrics("process", "tiny", project_id=7)
+        segments = [{"start_ms": i * 1000, "stop_ms": i * 1000 + 500} for i in range(50)]
+
+        def slow(items):
+            for each in items:
+                time.sleep(0.01)
+                yield each
+
+        Pipeline(maxsize=2).run_all(metrics.source("diarize", segments), metrics.wrap("transcribe", slow))
+        transcribe = [each for each in self.events if each.stage == "transcribe"]
+        self.assertEqual(transcribe[0].kind, ProgressEvent.START)
+        self.assertEqual((transcribe[-1].kind, transcribe[-1].done, transcribe[-1].audio_s), (ProgressEvent.END, 50, 25.0))
+        updates = [each for each in transcribe if each.kind == ProgressEvent.SEGMENT]
+        # rate limited, half a second of work gives a handful of updates and not one per line
+        self.assertTrue(0 < len(updates) < 10)
+        self.assertTrue(all(each.project_id == 7 for each in self.events))
+        # once the diarization is done the transcription knows how far it has to go
+        late = [each for each in updates if each.total]
+        self.assertTrue(all(each.total == 50 and each.eta_s is not None for each in late))
+
+    def test_pace_of_the_stage(self):
+        reporter = progress.Reporter("run", 1, [self.events.append], interval=0)
+        reporter.expect(4)
+        time.sleep(0.1)  # decoding or diarization before the stage, it must not slow down its ETA
+        reporter.start("transcribe")
+        reporter.segment("transcribe", 2, 20.0)
+        event = self.events[-1]
+        self.assertGreater(event.elapsed_s, 0.1)
+        self.assertLess(event.stage_elapsed_s, 0.05)
+        self.assertAlmostEqual(event.eta_s, event.stage_elapsed_s)
+        self.assertAlmostEqual(event.rtf, event.stage_elapsed_s / 20.0)
+
+    def test_unsubscribed_runs_have_no_reporter(self):
+        progress.unsubscribe(self.events.append)
+        self.assertIsNone(RunMetrics().progress)
+
+    def test_terminal_without_tty(self):
+        stream = io.StringIO()
+        printer = progress.TerminalProgress(stream)
+        for kind, stage, done in ((ProgressEvent.START, "slice", 0), (ProgressEvent.SEGMENT, "slice", 5),
+                                  (ProgressEvent.END, "slice", 10), (ProgressEvent.FINISHED, "total", 10)):
+            printer(ProgressEvent("run", 1, kind, stage, done, 10, 60.0, 30.0))
+        self.assertEqual(stream.getvalue().splitlines(), ["slice done, 10 lines in 0:30",
+                                                          "Run run done in 0:30, RTF 0.500"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import os
+import sys
+import subprocess
+import tempfile
+import unittest
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+class TestStartup(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        """torch, whisper and pydub must only be imported once something actually gets processed"""
+        probe = ("import sys, cli, util, db_util; "
+                 "print(','.join(m for m in ('torch', 'whisper', 'pydub', 'pyannote') if m in sys.modules))")
+        with tempfile.TemporaryDirectory() as work_dir:
+            proc = subprocess.run([sys.executable, "-c", probe], cwd=work_dir,
+                                  env=dict(os.environ, PYTHONPATH=SRC), capture_output=True, text=True)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertEqual(proc.stdout.strip(), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
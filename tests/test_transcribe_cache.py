@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from batch_transcribe import BatchTranscriber, StubWhisper
+from transcribe_cache import TranscriptionCache
+
+
+class TestTranscriptionCache(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.cache = TranscriptionCache(os.path.join(self.work_dir.name, "cache.db"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.work_dir.cleanup()
+
+    def test_key_depends_on_everything(self):
+        key = self.cache.make_key([0.0, 0.5], "medium", "de", {"fp16": True})
+        self.assertEqual(key, self.cache.make_key([0.0, 0.5], "medium", "de", {"fp16": True}))
+        self.assertNotEqual(key, self.cache.make_key([0.0, 0.25], "medium", "de", {"fp16": True}))
+        self.assertNotEqual(key, self.cache.make_key([0.0, 0.5], "small", "de", {"fp16": True}))
+        self.assertNotEqual(key, self.cache.make_key([0.0, 0.5], "medium", "en", {"fp16": True}))
+        self.assertNotEqual(key, self.cache.make_key([0.0, 0.5], "medium", "de", {"fp16": False}))
+
+    def test_second_run_skips_model(self):
+        lines = [(uid, [0.1 * uid] * (uid * 11)) for uid in range(1, 41)]
+        first = BatchTranscriber(StubWhisper(), cache=self.cache, model_name="stub").transcribe_all(lines)
+        stub = StubWhisper()
+        second = BatchTranscriber(stub, cache=self.cache, model_name="stub").transcribe_all(lines)
+        self.assertEqual(stub.calls, 0)
+        self.assertEqual(first, second)
+        self.assertEqual((self.cache.hits, self.cache.misses), (40, 40))
+
+    def test_eviction_keeps_recent(self):
+        self.cache.max_bytes = 2000
+        for i in range(50):
+            self.cache.put(f"key{i}", {"text": "x" * 100})
+        self.assertGreater(self.cache.evicted, 0)
+        self.assertLessEqual(self.cache.stats()['size_mb'] * 1024 * 1024, 2000)
+        self.assertIsNone(self.cache.get("key0"))
+        self.assertEqual(self.cache.get("key49"), {"text": "x" * 100})
+
+    def test_second_connection_is_not_locked(self):
+        self.cache.put("first", {"text": "a"})
+        self.assertEqual(self.cache.get("first"), {"text": "a"})  # a hit leaves no transaction open either
+        other = TranscriptionCache(self.cache.path)
+        other.db.execute("PRAGMA busy_timeout = 0")  # fail right away instead of waiting for a lock
+        try:
+            other.put("second", {"text": "b"})
+            self.assertEqual(other.get("first"), {"text": "a"})
+            self.assertEqual(self.cache.get("second"), {"text": "b"})
+        finally:
+            other.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
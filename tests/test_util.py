@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+
+import os
+import sys
+import wave
+import tempfile
+import unittest
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import util
+
+try:
+    import numpy
+except ImportError:  # comes with whisper
+    numpy = None
+
+Segment = namedtuple("Segment", ("start", "end"))
+
+
+class FakeAnnotation:
+    """Just the part of pyannote.core.Annotation that annotation2dict touches"""
+    def __init__(self, tracks):
+        self.tracks = tracks
+
+    def itertracks(self, yield_label=False):
+        return iter(self.tracks)
+
+
+class TestDiarizationOutput(unittest.TestCase):
+    dump = ("[ 00:00:01.240 -->  00:00:03.062] A SPEAKER_00\n"
+            "\n"
+            "this is not a segment\n"
+            "[ 00:01:04.5 -->  01:00:05.661] B SPEAKER_01\r\n"
+            "[ broken -->  00:00:05.661] C SPEAKER_01\n")
+
+    def test_parser_skips_garbage(self):
+        self.assertEqual(util.pipelinetxt2dict(self.dump), [
+            {"start_ms": 1240, "stop_ms": 3062, "speaker_id": "SPEAKER_00"},
+            {"start_ms": 64500, "stop_ms": 3605661, "speaker_id": "SPEAKER_01"}
+        ])
+
+    def test_parser_string_mode(self):
+        parsed = util.pipelinetxt2dict(self.dump, mode=1)
+        self.assertEqual((parsed[0]['start_ms'], parsed[0]['stop_ms']), ("00:00:01.240", "00:00:03.062"))
+
+    def test_annotation_tracks(self):
+        annotation = FakeAnnotation([(Segment(1.2399999, 3.062), "A", "SPEAKER_00"),
+                                     (Segment(4.5, 5.0), "B", "SPEAKER_01")])
+        self.assertEqual(list(util.annotation2dict(annotation)), [
+            {"start_ms": 1240, "stop_ms": 3062, "speaker_id": "SPEAKER_00"},
+            {"start_ms": 4500, "stop_ms": 5000, "speaker_id": "SPEAKER_01"}
+        ])
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestSliceSamples(unittest.TestCase):
+    def setUp(self):
+        self.samples = numpy.arange(util.SAMPLE_RATE * 2, dtype=numpy.float32)  # every sample is its own index
+
+    def test_bounds(self):
+        self.assertEqual(len(util.slice_samples(self.samples, -500, 1000)), util.SAMPLE_RATE)
+        self.assertEqual(util.slice_samples(self.samples, -500, 1000)[0], 0)
+        tail = util.slice_samples(self.samples, 1500, 9000)
+        self.assertEqual((len(tail), tail[-1]), (util.SAMPLE_RATE // 2, len(self.samples) - 1))
+        self.assertEqual(len(util.slice_samples(self.samples, 1000, 1000)), 0)
+        self.assertEqual(len(util.slice_samples(self.samples, 1000, 400)), 0)
+        self.assertEqual(len(util.slice_samples(self.samples, 5000, 6000)), 0)
+
+    def test_rounding(self):
+        part = util.slice_samples(self.samples, 1, 3)  # 16 samples per millisecond
+        self.assertEqual((part[0], len(part)), (16, 32))
+        self.assertEqual(util.slice_samples(self.samples, 10.9, 20)[0], 160)  # fractions of a ms get cut off
+        self.assertEqual(len(util.slice_samples(self.samples, 0, 1, sample_rate=44100)), 44)
+        self.assertIs(util.slice_samples(self.samples, 0, 10).base, self.samples)  # a view, not a copy
+
+    def test_speech_samples(self):
+        lines = [{"start_ms": 0, "stop_ms": 250, "speaker_id": "A"}, {"start_ms": 1990, "stop_ms": 2500, "speaker_id": "B"}]
+        parts = util.speech_samples("unused.wav", lines, samples=self.samples)
+        self.assertEqual([len(each['samples']) for each in parts], [4000, 160])
+        self.assertEqual([each['speaker_id'] for each in parts], ["A", "B"])
+
+
+class TestAudioFiles(unittest.TestCase):
+    def test_directory_and_glob(self):
+        with tempfile.TemporaryDirectory() as folder:
+            os.mkdir(os.path.join(folder, "day2"))
+            for name in ("b.WAV", "a.mp3", "notes.txt", os.path.join("day2", "c.flac")):
+                open(os.path.join(folder, name), "wb").close()
+            self.assertEqual(util.audio_files(folder), [os.path.join(folder, "a.mp3"), os.path.join(folder, "b.WAV")])
+            self.assertEqual(util.audio_files(os.path.join(folder, "**", "*.flac")),
+                             [os.path.join(folder, "day2", "c.flac")])
+            self.assertEqual(util.audio_files(os.path.join(folder, "nothing*")), [])
+
+
+class TestProjectTable(unittest.TestCase):
+    def test_rows(self):
+        projects = [{"uid": 1, "given_name": "x" * 30, "status": 2, "file_path": "a.wav"}, {"uid": 2, "status": 4}]
+        rows = list(util.project_table_rows(projects, columns=("uid", "given_name", "status", "file_path")))
+        self.assertEqual(rows[0], [1, util.shorten_left_pad("x" * 30, 24), "Transcribed", "a.wav"])
+        self.assertEqual(rows[1], [2, "", "Unknown", ""])
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestStems(unittest.TestCase):
+    def test_one_pass_stems(self):
+        samples = numpy.full(util.SAMPLE_RATE * 3, 0.5, dtype=numpy.float32)
+        segments = [{"start_ms": 0, "stop_ms": 1000, "speaker_id": "A"},
+                    {"start_ms": 1000, "stop_ms": 2000, "speaker_id": "B"},
+                    {"start_ms": 2500, "stop_ms": 9000, "speaker_id": "A"}]  # longer than the audio
+        with tempfile.TemporaryDirectory() as work_dir:
+            stems = util.export_speaker_stems(samples, iter(segments),
+                                              lambda speaker: os.path.join(work_dir, f"{speaker}.wav"))
+            self.assertEqual(set(stems), {"A", "B"})
+            with wave.open(stems['A'], "rb") as wav:
+                self.assertEqual((wav.getnchannels(), wav.getsampwidth(), wav.getframerate()),
+                                 (1, 2, util.SAMPLE_RATE))
+                pcm = numpy.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+            self.assertEqual(len(pcm), len(samples))
+            second = util.SAMPLE_RATE
+            self.assertTrue((pcm[:second] == 16383).all())
+            self.assertTrue((pcm[second:second * 5 // 2] == 0).all())
+            self.assertTrue((pcm[second * 5 // 2:] == 16383).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
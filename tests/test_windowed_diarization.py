@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from util import SAMPLE_RATE
+from windowed_diarization import SpeakerLinker, diarize_windowed
+
+TOTAL_MS = 10 * 60 * 1000
+# ground truth, three people taking turns every four seconds
+TRUTH = [{"start_ms": i * 4000, "stop_ms": i * 4000 + 3500, "speaker_id": "ABC"[i % 3]}
+         for i in range(TOTAL_MS // 4000)]
+
+
+class Window:
+    """Pretends to be decoded samples, only the length matters"""
+    def __init__(self, start_ms: int, duration_ms: int):
+        self.start_ms = start_ms
+        self.num = max(0, min(duration_ms, TOTAL_MS - start_ms)) * SAMPLE_RATE // 1000
+
+    def __len__(self):
+        return self.num
+
+
+class FakePipeline:
+    """Knows the truth, but like pyannote it names everybody differently in every window"""
+    def __init__(self):
+        self.window = 0
+
+    def __call__(self, samples: Window):
+        stop_ms = samples.start_ms + len(samples) * 1000 // SAMPLE_RATE
+        shift = self.window
+        self.window += 1
+        segments = []
+        for each in TRUTH:
+            start, stop = max(each['start_ms'], samples.start_ms), min(each['stop_ms'], stop_ms)
+            if stop > start:
+                label = f"LOCAL_{('ABC'.index(each['speaker_id']) + shift) % 3}"
+                segments.append({"start_ms": start - samples.start_ms, "stop_ms": stop - samples.start_ms,
+                                 "speaker_id": label})
+        return segments, {}
+
+
+class TestWindowedDiarization(unittest.TestCase):
+    def test_labels_stay_consistent(self):
+        segments = list(diarize_windowed("fake.wav", window_ms=3 * 60 * 1000, overlap_ms=40 * 1000,
+                                         load_window=lambda _, start, duration: Window(start, duration),
+                                         diarize_window=FakePipeline()))
+        names = {}
+        covered = 0
+        for each in segments:
+            truth = next(t for t in TRUTH if t['start_ms'] <= each['start_ms'] and each['stop_ms'] <= t['stop_ms'])
+            self.assertEqual(names.setdefault(truth['speaker_id'], each['speaker_id']), each['speaker_id'])
+            covered += each['stop_ms'] - each['start_ms']
+        self.assertEqual(len(set(names.values())), 3)
+        self.assertEqual(covered, sum(t['stop_ms'] - t['start_ms'] for t in TRUTH))
+        self.assertEqual(segments, sorted(segments, key=lambda x: x['start_ms']))
+
+    def test_window_ends_with_file(self):
+        segments = list(diarize_windowed("fake.wav", window_ms=TOTAL_MS, overlap_ms=1000,
+                                         load_window=lambda _, start, duration: Window(start, duration),
+                                         diarize_window=FakePipeline()))
+        self.assertEqual(len(segments), len(TRUTH))
+
+    def test_embeddings_link_silent_speakers(self):
+        linker = SpeakerLinker()
+        first = linker.link([{"start_ms": 0, "stop_ms": 1000, "speaker_id": "X"},
+                             {"start_ms": 1000, "stop_ms": 2000, "speaker_id": "Y"}],
+                            [], (0, 0), {"X": [1.0, 0.0, 0.1], "Y": [0.0, 1.0, 0.1]})
+        # Y did not say anything in the overlap, only the embedding can tell who it is
+        second = linker.link([{"start_ms": 5000, "stop_ms": 6000, "speaker_id": "A"},
+                              {"start_ms": 9000, "stop_ms": 9500, "speaker_id": "B"}],
+                             [{"start_ms": 4000, "stop_ms": 7000, "speaker_id": first['X']}], (4000, 8000),
+                             {"A": [0.2, 0.0, 0.0], "B": [0.1, 0.9, 0.0]})
+        self.assertEqual(second, {"A": first['X'], "B": first['Y']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright 2023 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of TransCrypt.
+#
+# TransCrypt is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# TransCrypt is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import unittest
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+logging.basicConfig(filename=os.devnull)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from db_util import CryptDB
+from worker import JobWorker
+
+
+class TestJobWorker(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.work_dir.name, "queue.db")
+        self.db = CryptDB(self.db_file)
+
+    def tearDown(self):
+        self.db.close()
+        self.work_dir.cleanup()
+
+    def test_workers_share_the_queue(self):
+        for i in range(40):
+            self.db.enqueue_job(f"{i}.wav")
+        processed = []
+        lock = threading.Lock()
+
+        def process(backend, job, name):
+            with lock:
+                processed.append(job['uid'])
+            if job['file_path'] == "13.wav":
+                raise RuntimeError("broken file")
+
+        workers = [JobWorker(self.db_file, process, name=f"worker{i}", poll_s=0.01) for i in range(4)]
+        threads = [threading.Thread(target=each.run, kwargs={"drain": True}) for each in workers]
+        for each in threads:
+            each.start()
+        for each in threads:
+            each.join()
+        self.assertEqual(sorted(processed), list(range(1, 41)))  # every job exactly once
+        self.assertEqual(sum(each.done for each in workers), 39)
+        failed = self.db.list_jobs(status=3)
+        self.assertEqual([each['file_path'] for each in failed], ["13.wav"])
+        self.assertIn("broken file", failed[0]['error'])
+
+    def test_expired_lease_gets_claimed_again(self):
+        job_id = self.db.enqueue_job("a.wav")
+        self.assertEqual(self.db.claim_job("dead", lease_s=-1)['uid'], job_id)
+        seen = []
+        worker = JobWorker(self.db_file, lambda backend, job, name: seen.append(job['attempts']), name="alive")
+        self.assertEqual(worker.run(drain=True), 1)
+        self.assertEqual(seen, [2])
+        self.assertEqual(self.db.fetch_job(job_id)['worker'], "alive")
+
+    def test_locked_database_is_no_lost_lease(self):
+        self.db.enqueue_job("a.wav")
+        real = CryptDB.renew_job
+        answers = [None, None]  # twice locked for longer than the timeout, then it works again
+
+        def renew(backend, *args):
+            return answers.pop(0) if answers else real(backend, *args)
+
+        worker = JobWorker(self.db_file, lambda backend, job, name: time.sleep(0.6), lease_s=0.3)
+        with mock.patch.object(CryptDB, "renew_job", renew):
+            self.assertEqual(worker.run(drain=True), 1)
+        self.assertEqual((worker.lost, answers), (0, []))
+        self.assertEqual(self.db.list_jobs(status=2)[0]['file_path'], "a.wav")
+
+    def test_lost_lease_aborts_the_job(self):
+        job_id = self.db.enqueue_job("a.wav")
+        steps = []
+
+        def process(backend, job, name):
+            # somebody else claimed it, eg. after this worker hung for longer than the lease
+            self.db.cur.execute("UPDATE job SET worker = 'thief' WHERE uid = ?", (job_id,))
+            self.db.db.commit()
+            for _ in range(300):
+                steps.append(1)
+                time.sleep(0.01)
+
+        worker = JobWorker(self.db_file, process, lease_s=0.3)
+        self.assertEqual(worker.run(drain=True), 0)
+        self.assertEqual((worker.lost, worker.failed), (1, 0))
+        self.assertLess(len(steps), 300)
+        job = self.db.fetch_job(job_id)
+        self.assertEqual((job['worker'], job['status']), ("thief", 1))  # its result is not ours to write
+
+
+if __name__ == '__main__':
+    unittest.main()